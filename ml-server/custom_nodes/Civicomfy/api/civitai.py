@@ -5,6 +5,16 @@ import requests
 import json
 from typing import List, Optional, Dict, Any, Union
 
+from ..utils.http_pool import get_session
+from ..utils.ttl_cache import TTLCache
+from ..config import CIVITAI_CACHE_TTL, CIVITAI_CACHE_SIZE
+
+# Shared by all CivitaiAPI instances; keyed by (kind, id, api key) since the key can change visibility
+metadata_cache = TTLCache(maxsize=CIVITAI_CACHE_SIZE, ttl=CIVITAI_CACHE_TTL)
+
+def _is_cacheable(result) -> bool:
+    return isinstance(result, dict) and "error" not in result
+
 class CivitaiAPI:
     """Simple wrapper for interacting with the Civitai API v1."""
     BASE_URL = "https://civitai.com/api/v1"
@@ -34,7 +44,7 @@ class CivitaiAPI:
         request_headers = self._get_request_headers(method, json_data is not None)
 
         try:
-            response = requests.request(
+            response = get_session(url).request(
                 method,
                 url,
                 headers=request_headers,
@@ -77,18 +87,20 @@ class CivitaiAPI:
             return {"error": "Invalid JSON response", "details": response_text, "status_code": response.status_code if hasattr(response, 'status_code') else None}
 
     def get_model_info(self, model_id: int) -> Optional[Dict[str, Any]]:
-        """Gets information about a model by its ID. (GET /models/{id})"""
+        """Gets information about a model by its ID. (GET /models/{id}, cached)"""
         endpoint = f"/models/{model_id}"
-        result = self._request("GET", endpoint)
+        result = metadata_cache.get_or_load(("model", int(model_id), self.api_key),
+                                            lambda: self._request("GET", endpoint), cache_if=_is_cacheable)
         # Check if the result is an error dictionary
         if isinstance(result, dict) and "error" in result:
             return result # Propagate error dict
         return result # Return model info dict or None
 
     def get_model_version_info(self, version_id: int) -> Optional[Dict[str, Any]]:
-        """Gets information about a specific model version by its ID. (GET /model-versions/{id})"""
+        """Gets information about a specific model version by its ID. (GET /model-versions/{id}, cached)"""
         endpoint = f"/model-versions/{version_id}"
-        result = self._request("GET", endpoint)
+        result = metadata_cache.get_or_load(("version", int(version_id), self.api_key),
+                                            lambda: self._request("GET", endpoint), cache_if=_is_cacheable)
         if isinstance(result, dict) and "error" in result:
             return result
         return result
@@ -214,7 +226,7 @@ class CivitaiAPI:
 
         try:
             # print(f"DEBUG: Meili Search Payload: {json.dumps(payload, indent=2)}") # Debugging payload
-            response = requests.post(meili_url, headers=headers, json=payload, timeout=25) # Use reasonable timeout
+            response = get_session(meili_url).post(meili_url, headers=headers, json=payload, timeout=25) # Use reasonable timeout
             response.raise_for_status()
 
             results_data = response.json()
@@ -12,6 +12,28 @@ DOWNLOAD_HISTORY_LIMIT = 100
 DOWNLOAD_TIMEOUT = 60 # Timeout for individual download chunks/requests (seconds)
 HEAD_REQUEST_TIMEOUT = 25 # Timeout for initial HEAD request (seconds)
 METADATA_DOWNLOAD_TIMEOUT = 20 # Timeout for downloading thumbnail (seconds)
+RESUMABLE_DOWNLOADS = True # Keep segment parts + journal on failure so a retry only fetches missing bytes
+RESUME_VERIFY_HASH = False # Also re-hash partial parts on resume (reads every kept part once)
+JOURNAL_SAVE_INTERVAL = 2.0 # Min seconds between segment journal writes
+PREALLOCATE_OUTPUT = True # Multi-connection: write segments in place into one preallocated file (no part merge)
+HTTP_POOL_MAXSIZE = 32 # Keep-alive connections kept per host (>= concurrent downloads x connections)
+HTTP_RETRY_TOTAL = 3 # Adapter-level retries for connect errors / 429 / 5xx on GET and HEAD
+HTTP_RETRY_BACKOFF = 0.5 # Backoff factor (seconds) between adapter retries
+DOWNLOAD_ENGINE = "async" # "async": downloads run as tasks on ComfyUI's event loop; "threads": thread per download/connection
+ASYNC_MAX_CONNECTIONS = MAX_CONCURRENT_DOWNLOADS * DEFAULT_CONNECTIONS # Async engine: open connections shared by all downloads
+ASYNC_IO_WORKERS = 4 # Async engine: threads doing file writes, journal saves and merges off the event loop
+CIVITAI_CACHE_TTL = 300 # Seconds model/version info from the Civitai API is reused (details -> download flow)
+CIVITAI_CACHE_SIZE = 256 # Max cached model/version responses
+VERIFY_DOWNLOAD_HASH = True # Hash downloads as they stream; a mismatch with Civitai's SHA256/CRC32 fails the download
+DEDUPE_EXISTING_MODELS = True # Reuse a file already on disk (same SHA256 / version+file) instead of downloading it again
+DEDUPE_LINK_MODES = ("reflink", "hardlink", "copy") # Tried in order when reusing a local file
+MODEL_INDEX_RESCAN_INTERVAL = 3600 # Seconds before a model root is rescanned for .cminfo.json files
+DIR_INDEX_MAX_ENTRIES = 5000 # Max directories listed per model root in the directory picker
+DIR_INDEX_REVALIDATE_INTERVAL = 10 # Seconds before a cached directory tree is re-checked (by directory mtime, in the background)
+USE_SHARED_SCHEDULER = True # Take connections/bandwidth from custom_nodes/download_scheduler.py (shared with other download nodes)
+DEFAULT_DOWNLOAD_PRIORITY = "normal" # "low" | "normal" | "high" (or an int); higher-priority downloads preempt lower ones
+BATCH_RESOLVE_CONCURRENCY = 8 # Batch downloads: Civitai lookups/existence checks run this many at a time
+BATCH_HISTORY_LIMIT = 50 # Batch downloads remembered for aggregate progress (GET /civitai/download/batch/{id})
 
 # --- Paths ---
 # The root directory of *this specific plugin/extension*
@@ -0,0 +1,448 @@
+# ================================================
+# File: downloader/async_engine.py
+# ================================================
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Callable, Any
+
+import aiohttp
+
+from .chunk_downloader import ChunkDownloader
+from ..utils.http_pool import session_pool
+from ..config import ASYNC_MAX_CONNECTIONS, ASYNC_IO_WORKERS
+
+
+def _stats_trace_config() -> aiohttp.TraceConfig:
+    """Feeds aiohttp requests / new connections into the shared per-host HTTP stats."""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.stats = session_pool.host_stats(str(params.url))
+        ctx.stats.record_request()
+
+    async def on_connection_create_end(session, ctx, params):
+        stats = getattr(ctx, "stats", None)
+        if stats is not None:
+            stats.record_new_connection()
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+class AsyncDownloadEngine:
+    """Shared state for downloads running as tasks on one event loop (ComfyUI's server loop).
+
+    One aiohttp session whose connector bounds the open connections of all downloads
+    together, plus a small thread pool that keeps file I/O off the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_connections: int = ASYNC_MAX_CONNECTIONS,
+                 io_workers: int = ASYNC_IO_WORKERS):
+        self.loop = loop
+        self.max_connections = max(1, max_connections)
+        self.io_executor = ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix="civicomfy-io")
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Returns the engine's session, creating it on the loop on first use."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=0, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[_stats_trace_config()])
+        return self._session
+
+    def close(self):
+        """Closes the session (if the loop still runs) and stops the I/O threads."""
+        session, self._session = self._session, None
+        if session is not None and not session.closed and not self.loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(session.close(), self.loop)
+            except RuntimeError:
+                pass
+        self.io_executor.shutdown(wait=False)
+
+
+class _SerialSink:
+    """Opens a file lazily and serializes writes and the final close across I/O threads.
+
+    A task cancelled mid-write leaves its write running in the pool; the close it
+    submits afterwards must not run concurrently with (or before) that write.
+    """
+
+    def __init__(self, opener: Callable[[], Any], writer: Callable[[Any, bytes], int]):
+        self._opener = opener
+        self._writer = writer
+        self._lock = threading.Lock()
+        self._file = None
+        self._closed = False
+
+    def write(self, chunk: bytes) -> int:
+        with self._lock:
+            if self._closed:
+                return 0
+            if self._file is None:
+                self._file = self._opener()
+            return self._writer(self._file, chunk)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class AsyncChunkDownloader(ChunkDownloader):
+    """ChunkDownloader running as coroutines on the engine's loop instead of threads.
+
+    Ranges are pulled from the same work-stealing queue by worker tasks; file writes,
+    journal saves and the final merge/rename run in the engine's I/O pool.
+    """
+
+    def __init__(self, *args, engine: AsyncDownloadEngine, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine = engine
+        self._tasks = set()
+        self._io_pending = set()
+        self._io_lock = threading.Lock()
+
+    def cancel(self):
+        """Signal the download to cancel and interrupt tasks waiting on the network."""
+        was_cancelled = self.is_cancelled
+        super().cancel()
+        if not was_cancelled:
+            try:
+                self.engine.loop.call_soon_threadsafe(self._cancel_tasks)
+            except RuntimeError:
+                pass  # Loop already closed (shutdown)
+
+    def _cancel_tasks(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = self.engine.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if self.is_cancelled:
+            task.cancel()
+        return task
+
+    # --- Offloaded file I/O ---
+    def _submit_io(self, fn, *args):
+        """Runs fn in the I/O pool without waiting; _drain_io() waits for it."""
+        future = self.engine.io_executor.submit(fn, *args)
+        with self._io_lock:
+            self._io_pending.add(future)
+        future.add_done_callback(self._io_done)
+        return future
+
+    def _io_done(self, future):
+        with self._io_lock:
+            self._io_pending.discard(future)
+
+    async def _io(self, fn, *args):
+        return await asyncio.wrap_future(self._submit_io(fn, *args))
+
+    # --- Shared download scheduler ---
+    async def _acquire_connection_async(self) -> bool:
+        job = self._sched_job
+        return job is None or await job.acquire_async(should_stop=lambda: self.is_cancelled)
+
+    async def _throttle_async(self, nbytes: int):
+        if self._sched_job is not None:
+            await self._sched_job.throttle_async(nbytes)
+
+    async def _drain_io(self):
+        """Waits for writes still running in the pool (e.g. from cancelled tasks)."""
+        while True:
+            with self._io_lock:
+                pending = list(self._io_pending)
+            if not pending:
+                return
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending), return_exceptions=True)
+
+    # --- Network ---
+    async def _get_range_support_and_url_async(self) -> Tuple[str, bool]:
+        """Check for range support and get final URL after redirects."""
+        print(f"[Downloader {self.download_id}] Checking range support/redirects for: {self.initial_url} (Timeout: {self.HEAD_REQUEST_TIMEOUT}s)")
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.HEAD_REQUEST_TIMEOUT, sock_read=self.HEAD_REQUEST_TIMEOUT)
+        try:
+            session = await self.engine.get_session()
+            async with session.head(self.initial_url, allow_redirects=True, timeout=timeout,
+                                    headers=self._get_request_headers()) as response:
+                response.raise_for_status()
+
+                # Update URL after redirects
+                final_url = str(response.url)
+                self.url = final_url
+
+                # Check range support
+                supports_ranges = response.headers.get('accept-ranges', 'none').lower() == 'bytes'
+
+                # Get file size if not already known
+                if self.total_size <= 0:
+                    head_size = int(response.headers.get('Content-Length', 0))
+                    if head_size > 0:
+                        self.total_size = head_size
+                        print(f"[Downloader {self.download_id}] Got file size from HEAD: {self.total_size} bytes")
+
+            print(f"[Downloader {self.download_id}] HEAD Check OK - Final URL: {final_url}, Range Support: {supports_ranges}")
+            return final_url, supports_ranges
+
+        except asyncio.TimeoutError:
+            print(f"[Downloader {self.download_id}] Warning: HEAD request timed out. Proceeding with Single connection.")
+        except aiohttp.ClientResponseError as e:
+            print(f"[Downloader {self.download_id}] Warning: HEAD request failed (Status Code: {e.status}). Proceeding with Single connection.")
+        except aiohttp.ClientError:
+            print(f"[Downloader {self.download_id}] Warning: HEAD request failed. Proceeding with Single connection.")
+        except Exception as e:
+            print(f"[Downloader {self.download_id}] Warning: Unexpected error during HEAD request: {e}. Proceeding with Single connection.")
+        return self.initial_url, False
+
+    def _stream_timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.DOWNLOAD_TIMEOUT, sock_read=self.DOWNLOAD_TIMEOUT)
+
+    async def download_segment_async(self, segment_index: int) -> Optional[bool]:
+        """Async counterpart of download_segment(): one attempt at a range's missing bytes."""
+        segment = self.segments[segment_index]
+
+        if self.is_cancelled:
+            if not self.error: self.error = "Cancelled during segment download"
+            return False
+
+        # Only request the bytes this range is still missing
+        resume_from = segment["written"]
+        start_byte = segment["start"]
+        if resume_from >= segment["end"] - start_byte + 1:
+            return True
+        request_headers = self._get_request_headers(add_range=f'bytes={start_byte + resume_from}-{segment["end"]}')
+
+        sink = _SerialSink(
+            lambda: self._open_segment_sink(segment_index, start_byte + resume_from),
+            lambda f, chunk: self._write_segment_chunk(f, segment_index, chunk),
+        )
+        try:
+            session = await self.engine.get_session()
+            async with session.get(self.url, headers=request_headers, timeout=self._stream_timeout()) as response:
+                response.raise_for_status()
+                if response.status != 206:
+                    raise ValueError(f"Server ignored Range request (Status {response.status})")
+
+                # Reads return whatever arrived; batch them so each pool write is one full chunk
+                buffer = bytearray()
+                async for data in response.content.iter_chunked(self.chunk_size):
+                    if self.is_cancelled:
+                        print(f"[Downloader {self.download_id}] Segment {segment_index} cancelled mid-stream.")
+                        if not self.error: self.error = "Cancelled during segment download"
+                        return False
+                    buffer += data
+                    while len(buffer) >= self.chunk_size:
+                        await self._io(sink.write, bytes(buffer[:self.chunk_size]))
+                        del buffer[:self.chunk_size]
+                    await self._throttle_async(len(data))
+                    if self._segment_remaining(segment) <= 0:
+                        break
+                    if self._should_yield():
+                        print(f"[Downloader {self.download_id}] Segment {segment_index} yielding its connection to a higher-priority download.")
+                        if buffer:
+                            await self._io(sink.write, bytes(buffer))
+                        return None
+                if buffer and self._segment_remaining(segment) > 0:
+                    await self._io(sink.write, bytes(buffer))
+
+            # Verify range size
+            if self._segment_remaining(segment) != 0:
+                expected_size = segment["end"] - start_byte + 1
+                raise ValueError(f"Size mismatch. Expected {expected_size}, got {segment['written']}")
+
+            return True  # Success
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            error_msg_detail = f"{e}" or type(e).__name__
+
+            if isinstance(e, aiohttp.ClientResponseError):
+                if e.status == 401:
+                    error_msg_detail += " (Unauthorized)"
+                elif e.status == 403:
+                    error_msg_detail += " (Forbidden)"
+                elif e.status == 416:
+                    error_msg_detail += " (Range Not Satisfiable)"
+                    self.error = f"Segment {segment_index} failed: {error_msg_detail}"
+                    self.cancel()
+                    return False
+
+            attempt = self._range_attempts.get(segment_index, 0) + 1
+            print(f"[Downloader {self.download_id}] Warning: Segment {segment_index} failed "
+                  f"(Try {attempt}/{self.RANGE_MAX_ATTEMPTS}), requeueing: {error_msg_detail}")
+            return False
+
+        except Exception as e:
+            self.error = f"Segment {segment_index} critical error: {e}"
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            self.cancel()
+            return False
+
+        finally:
+            self._submit_io(sink.close)
+
+    async def _range_worker_async(self):
+        """Pulls ranges from the shared queue until the file is complete or the download stops."""
+        while not self.is_cancelled:
+            if not await self._acquire_connection_async():
+                return
+            try:
+                index = self._next_range()
+                if index is None:
+                    return
+                completed = False
+                try:
+                    completed = await self.download_segment_async(index)
+                finally:
+                    back_off = self._finish_range(index, completed)
+            finally:
+                self._release_connection()
+            if back_off:
+                attempts = self._range_attempts.get(index, 1)
+                await asyncio.sleep(min(2 ** (attempts - 1), 10))  # cancel() interrupts the sleep
+
+    async def _do_multi_connection_download_async(self) -> bool:
+        """Handle multi-connection download process with worker tasks."""
+        if not await self._io(self._prepare_multi_connection):
+            return False
+
+        workers = [self._spawn(self._range_worker_async()) for _ in range(self._worker_count())]
+        await asyncio.gather(*workers, return_exceptions=True)
+        await self._drain_io()
+        return await self._io(self._complete_multi_connection)
+
+    def _write_fallback_chunk(self, f, chunk: bytes) -> int:
+        bytes_written = f.write(chunk)
+        if self._inline_hasher is not None:
+            self._inline_hasher.update(chunk[:bytes_written])
+        self._update_progress(bytes_written)
+        return bytes_written
+
+    def _open_fallback_output(self):
+        # Ensure output directory exists
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        return self._open_output_for_write()
+
+    async def fallback_download_async(self) -> bool:
+        """Async counterpart of fallback_download(): one plain GET streamed to the output file."""
+        self.connection_type = "Single"
+        if self.manager and self.download_id:
+            self.manager._update_download_status(self.download_id, connection_type=self.connection_type, status="downloading")
+
+        print(f"[Downloader {self.download_id}] Using standard single-connection download for {self.output_path.name}...")
+
+        self._start_time = self._start_time or time.monotonic()
+        self._last_update_time = self._start_time
+        self._last_downloaded_bytes = 0
+        self.downloaded = 0
+        self._inline_hasher = self._new_hasher()
+
+        sink = _SerialSink(self._open_fallback_output, self._write_fallback_chunk)
+        # A plain GET can't be resumed elsewhere, so it keeps its connection slot until done
+        if not await self._acquire_connection_async():
+            return False
+        try:
+            session = await self.engine.get_session()
+            async with session.get(self.url, allow_redirects=True, timeout=self._stream_timeout(),
+                                   headers=self._get_request_headers()) as response:
+                response.raise_for_status()
+
+                # Update URL after potential redirects
+                final_get_url = str(response.url)
+                if final_get_url != self.url:
+                    print(f"[Downloader {self.download_id}] URL redirected during GET to: {final_get_url}")
+                    self.url = final_get_url
+
+                # Get/confirm file size
+                if self.total_size <= 0:
+                    get_size = int(response.headers.get('Content-Length', 0))
+                    if get_size > 0:
+                        self.total_size = get_size
+                        print(f"[Downloader {self.download_id}] Obtained file size via fallback GET: {self.total_size}")
+                    else:
+                        print(f"[Downloader {self.download_id}] Warning: File size unknown. Progress may be inaccurate.")
+
+                buffer = bytearray()
+                async for data in response.content.iter_chunked(self.chunk_size):
+                    if self.is_cancelled:
+                        print(f"[Downloader {self.download_id}] Fallback download cancelled.")
+                        return False
+                    buffer += data
+                    await self._throttle_async(len(data))
+                    if len(buffer) >= self.chunk_size:
+                        await self._io(sink.write, bytes(buffer))
+                        buffer.clear()
+                # Writing even an empty remainder creates the output file for empty downloads
+                await self._io(sink.write, bytes(buffer))
+
+            # Verify download size if known
+            if self.total_size > 0 and self.downloaded != self.total_size and not self.error:
+                print(f"[Downloader {self.download_id}] Warning: Size mismatch. Expected {self.total_size}, got {self.downloaded}.")
+            if self._inline_hasher is not None and not self._check_hashes(self._inline_hasher.hexdigests()):
+                return False
+
+            print(f"[Downloader {self.download_id}] Fallback download completed.")
+            return not self.error
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_msg_detail = f"{e}" or type(e).__name__
+            if isinstance(e, aiohttp.ClientResponseError):
+                if e.status == 401:
+                    error_msg_detail += " (Unauthorized - Check API Key?)"
+                elif e.status == 403:
+                    error_msg_detail += " (Forbidden - Permissions Issue?)"
+
+            if not self.error:
+                self.error = f"Fallback download failed: {error_msg_detail}"
+            print(f"[Downloader {self.download_id}] Error during fallback download: {self.error}")
+            return False
+
+        except Exception as e:
+            if not self.error:
+                self.error = f"Fallback download failed: {e}"
+            print(f"[Downloader {self.download_id}] Error during fallback download: {self.error}")
+            return False
+
+        finally:
+            self._release_connection()
+            self._submit_io(sink.close)
+
+    async def download_async(self) -> bool:
+        """Async counterpart of download(); must run on the engine's loop."""
+        await self._io(self._begin_attempt)
+        success = False
+
+        # Check range support and get final URL
+        final_url, supports_ranges = await self._get_range_support_and_url_async()
+
+        try:
+            if self._use_multi_connection(supports_ranges):
+                success = await self._do_multi_connection_download_async()
+            else:
+                # Run as a tracked task so cancel() can interrupt a stalled read
+                results = await asyncio.gather(self._spawn(self.fallback_download_async()), return_exceptions=True)
+                success = results[0] is True
+                if not success and not self.error:
+                    self.error = "Single connection download failed."
+
+        except asyncio.CancelledError:
+            # The download task itself was cancelled (e.g. shutdown)
+            self.cancel()
+            raise
+
+        except Exception as e:
+            self._handle_unexpected_error(e)
+            success = False
+
+        finally:
+            await self._drain_io()
+            await self._io(self._end_attempt, success)
+
+        return success and not self.error and not self.is_cancelled
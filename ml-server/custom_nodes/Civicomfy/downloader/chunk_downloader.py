@@ -7,16 +7,59 @@ import requests
 import threading
 import time
 import shutil
+import hashlib
+import errno
+from collections import deque
+import json
 from pathlib import Path
 import os
-from typing import Optional, Dict, Tuple, Union, TYPE_CHECKING
+from typing import Optional, Dict, Tuple, Union, Any, TYPE_CHECKING
 
 # Import manager type hint without circular dependency during type checking
 if TYPE_CHECKING:
     from .manager import DownloadManager
 
+from ..utils.http_pool import get_session
+from ..utils.shared_scheduler import get_scheduler_module
+from .hash_verify import MultiHasher, OrderedFileHasher, pick_algorithms, compare_hashes
+
 # Import config values
-from ..config import DEFAULT_CHUNK_SIZE, DOWNLOAD_TIMEOUT, HEAD_REQUEST_TIMEOUT
+from ..config import (
+    DEFAULT_CHUNK_SIZE, DOWNLOAD_TIMEOUT, HEAD_REQUEST_TIMEOUT,
+    RESUMABLE_DOWNLOADS, RESUME_VERIFY_HASH, JOURNAL_SAVE_INTERVAL, PREALLOCATE_OUTPUT,
+    VERIFY_DOWNLOAD_HASH, DEFAULT_DOWNLOAD_PRIORITY
+)
+
+JOURNAL_FILENAME = "journal.json"
+JOURNAL_VERSION = 1
+PREALLOCATED_DATA_FILENAME = "data"
+
+class _PositionalWriter:
+    """File-like sink writing a segment's bytes at increasing offsets of a shared fd (os.pwrite)."""
+
+    def __init__(self, fd: int, offset: int):
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        total = 0
+        while total < len(view):
+            total += os.pwrite(self.fd, view[total:], self.offset + total)
+        self.offset += total
+        return total
+
+    def flush(self):
+        pass  # pwrite bypasses userspace buffers
+
+    def close(self):
+        pass  # The shared fd is closed by the downloader
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
 
 class ChunkDownloader:
     """Handles downloading files in chunks using multiple connections or fallback."""
@@ -25,18 +68,32 @@ class ChunkDownloader:
     HEAD_REQUEST_TIMEOUT = HEAD_REQUEST_TIMEOUT
     DOWNLOAD_TIMEOUT = DOWNLOAD_TIMEOUT
     MIN_SIZE_FOR_MULTI_MB = 100  # Minimum file size for multi-connection download
+    RANGE_SIZE_MB = 32  # Work-queue range size; many small ranges keep all connections busy
+    MIN_STEAL_SIZE_MB = 4  # Don't split in-flight ranges with less than this left
+    RANGE_MAX_ATTEMPTS = 5  # Per-range attempts before the whole download fails
+    JOURNAL_SAVE_INTERVAL = JOURNAL_SAVE_INTERVAL
 
     def __init__(self, url: str, output_path: str, num_connections: int = 4,
                  chunk_size: int = DEFAULT_CHUNK_SIZE, manager: 'DownloadManager' = None,
                  download_id: str = None, api_key: Optional[str] = None,
-                 known_size: Optional[int] = None):
+                 known_size: Optional[int] = None, resumable: bool = RESUMABLE_DOWNLOADS,
+                 verify_resume_hash: bool = RESUME_VERIFY_HASH, preallocate: bool = PREALLOCATE_OUTPUT,
+                 expected_hashes: Optional[Dict[str, str]] = None, verify_hash: bool = VERIFY_DOWNLOAD_HASH,
+                 priority: Union[str, int, None] = None):
         # URLs
         self.initial_url = url
         self.url = url
         
         # Paths
         self.output_path = Path(output_path)
-        self.temp_dir = self.output_path.parent / f".{self.output_path.name}.parts_{download_id or int(time.time())}"
+        if resumable:
+            # Stable name so a later attempt for the same output path finds the parts + journal
+            self.temp_dir = self.resume_dir_for(output_path)
+        else:
+            self.temp_dir = self.output_path.parent / f".{self.output_path.name}.parts_{download_id or int(time.time())}"
+        self.journal_path = self.temp_dir / JOURNAL_FILENAME
+        # Preallocated mode: segments write in place into one file that is renamed on success
+        self.data_path = self.temp_dir / PREALLOCATED_DATA_FILENAME
         
         # Download configuration
         self.num_connections = max(1, num_connections)
@@ -45,6 +102,12 @@ class ChunkDownloader:
         self.download_id = download_id
         self.api_key = api_key
         self.known_size = known_size if known_size and known_size > 0 else None
+        self.resumable = resumable
+        self.verify_resume_hash = verify_resume_hash
+        self.preallocate = preallocate
+        self.expected_hashes = expected_hashes or {}  # Civitai file hashes ({"SHA256": ..., "CRC32": ...})
+        self.verify_hash = verify_hash
+        self.priority = priority if priority not in (None, "") else DEFAULT_DOWNLOAD_PRIORITY
         
         # Download state
         self.total_size = self.known_size or 0
@@ -57,6 +120,31 @@ class ChunkDownloader:
         self.lock = threading.Lock()
         self.cancel_event = threading.Event()
         self.part_files = []
+        self._output_fd: Optional[int] = None
+
+        # Segment journal state: {index: {"index", "start", "end", "written"}}
+        self.segments: Dict[int, Dict[str, Any]] = {}
+        self._segment_hashers: Dict[int, Any] = {}
+        self._journal_lock = threading.Lock()
+        self._last_journal_save = 0
+        self.resumed_bytes = 0
+
+        # Whole-file hashing while the download streams
+        self.hash_digests: Dict[str, str] = {}
+        self.hash_verified: Optional[bool] = None  # None: no expected hash to compare against
+        self._inline_hasher: Optional[MultiHasher] = None
+        self._ordered_hasher: Optional[OrderedFileHasher] = None
+        self._discard_parts = False
+
+        # Shared download scheduler job (connection slots, bandwidth, preemption); None if unavailable
+        self._sched_job = None
+
+        # Range scheduler state (guarded by self.lock)
+        self._pending_ranges = deque()
+        self._inflight_ranges = set()
+        self._range_started: Dict[int, Tuple[float, int]] = {}
+        self._range_attempts: Dict[int, int] = {}
+        self._next_segment_index = 0
         
         # Performance tracking
         self._start_time = 0
@@ -64,6 +152,17 @@ class ChunkDownloader:
         self._last_downloaded_bytes = 0
         self._speed = 0
 
+    @staticmethod
+    def resume_dir_for(output_path: Union[str, Path]) -> Path:
+        """Returns the parts directory used by resumable downloads of output_path."""
+        output_path = Path(output_path)
+        return output_path.parent / f".{output_path.name}.parts"
+
+    @classmethod
+    def has_resume_journal(cls, output_path: Union[str, Path]) -> bool:
+        """True if a previous attempt left a segment journal for output_path."""
+        return (cls.resume_dir_for(output_path) / JOURNAL_FILENAME).is_file()
+
     def _get_request_headers(self, add_range: Optional[str] = None) -> Dict[str, str]:
         """Constructs request headers with optional auth and range."""
         headers = {}
@@ -83,14 +182,14 @@ class ChunkDownloader:
         if not self.is_cancelled:
             print(f"[Downloader {self.download_id or 'N/A'}] Cancellation requested by user.")
             self.cancel_event.set()
-            self.error = "Download cancelled by user"
+            self.error = self.error or "Download cancelled by user"
             if self.manager and self.download_id:
                 self.manager._update_download_status(self.download_id, status="cancelled", error=self.error)
 
-    def _cleanup_temp(self, success: bool):
+    def _cleanup_temp(self, success: bool, keep_parts: bool = False):
         """Remove temporary directory and potentially the output file."""
-        # Clean up temp directory
-        if self.temp_dir.exists():
+        # Clean up temp directory (kept on failure in resumable mode)
+        if self.temp_dir.exists() and not keep_parts:
             try:
                 shutil.rmtree(self.temp_dir)
             except Exception as e:
@@ -113,7 +212,7 @@ class ChunkDownloader:
             request_headers = self._get_request_headers()
             
             print(f"[Downloader {self.download_id}] Checking range support/redirects for: {self.initial_url} (Timeout: {self.HEAD_REQUEST_TIMEOUT}s)")
-            response = requests.head(
+            response = get_session(self.initial_url).head(
                 self.initial_url,
                 allow_redirects=True,
                 timeout=self.HEAD_REQUEST_TIMEOUT,
@@ -178,88 +277,526 @@ class ChunkDownloader:
                     self.manager._update_download_status(
                         self.download_id,
                         progress=progress,
-                        speed=self._speed,
-                        status="downloading"
+                        speed=self._speed
                     )
 
-    def download_segment(self, segment_index: int, start_byte: int, end_byte: int):
-        """Downloads a specific segment of the file."""
-        part_file_path = self.temp_dir / f"part_{segment_index}"
-        request_headers = self._get_request_headers(add_range=f'bytes={start_byte}-{end_byte}')
-        retries = 3
-        
-        for current_try in range(retries):
-            if self.is_cancelled:
-                print(f"[Downloader {self.download_id}] Segment {segment_index} cancelled before request (Try {current_try+1}).")
-                # Ensure error is set if not already
-                if not self.error: self.error = "Cancelled during segment download"
-                return 
-                
-            response = None
-            try:
-                response = requests.get(self.url, headers=request_headers, stream=True, timeout=self.DOWNLOAD_TIMEOUT)
-                response.raise_for_status()
+    # --- Segment journal (resumable mode) ---
+    def _new_segment(self, index: int, start_byte: int, end_byte: int, written: int = 0) -> Dict[str, Any]:
+        """Registers a segment and its (optional) running hasher."""
+        segment = {"index": index, "start": start_byte, "end": end_byte, "written": written}
+        self.segments[index] = segment
+        if self.verify_resume_hash:
+            self._segment_hashers[index] = hashlib.sha256()
+        return segment
 
-                bytes_written_this_segment = 0
-                with open(part_file_path, 'wb') as f:
-                    for chunk in response.iter_content(self.chunk_size):
-                        if self.is_cancelled:
-                            print(f"[Downloader {self.download_id}] Segment {segment_index} cancelled mid-stream.")
-                            # Ensure error is set if not already
-                            if not self.error: self.error = "Cancelled during segment download"
-                            
-                            
-                        if chunk:
-                            bytes_written = f.write(chunk)
-                            bytes_written_this_segment += bytes_written
-                            self._update_progress(bytes_written)
-
-                # Verify segment size
-                expected_size = (end_byte - start_byte) + 1
-                if bytes_written_this_segment != expected_size:
-                    if response:
-                        response.close()
-                    raise ValueError(f"Size mismatch. Expected {expected_size}, got {bytes_written_this_segment}")
-
-                return  # Success
+    def _advance_segment(self, segment_index: int, chunk: bytes, bytes_written: int):
+        """Records bytes appended to a segment's part file."""
+        with self.lock:
+            self.segments[segment_index]["written"] += bytes_written
+            hasher = self._segment_hashers.get(segment_index)
+            if hasher is not None:
+                hasher.update(chunk[:bytes_written])
 
-            
-            except (requests.exceptions.RequestException, ValueError) as e:
-                # Handle HTTP status codes
-                status_code = None
-                error_msg_detail = f"{e}"
-                
-                if isinstance(e, requests.exceptions.RequestException) and hasattr(e, 'response') and e.response is not None:
-                    status_code = e.response.status_code
-                    if status_code == 401: 
-                        error_msg_detail += " (Unauthorized)"
-                    elif status_code == 403: 
-                        error_msg_detail += " (Forbidden)"
-                    elif status_code == 416:
-                        error_msg_detail += " (Range Not Satisfiable)"
-                        self.error = f"Segment {segment_index} failed: {error_msg_detail}"
-                        self.cancel()
-                        return
-
-                print(f"[Downloader {self.download_id}] Warning: Segment {segment_index} failed (Try {current_try+1}/{retries}): {error_msg_detail}")
-                
-                if current_try >= retries - 1:  # Last attempt failed
-                    self.error = f"Segment {segment_index} failed after {retries} attempts: {error_msg_detail}"
-                    self.cancel()
-                    return
-                    
-                # Exponential backoff before retry
-                time.sleep(min(2 ** current_try, 10))
-                
+    def _journal_due(self) -> bool:
+        """Reserves the next journal write slot if the save interval has passed."""
+        if not self.resumable:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self._last_journal_save < self.JOURNAL_SAVE_INTERVAL:
+                return False
+            self._last_journal_save = now
+            return True
+
+    def _save_journal(self):
+        """Atomically writes segment ranges and bytes written to the journal file."""
+        if not self.resumable or not self.segments:
+            return
+        with self.lock:
+            segments = []
+            for index in sorted(self.segments):
+                entry = dict(self.segments[index])
+                hasher = self._segment_hashers.get(index)
+                if hasher is not None:
+                    entry["sha256"] = hasher.copy().hexdigest()
+                segments.append(entry)
+        journal = {
+            "version": JOURNAL_VERSION,
+            "layout": self._journal_layout,
+            "url": self.initial_url,
+            "total_size": self.total_size,
+            "segments": segments,
+        }
+        with self._journal_lock:
+            temp_journal = self.journal_path.with_suffix(".tmp")
+            try:
+                with open(temp_journal, 'w', encoding='utf-8') as f:
+                    json.dump(journal, f)
+                os.replace(temp_journal, self.journal_path)
             except Exception as e:
-                self.error = f"Segment {segment_index} critical error: {e}"
+                print(f"[Downloader {self.download_id}] Warning: Could not write segment journal {self.journal_path}: {e}")
+
+    def _load_journal(self) -> Optional[Dict[str, Any]]:
+        """Reads the journal left by a previous attempt if it matches this download."""
+        if not self.journal_path.is_file():
+            return None
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                journal = json.load(f)
+        except Exception as e:
+            print(f"[Downloader {self.download_id}] Warning: Ignoring unreadable segment journal: {e}")
+            return None
+
+        if not isinstance(journal, dict) or journal.get("version") != JOURNAL_VERSION:
+            print(f"[Downloader {self.download_id}] Ignoring segment journal with unknown format.")
+            return None
+        if journal.get("layout", "parts") != self._journal_layout:
+            print(f"[Downloader {self.download_id}] Ignoring segment journal written for a different storage layout.")
+            return None
+        if journal.get("url") != self.initial_url or journal.get("total_size") != self.total_size:
+            print(f"[Downloader {self.download_id}] Ignoring segment journal for a different URL or size.")
+            return None
+
+        # Segments must be well-formed and cover the whole file without gaps or overlaps
+        segments = journal.get("segments")
+        if not isinstance(segments, list) or not segments:
+            return None
+        expected_start = 0
+        try:
+            for entry in sorted(segments, key=lambda e: e["start"]):
+                if entry["start"] != expected_start or entry["end"] < entry["start"] or entry["written"] < 0:
+                    raise ValueError(f"bad segment {entry}")
+                expected_start = entry["end"] + 1
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"[Downloader {self.download_id}] Ignoring inconsistent segment journal: {e}")
+            return None
+        if expected_start != self.total_size:
+            print(f"[Downloader {self.download_id}] Ignoring segment journal that does not cover the file.")
+            return None
+        return journal
+
+    @property
+    def _journal_layout(self) -> str:
+        return "preallocated" if self.preallocate else "parts"
+
+    def _hash_file_prefix(self, path: Path, length: int, offset: int = 0):
+        """Returns a sha256 hasher fed with `length` bytes of path starting at offset."""
+        hasher = hashlib.sha256()
+        remaining = length
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while remaining > 0:
+                data = f.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                hasher.update(data)
+                remaining -= len(data)
+        return hasher
+
+    def _restore_from_journal(self, journal: Dict[str, Any]):
+        """Re-validates kept part files against the journal and rebuilds segment state.
+           Parts are trimmed to the bytes known good; segments that fail validation restart."""
+        self.segments = {}
+        self._segment_hashers = {}
+        if self.preallocate:
+            # In-place writes can't be checked by size, only the preallocated length itself
+            data_size = self.data_path.stat().st_size if self.data_path.exists() else -1
+            if data_size != self.total_size:
+                raise ValueError(f"preallocated data file has size {data_size}, expected {self.total_size}")
+
+        for entry in journal["segments"]:
+            index = int(entry["index"])
+            segment = self._new_segment(index, int(entry["start"]), int(entry["end"]))
+            length = segment["end"] - segment["start"] + 1
+            journaled = min(int(entry["written"]), length)
+            if self.preallocate:
+                part_file_path, offset = self.data_path, segment["start"]
+                on_disk = journaled  # pwrite data reaches the OS before the journal records it
+            else:
+                part_file_path, offset = self.temp_dir / f"part_{index}", 0
+                on_disk = part_file_path.stat().st_size if part_file_path.exists() else 0
+            valid = min(on_disk, journaled)
+
+            if self.verify_resume_hash and valid > 0:
+                expected_digest = entry.get("sha256")
+                if on_disk < journaled and expected_digest:
+                    # Journal is ahead of the disk (crash before flush); digest can't be checked
+                    print(f"[Downloader {self.download_id}] Segment {index}: part shorter than journal, restarting segment.")
+                    valid = 0
+                else:
+                    hasher = self._hash_file_prefix(part_file_path, valid, offset)
+                    if expected_digest and hasher.hexdigest() != expected_digest:
+                        print(f"[Downloader {self.download_id}] Segment {index}: hash mismatch, restarting segment.")
+                        valid = 0
+                    else:
+                        self._segment_hashers[index] = hasher
+                if valid == 0:
+                    self._segment_hashers[index] = hashlib.sha256()
+
+            # Drop anything past the validated length (unjournaled tail or stale data)
+            if not self.preallocate:
+                with open(part_file_path, 'r+b' if part_file_path.exists() else 'wb') as f:
+                    f.truncate(valid)
+            segment["written"] = valid
+
+        self.resumed_bytes = sum(seg["written"] for seg in self.segments.values())
+
+    def _open_output_file(self) -> bool:
+        """Creates (or reopens when resuming) the preallocated data file at its full size."""
+        try:
+            self.temp_dir.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            self.error = f"Failed to create output file: {e}"
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            return False
+
+        try:
+            if os.fstat(fd).st_size != self.total_size:
+                try:
+                    # Reserve real blocks so a full disk fails now instead of at 95%
+                    os.posix_fallocate(fd, 0, self.total_size)
+                except AttributeError:
+                    os.ftruncate(fd, self.total_size)  # Not available (Windows/macOS): sparse file
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    os.ftruncate(fd, self.total_size)  # Filesystem without fallocate support
+        except OSError as e:
+            os.close(fd)
+            self.error = f"Failed to preallocate {self.total_size} bytes for output file: {e}"
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            return False
+
+        if hasattr(os, 'pwrite'):
+            self._output_fd = fd
+        else:
+            os.close(fd)  # Segments open their own handles and seek instead
+        return True
+
+    def _close_output_file(self):
+        """Closes the shared preallocated file descriptor once no segment thread can still write to it."""
+        fd, self._output_fd = self._output_fd, None
+        if fd is None:
+            return
+
+        def close_fd():
+            for t in self.threads:
+                t.join()
+            try:
+                os.close(fd)
+            except OSError as e:
+                print(f"[Downloader {self.download_id}] Warning: Could not close output file: {e}")
+
+        if any(t.is_alive() for t in self.threads):
+            # A straggler stuck in a network read must not pwrite into a recycled fd
+            threading.Thread(target=close_fd, daemon=True).start()
+        else:
+            close_fd()
+
+    def _open_segment_sink(self, segment_index: int, position: int):
+        """Returns a writable file-like object positioned at the segment's next byte."""
+        # Unbuffered: bytes counted in "written" must be readable by the ordered hasher
+        if not self.preallocate:
+            return open(self.temp_dir / f"part_{segment_index}", 'ab', buffering=0)
+        if self._output_fd is not None:
+            return _PositionalWriter(self._output_fd, position)
+        f = open(self.data_path, 'r+b', buffering=0)
+        f.seek(position)
+        return f
+
+    def _open_output_for_write(self):
+        """Opens output_path for writing on a new inode.
+
+        The path may be a hardlink to another model (LocalCopyDownloader reuse); opening it
+        with 'wb' in place would truncate and rewrite that model under its other name too.
+        """
+        try:
+            os.unlink(self.output_path)
+        except FileNotFoundError:
+            pass
+        return open(self.output_path, 'wb')
+
+    def finalize_preallocated(self) -> bool:
+        """Checks the in-place data file and renames it onto the output path (replaces merge_parts)."""
+        self._close_output_file()
+        try:
+            final_size = self.data_path.stat().st_size
+            if self.total_size > 0 and final_size != self.total_size:
+                self.error = f"Output size ({final_size}) differs from expected ({self.total_size}). File may be corrupt."
                 print(f"[Downloader {self.download_id}] Error: {self.error}")
-                self.cancel()
+                return False
+            os.replace(self.data_path, self.output_path)
+            print(f"[Downloader {self.download_id}] Moved preallocated file into place (no merge needed).")
+            return True
+        except Exception as e:
+            self.error = f"Failed to move downloaded file into place: {e}"
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            return False
+
+    # --- Shared download scheduler (custom_nodes/download_scheduler.py) ---
+    def _register_scheduler_job(self):
+        module = get_scheduler_module()
+        if module is None:
+            return
+        try:
+            self._sched_job = module.scheduler.register(
+                self.output_path.name, source="Civicomfy", priority=module.parse_priority(self.priority),
+                size=self.total_size or None)
+        except Exception as e:
+            print(f"[Downloader {self.download_id}] Warning: Could not register with download scheduler: {e}")
+            self._sched_job = None
+
+    def _close_scheduler_job(self):
+        job, self._sched_job = self._sched_job, None
+        if job is not None:
+            job.close()
+
+    def _acquire_connection(self) -> bool:
+        """Waits for a connection slot from the shared scheduler. False if the download stopped."""
+        job = self._sched_job
+        return job is None or job.acquire(should_stop=lambda: self.is_cancelled)
+
+    def _release_connection(self):
+        if self._sched_job is not None:
+            self._sched_job.release()
+
+    def _throttle(self, nbytes: int):
+        if self._sched_job is not None:
+            self._sched_job.throttle(nbytes)
+
+    def _should_yield(self) -> bool:
+        """True when a higher-priority download needs this worker's connection."""
+        return self._sched_job is not None and self._sched_job.should_yield()
+
+    # --- Range scheduler (shared work queue + work stealing) ---
+    def _segment_remaining(self, segment: Dict[str, Any]) -> int:
+        return segment["end"] - segment["start"] + 1 - segment["written"]
+
+    def _next_range(self) -> Optional[int]:
+        """Hands an idle worker its next range: queued work first, otherwise the tail half
+           of the in-flight range expected to finish last. Returns None when nothing is left."""
+        with self.lock:
+            while self._pending_ranges:
+                index = self._pending_ranges.popleft()
+                if self._segment_remaining(self.segments[index]) > 0:
+                    self._start_range(index)
+                    return index
+
+            # Steal: split the in-flight range with the longest estimated time to finish
+            now = time.monotonic()
+            victim, victim_eta = None, 0.0
+            for index in self._inflight_ranges:
+                segment = self.segments[index]
+                remaining = self._segment_remaining(segment)
+                if remaining < self.MIN_STEAL_SIZE_MB * 1024 * 1024:
+                    continue
+                started, written_at_start = self._range_started[index]
+                rate = (segment["written"] - written_at_start) / max(now - started, 1e-3)
+                eta = remaining / max(rate, 1.0)
+                if eta > victim_eta:
+                    victim, victim_eta = index, eta
+            if victim is None:
+                return None
+
+            # The victim may be mid-write on one chunk past its recorded progress, so the
+            # split point always leaves it at least one chunk of room.
+            segment = self.segments[victim]
+            remaining = self._segment_remaining(segment)
+            keep = max(remaining // 2, self.chunk_size)
+            split_at = segment["start"] + segment["written"] + keep
+            new_index = self._next_segment_index
+            self._next_segment_index += 1
+            self._new_segment(new_index, split_at, segment["end"])
+            segment["end"] = split_at - 1
+            self._start_range(new_index)
+            print(f"[Downloader {self.download_id}] Idle worker took bytes {split_at}-{self.segments[new_index]['end']} "
+                  f"from range {victim} (ETA {victim_eta:.0f}s).")
+            return new_index
+
+    def _start_range(self, index: int):
+        """Marks a range in flight (self.lock held)."""
+        self._inflight_ranges.add(index)
+        self._range_started[index] = (time.monotonic(), self.segments[index]["written"])
+
+    def _finish_range(self, index: int, completed: Optional[bool]) -> bool:
+        """Takes a range out of flight; a failed range is requeued until it runs out of attempts.
+           completed=None means the range gave up its connection to a higher-priority download:
+           it goes back to the front of the queue without counting an attempt.
+           Returns True if the worker should back off before taking more work."""
+        with self.lock:
+            self._inflight_ranges.discard(index)
+            self._range_started.pop(index, None)
+            if completed is None and not self.is_cancelled:
+                self._pending_ranges.appendleft(index)
+                return False
+            if completed or self.is_cancelled:
+                return False
+            attempts = self._range_attempts.get(index, 0) + 1
+            self._range_attempts[index] = attempts
+            if attempts < self.RANGE_MAX_ATTEMPTS:
+                self._pending_ranges.append(index)
+                return True
+        if not self.error:
+            self.error = f"Range {index} failed after {self.RANGE_MAX_ATTEMPTS} attempts."
+        print(f"[Downloader {self.download_id}] Error: {self.error}")
+        self.cancel()
+        return False
+
+    def _range_worker(self):
+        """Pulls ranges from the shared queue until the file is complete or the download stops."""
+        while not self.is_cancelled:
+            if not self._acquire_connection():
                 return
-                
+            try:
+                index = self._next_range()
+                if index is None:
+                    return
+                completed = self.download_segment(index)
             finally:
-                if response:
-                    response.close()
+                self._release_connection()
+            if self._finish_range(index, completed):
+                attempts = self._range_attempts.get(index, 1)
+                self.cancel_event.wait(min(2 ** (attempts - 1), 10))  # Back off, wake early on cancel
+
+    def _write_segment_chunk(self, f, segment_index: int, chunk: bytes) -> int:
+        """Writes one chunk of a range and records it in progress and the journal."""
+        # Never write past the range end; it shrinks when another worker steals the tail
+        remaining = self._segment_remaining(self.segments[segment_index])
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+        if not chunk:
+            return 0
+        bytes_written = f.write(chunk)
+        self._advance_segment(segment_index, chunk, bytes_written)
+        if self._ordered_hasher is not None:
+            self._ordered_hasher.notify()
+        self._update_progress(bytes_written)
+        if self._journal_due():
+            f.flush()
+            self._save_journal()
+        return bytes_written
+
+    def download_segment(self, segment_index: int) -> Optional[bool]:
+        """Downloads the missing bytes of one range, appending to any bytes already kept.
+           Returns True once the range is complete; False on a failure the scheduler may retry;
+           None if it stopped early to hand its connection to a higher-priority download."""
+        segment = self.segments[segment_index]
+
+        if self.is_cancelled:
+            # Ensure error is set if not already
+            if not self.error: self.error = "Cancelled during segment download"
+            return False
+
+        # Only request the bytes this range is still missing
+        resume_from = segment["written"]
+        start_byte = segment["start"]
+        if resume_from >= segment["end"] - start_byte + 1:
+            return True
+        request_headers = self._get_request_headers(add_range=f'bytes={start_byte + resume_from}-{segment["end"]}')
+
+        response = None
+        try:
+            response = get_session(self.url).get(self.url, headers=request_headers, stream=True, timeout=self.DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ValueError(f"Server ignored Range request (Status {response.status_code})")
+
+            with self._open_segment_sink(segment_index, start_byte + resume_from) as f:
+                for chunk in response.iter_content(self.chunk_size):
+                    if self.is_cancelled:
+                        print(f"[Downloader {self.download_id}] Segment {segment_index} cancelled mid-stream.")
+                        # Ensure error is set if not already
+                        if not self.error: self.error = "Cancelled during segment download"
+                        return False
+
+                    if chunk:
+                        self._write_segment_chunk(f, segment_index, chunk)
+                        self._throttle(len(chunk))
+                        if self._segment_remaining(segment) <= 0:
+                            break
+                        if self._should_yield():
+                            print(f"[Downloader {self.download_id}] Segment {segment_index} yielding its connection to a higher-priority download.")
+                            return None
+
+            # Verify range size
+            if self._segment_remaining(segment) != 0:
+                expected_size = segment["end"] - start_byte + 1
+                raise ValueError(f"Size mismatch. Expected {expected_size}, got {segment['written']}")
+
+            return True  # Success
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # Handle HTTP status codes
+            error_msg_detail = f"{e}"
+
+            if isinstance(e, requests.exceptions.RequestException) and hasattr(e, 'response') and e.response is not None:
+                status_code = e.response.status_code
+                if status_code == 401:
+                    error_msg_detail += " (Unauthorized)"
+                elif status_code == 403:
+                    error_msg_detail += " (Forbidden)"
+                elif status_code == 416:
+                    error_msg_detail += " (Range Not Satisfiable)"
+                    self.error = f"Segment {segment_index} failed: {error_msg_detail}"
+                    self.cancel()
+                    return False
+
+            attempt = self._range_attempts.get(segment_index, 0) + 1
+            print(f"[Downloader {self.download_id}] Warning: Segment {segment_index} failed "
+                  f"(Try {attempt}/{self.RANGE_MAX_ATTEMPTS}), requeueing: {error_msg_detail}")
+            return False
+
+        except Exception as e:
+            self.error = f"Segment {segment_index} critical error: {e}"
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            self.cancel()
+            return False
+
+        finally:
+            if response:
+                response.close()
+
+    # --- Whole-file hash verification ---
+    def _new_hasher(self) -> Optional[MultiHasher]:
+        return MultiHasher(pick_algorithms(self.expected_hashes)) if self.verify_hash else None
+
+    def _start_ordered_hasher(self):
+        """Starts hashing the written prefix of a multi-connection download in the background."""
+        hasher = self._new_hasher()
+        if hasher is not None:
+            self._ordered_hasher = OrderedFileHasher(self, hasher)
+            self._ordered_hasher.start()
+
+    def _stop_ordered_hasher(self):
+        hasher, self._ordered_hasher = self._ordered_hasher, None
+        if hasher is not None:
+            hasher.stop()
+
+    def _check_hashes(self, digests: Optional[Dict[str, str]]) -> bool:
+        """Records the computed digests; returns False (and sets the error) if they contradict Civitai's."""
+        if digests is None:
+            print(f"[Downloader {self.download_id}] Warning: Could not hash download; file not verified.")
+            return True
+        self.hash_digests = digests
+        self.hash_verified = compare_hashes(self.expected_hashes, digests)
+        if self.hash_verified is False:
+            name = next(n for n in digests if self.expected_hashes.get(n))
+            self.error = (f"Hash mismatch: expected {name} {str(self.expected_hashes[name]).upper()}, "
+                          f"got {digests[name]}. File is corrupt.")
+            self._discard_parts = True  # Resuming would reuse the bad bytes
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            return False
+        if self.hash_verified:
+            print(f"[Downloader {self.download_id}] Hash verified ({', '.join(digests)}).")
+        return True
+
+    def _finish_ordered_hash(self) -> bool:
+        """Waits for the background hasher to reach the end of the file and checks the result."""
+        hasher, self._ordered_hasher = self._ordered_hasher, None
+        if hasher is None:
+            return True
+        return self._check_hashes(hasher.finish())
 
     def merge_parts(self) -> bool:
         """Merges all downloaded part files into the final output file."""
@@ -275,10 +812,13 @@ class ChunkDownloader:
             return False
             
         try:
-            # Sort part files numerically
-            sorted_part_files = sorted(self.part_files, key=lambda p: int(p.name.split('_')[-1]))
+            # Sort part files by the byte offset of their range (stolen ranges get higher indices)
+            def part_offset(p):
+                index = int(p.name.split('_')[-1])
+                return self.segments[index]["start"] if index in self.segments else index
+            sorted_part_files = sorted(self.part_files, key=part_offset)
 
-            with open(self.output_path, 'wb') as outfile:
+            with self._open_output_for_write() as outfile:
                 for part_file in sorted_part_files:
                     # Check if part exists
                     if not part_file.exists():
@@ -328,12 +868,16 @@ class ChunkDownloader:
         self._last_update_time = self._start_time
         self._last_downloaded_bytes = 0
         self.downloaded = 0
+        self._inline_hasher = self._new_hasher()
         
         response = None
+        # A plain GET can't be resumed elsewhere, so it keeps its connection slot until done
+        if not self._acquire_connection():
+            return False
         
         try:
             request_headers = self._get_request_headers()
-            response = requests.get(self.url, stream=True, timeout=self.DOWNLOAD_TIMEOUT, 
+            response = get_session(self.url).get(self.url, stream=True, timeout=self.DOWNLOAD_TIMEOUT, 
                                     allow_redirects=True, headers=request_headers)
             response.raise_for_status()
 
@@ -355,20 +899,25 @@ class ChunkDownloader:
             # Ensure output directory exists
             self.output_path.parent.mkdir(parents=True, exist_ok=True)
 
-            with open(self.output_path, 'wb') as f:
+            with self._open_output_for_write() as f:
                 for chunk in response.iter_content(self.chunk_size):
                     if self.is_cancelled:
                         print(f"[Downloader {self.download_id}] Fallback download cancelled.")
                         return False
                     if chunk:
                         bytes_written = f.write(chunk)
+                        if self._inline_hasher is not None:
+                            self._inline_hasher.update(chunk[:bytes_written])
                         self._update_progress(bytes_written)
+                        self._throttle(bytes_written)
 
                     
 
             # Verify download size if known
             if self.total_size > 0 and self.downloaded != self.total_size and not self.error:
                 print(f"[Downloader {self.download_id}] Warning: Size mismatch. Expected {self.total_size}, got {self.downloaded}.")
+            if self._inline_hasher is not None and not self._check_hashes(self._inline_hasher.hexdigests()):
+                return False
 
             print(f"[Downloader {self.download_id}] Fallback download completed.")
             return not self.error
@@ -396,47 +945,98 @@ class ChunkDownloader:
         finally:
             if response:
                 response.close()
+            self._release_connection()
 
-    def download(self) -> bool:
-        """Main download method that chooses between multi-connection or fallback approach."""
+    def _begin_attempt(self):
+        """Resets per-attempt state before a download starts."""
         self._start_time = time.monotonic()
         self.downloaded = 0
         self.error = None
         self.threads = []
         self.part_files = []
-        success = False
+        self.segments = {}
+        self._segment_hashers = {}
+        self.resumed_bytes = 0
+        self.hash_digests = {}
+        self.hash_verified = None
+        self._inline_hasher = None
+        self._discard_parts = False
+        self._close_scheduler_job()
+        self._register_scheduler_job()
 
-        # Clean up any existing temp directory
-        if self.temp_dir.exists():
+        # Clean up any existing temp directory (resumable parts are validated once the size is known)
+        if self.temp_dir.exists() and not self.resumable:
             print(f"[Downloader {self.download_id}] Warning: Removing leftover temp directory: {self.temp_dir}")
             self._cleanup_temp(success=False)
 
-        # Check range support and get final URL
-        final_url, supports_ranges = self._get_range_support_and_url()
-        
-        # Decide on download strategy
-        use_multi_connection = False
+    def _use_multi_connection(self, supports_ranges: bool) -> bool:
+        """Decides on the download strategy once range support and size are known."""
         if supports_ranges and self.num_connections > 1 and self.total_size > 0:
             if self.total_size > self.MIN_SIZE_FOR_MULTI_MB * 1024 * 1024:
-                use_multi_connection = True
-            else:
-                print(f"[Downloader {self.download_id}] File size ({self.total_size / (1024*1024):.2f} MB) below threshold for multi-connection.")
-        
-        expected_final_size = self.total_size
+                return True
+            print(f"[Downloader {self.download_id}] File size ({self.total_size / (1024*1024):.2f} MB) below threshold for multi-connection.")
+            return False
+
+        reason = "Range requests not supported" if not supports_ranges else \
+                 "Single connection requested" if self.num_connections <= 1 else \
+                 "File size unknown or too small"
+        print(f"[Downloader {self.download_id}] ({reason}). Using fallback single-connection download.")
+        return False
+
+    def _handle_unexpected_error(self, e: Exception):
+        """Records an unexpected exception from the download body and cancels the download."""
+        import traceback
+        print(f"--- Critical Error in Download {self.download_id} ('{self.output_path.name}') ---")
+        traceback.print_exc()
+        print("--- End Error ---")
+
+        if not self.error:
+            self.error = f"Unexpected download error: {str(e)}"
+        if not self.is_cancelled: 
+            self.cancel()
+
+    def _end_attempt(self, success: bool):
+        """Cleanup (or keep parts for resume) and send the final status update."""
+        succeeded = success and not self.is_cancelled and not self.error
+        self._stop_ordered_hasher()
+        self._close_scheduler_job()
+        self._close_output_file()
+        keep_parts = self.resumable and not succeeded and not self._discard_parts
+        if keep_parts and self.segments:
+            self._save_journal()
+            print(f"[Downloader {self.download_id}] Keeping downloaded parts for resume in {self.temp_dir}")
+        self._cleanup_temp(success=succeeded, keep_parts=keep_parts)
+
+        if self.manager and self.download_id:
+            if succeeded and self.hash_digests:
+                self.manager._record_download_hashes(self.download_id, self.hash_digests, self.hash_verified)
+            final_status = "completed" if success else ("cancelled" if self.is_cancelled else "failed")
+            final_progress = 100.0 if success else ((self.downloaded / self.total_size * 100) if self.total_size > 0 else 0)
+            
+            self.manager._update_download_status(
+                self.download_id,
+                status=final_status,
+                progress=min(100.0, final_progress),
+                speed=0,
+                error=self.error,
+                connection_type=self.connection_type
+            )
+
+    def download(self) -> bool:
+        """Main download method that chooses between multi-connection or fallback approach."""
+        self._begin_attempt()
+        success = False
+
+        # Check range support and get final URL
+        final_url, supports_ranges = self._get_range_support_and_url()
 
         try:
-            if use_multi_connection:
+            if self._use_multi_connection(supports_ranges):
                 # Multi-connection download approach
                 success = self._do_multi_connection_download()
             else:
                 # Single connection fallback
-                reason = "Range requests not supported" if not supports_ranges else \
-                         "Single connection requested" if self.num_connections <= 1 else \
-                         "File size unknown or too small"
-                print(f"[Downloader {self.download_id}] ({reason}). Using fallback single-connection download.")
                 success = self.fallback_download()
-                expected_final_size = self.total_size
-                
                 if not success and not self.error:
                     self.error = "Single connection download failed."
 
@@ -448,39 +1048,28 @@ class ChunkDownloader:
             success = False
             
         except Exception as e:
-            import traceback
-            print(f"--- Critical Error in Download {self.download_id} ('{self.output_path.name}') ---")
-            traceback.print_exc()
-            print("--- End Error ---")
-            
-            if not self.error:
-                self.error = f"Unexpected download error: {str(e)}"
-            
+            self._handle_unexpected_error(e)
             success = False
-            if not self.is_cancelled: 
-                self.cancel()
 
         finally:
-            # Cleanup and final status update
-            self._cleanup_temp(success=success and not self.is_cancelled and not self.error)
-
-            if self.manager and self.download_id:
-                final_status = "completed" if success else ("cancelled" if self.is_cancelled else "failed")
-                final_progress = 100.0 if success else ((self.downloaded / self.total_size * 100) if self.total_size > 0 else 0)
-                
-                self.manager._update_download_status(
-                    self.download_id,
-                    status=final_status,
-                    progress=min(100.0, final_progress),
-                    speed=0,
-                    error=self.error,
-                    connection_type=self.connection_type
-                )
+            self._end_attempt(success)
 
         return success and not self.error and not self.is_cancelled
 
-    def _do_multi_connection_download(self) -> bool:
-        """Handle multi-connection download process."""
+    def _calculate_segments(self) -> list:
+        """Splits the file into (index, start_byte, end_byte) ranges for the work queue.
+           Ranges are at most RANGE_SIZE_MB, and small enough that every connection gets one."""
+        per_connection = -(-self.total_size // self.num_connections)  # ceil
+        range_size = max(1, min(self.RANGE_SIZE_MB * 1024 * 1024, per_connection))
+
+        segments = []
+        for i, start_byte in enumerate(range(0, self.total_size, range_size)):
+            end_byte = min(start_byte + range_size, self.total_size) - 1
+            segments.append((i, start_byte, end_byte))
+        return segments
+
+    def _prepare_multi_connection(self) -> bool:
+        """Restores or lays out the ranges, prepares storage and fills the work queue."""
         self.connection_type = f"Multi ({self.num_connections})"
         if self.manager and self.download_id:
             self.manager._update_download_status(self.download_id, connection_type=self.connection_type, status="downloading")
@@ -488,61 +1077,101 @@ class ChunkDownloader:
         print(f"[Downloader {self.download_id}] Starting multi-connection download for {self.output_path.name} "
               f"({self.total_size / (1024 * 1024):.2f} MB) using {self.num_connections} connections.")
 
-        # Create temp directory
-        try:
-            if self.temp_dir.exists(): 
-                shutil.rmtree(self.temp_dir)
-            self.temp_dir.mkdir(parents=True)
-        except Exception as e:
-            self.error = f"Failed to create temp directory: {e}"
-            print(f"[Downloader {self.download_id}] Error: {self.error}")
-            return False
+        # Resume from the journal of a previous attempt when it still matches
+        journal = self._load_journal() if self.resumable else None
+        if journal:
+            try:
+                self._restore_from_journal(journal)
+            except Exception as e:
+                print(f"[Downloader {self.download_id}] Warning: Could not restore segment journal: {e}. Starting over.")
+                journal = None
 
-        # Calculate segments
-        segment_size = self.total_size // self.num_connections
-        
-        # Handle small files with many connections
-        if segment_size == 0 and self.total_size > 0:
-            segment_size = self.total_size // min(self.num_connections, self.total_size) if self.total_size >= self.num_connections else self.total_size
-            if segment_size == 0:
-                segment_size = self.total_size
-                self.num_connections = 1
-                print(f"[Downloader {self.download_id}] Warning: Forcing single connection for very small file.")
-                return self.fallback_download()
-
-        # Create segments
-        segments = []
-        current_byte = 0
-        for i in range(self.num_connections):
-            if current_byte >= self.total_size: 
-                break
-                
-            start_byte = current_byte
-            end_byte = min(current_byte + segment_size - 1, self.total_size - 1)
-            
-            # Ensure last segment goes to the end
-            if i == self.num_connections - 1:
-                end_byte = self.total_size - 1
-
-            # Ensure segment is valid
-            if start_byte <= end_byte < self.total_size:
-                segments.append((i, start_byte, end_byte))
-                self.part_files.append(self.temp_dir / f"part_{i}")
-            else:
-                print(f"[Downloader {self.download_id}] Warning: Skipping invalid segment {i}, start={start_byte}, end={end_byte}")
-            
-            current_byte = end_byte + 1
+        if journal:
+            segments = [(seg["index"], seg["start"], seg["end"]) for seg in sorted(self.segments.values(), key=lambda s: s["start"])]
+            print(f"[Downloader {self.download_id}] Resuming with {self.resumed_bytes / (1024 * 1024):.2f} MB "
+                  f"already downloaded across {len(segments)} segments.")
+        else:
+            self.segments = {}
+            self._segment_hashers = {}
+            self.resumed_bytes = 0
+
+            # Create temp directory
+            try:
+                if self.temp_dir.exists(): 
+                    shutil.rmtree(self.temp_dir)
+                self.temp_dir.mkdir(parents=True)
+            except Exception as e:
+                self.error = f"Failed to create temp directory: {e}"
+                print(f"[Downloader {self.download_id}] Error: {self.error}")
+                return False
+
+            segments = self._calculate_segments()
+            for index, start, end in segments:
+                self._new_segment(index, start, end)
+            self._save_journal()
+
+        if self.preallocate:
+            if not self._open_output_file():
+                return False
+        else:
+            self.part_files = [self.temp_dir / f"part_{index}" for index, _, _ in segments]
+        with self.lock:
+            self.downloaded = self.resumed_bytes
+            self._last_downloaded_bytes = self.downloaded
 
         if not segments:
             self.error = f"No valid download segments calculated (Total Size: {self.total_size})."
             print(f"[Downloader {self.download_id}] Error: {self.error}")
             return False
 
-        # Start download threads
-        for index, start, end in segments:
+        # Queue incomplete ranges
+        with self.lock:
+            self._pending_ranges = deque(index for index, start, end in segments
+                                         if self.segments[index]["written"] < end - start + 1)
+            self._inflight_ranges = set()
+            self._range_started = {}
+            self._range_attempts = {}
+            self._next_segment_index = max(self.segments) + 1
+        self._start_ordered_hasher()
+        return True
+
+    def _worker_count(self) -> int:
+        return min(self.num_connections, max(1, len(self._pending_ranges)))
+
+    def _complete_multi_connection(self) -> bool:
+        """Checks the finished ranges and produces the output file."""
+        if self.is_cancelled:
+            print(f"[Downloader {self.download_id}] Download stopped (cancelled).")
+            self.error = self.error or "Download cancelled."
+            return False
+        elif self.error:
+            print(f"[Downloader {self.download_id}] Download stopped (error): {self.error}")
+            return False
+        elif self.total_size > 0 and self.downloaded != self.total_size:
+            self.error = f"Multi-download size mismatch. Expected {self.total_size}, got {self.downloaded}."
+            print(f"[Downloader {self.download_id}] Error: {self.error}")
+            return False
+
+        # Verify the whole-file hash before the file is moved into place
+        if not self._finish_ordered_hash():
+            return False
+
+        # Merge parts (preallocated files are already complete in place)
+        if self.preallocate:
+            return self.finalize_preallocated()
+        self.part_files = [self.temp_dir / f"part_{index}" for index in self.segments]
+        return self.merge_parts()
+
+    def _do_multi_connection_download(self) -> bool:
+        """Handle multi-connection download process."""
+        if not self._prepare_multi_connection():
+            return False
+
+        # Start the worker pool
+        for _ in range(self._worker_count()):
             if self.is_cancelled: 
                 break
-            thread = threading.Thread(target=self.download_segment, args=(index, start, end), daemon=True)
+            thread = threading.Thread(target=self._range_worker, daemon=True)
             self.threads.append(thread)
             thread.start()
 
@@ -557,18 +1186,8 @@ class ChunkDownloader:
             
             active_threads = [t for t in active_threads if t not in joined_threads]
 
-        # Handle download completion
+        # Give segment threads a moment to stop writing so the journal matches the parts
         if self.is_cancelled:
-            print(f"[Downloader {self.download_id}] Download stopped (cancelled).")
-            self.error = self.error or "Download cancelled."
-            return False
-        elif self.error:
-            print(f"[Downloader {self.download_id}] Download stopped (error): {self.error}")
-            return False
-        elif self.total_size > 0 and self.downloaded != self.total_size:
-            self.error = f"Multi-download size mismatch. Expected {self.total_size}, got {self.downloaded}."
-            print(f"[Downloader {self.download_id}] Error: {self.error}")
-            return False
-
-        # Merge parts
-        return self.merge_parts()
\ No newline at end of file
+            for t in self.threads:
+                t.join(timeout=2.0)
+        return self._complete_multi_connection()
@@ -0,0 +1,166 @@
+# ================================================
+# File: downloader/hash_verify.py
+# ================================================
+import hashlib
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .chunk_downloader import ChunkDownloader
+
+
+class _Crc32:
+    """hashlib-style wrapper around zlib.crc32 (Civitai publishes CRC32 as 8 upper-case hex digits)."""
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, data: bytes):
+        self._crc = zlib.crc32(data, self._crc)
+
+    def hexdigest(self) -> str:
+        return format(self._crc & 0xFFFFFFFF, '08X')
+
+
+# Civitai hash name -> factory. SHA256 is always computed: it is the digest recorded for later checks.
+HASH_FACTORIES = {
+    "SHA256": hashlib.sha256,
+    "CRC32": _Crc32,
+}
+
+
+def pick_algorithms(expected: Optional[Dict[str, str]]) -> List[str]:
+    """SHA256, plus CRC32 when that is the only supported hash Civitai gave us."""
+    expected = expected or {}
+    names = ["SHA256"]
+    if not expected.get("SHA256") and expected.get("CRC32"):
+        names.append("CRC32")
+    return names
+
+
+class MultiHasher:
+    """Feeds the same bytes to several hashers."""
+
+    def __init__(self, names: List[str]):
+        self._hashers = {name: HASH_FACTORIES[name]() for name in names}
+
+    def update(self, data: bytes):
+        for hasher in self._hashers.values():
+            hasher.update(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: hasher.hexdigest().upper() for name, hasher in self._hashers.items()}
+
+
+def compare_hashes(expected: Optional[Dict[str, str]], digests: Dict[str, str]) -> Optional[bool]:
+    """True/False when at least one computed hash has an expected value, None if nothing to compare."""
+    checked = False
+    for name, digest in digests.items():
+        want = (expected or {}).get(name)
+        if not want:
+            continue
+        if str(want).strip().upper() != digest:
+            return False
+        checked = True
+    return True if checked else None
+
+
+class OrderedFileHasher:
+    """Hashes a multi-connection download in file order while ranges are still arriving.
+
+    A hash can't be assembled from per-range digests, so this thread follows the
+    contiguous prefix of written bytes and reads it back (normally still in the page
+    cache) as it grows. When the last range lands only the tail remains to be hashed.
+    """
+    READ_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, downloader: 'ChunkDownloader', hasher: MultiHasher):
+        self.downloader = downloader
+        self.hasher = hasher
+        self.hashed = 0
+        self.error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stop = False
+        self._finishing = False
+        self._handles: Dict[Any, Any] = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def notify(self):
+        """Called after bytes are written; wakes the hasher if it is waiting."""
+        self._wake.set()
+
+    def stop(self):
+        """Stops hashing and waits briefly so no file handle is left open on the parts."""
+        self._stop = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5.0)
+
+    def finish(self) -> Optional[Dict[str, str]]:
+        """Waits until the whole file is hashed; returns the digests (None on error or stop)."""
+        self._finishing = True
+        self._wake.set()
+        self._thread.join()
+        if self.error or self.hashed != self.downloader.total_size:
+            return None
+        return self.hasher.hexdigests()
+
+    def _contiguous_end(self) -> int:
+        """End offset of the written prefix (every byte below it is on disk)."""
+        d = self.downloader
+        with d.lock:
+            position = 0
+            for segment in sorted(d.segments.values(), key=lambda s: s["start"]):
+                if segment["start"] != position:
+                    break
+                position = segment["start"] + segment["written"]
+                if position <= segment["end"]:
+                    break
+        return position
+
+    def _read(self, offset: int, length: int) -> bytes:
+        d = self.downloader
+        if d.preallocate:
+            key, path, position = None, d.data_path, offset
+        else:
+            with d.lock:
+                segment = next(s for s in d.segments.values() if s["start"] <= offset <= s["end"])
+            length = min(length, segment["start"] + segment["written"] - offset)
+            key, path, position = segment["index"], d.temp_dir / f"part_{segment['index']}", offset - segment["start"]
+        f = self._handles.get(key)
+        if f is None:
+            f = self._handles[key] = open(Path(path), 'rb')
+        f.seek(position)
+        return f.read(length)
+
+    def _run(self):
+        try:
+            while not self._stop:
+                self._wake.clear()
+                end = self._contiguous_end()
+                while self.hashed < end and not self._stop:
+                    data = self._read(self.hashed, min(self.READ_SIZE, end - self.hashed))
+                    if not data:
+                        raise IOError(f"Unexpected end of data at offset {self.hashed}")
+                    self.hasher.update(data)
+                    self.hashed += len(data)
+                if self.hashed >= self.downloader.total_size:
+                    return
+                if self._finishing and self.hashed >= self._contiguous_end():
+                    return  # Download ended with a gap; nothing more will arrive
+                self._wake.wait(0.5)
+        except Exception as e:
+            self.error = f"Hashing failed: {e}"
+            print(f"[Downloader {self.downloader.download_id}] Warning: {self.error}")
+        finally:
+            for f in self._handles.values():
+                try:
+                    f.close()
+                except Exception:
+                    pass
+            self._handles.clear()
@@ -0,0 +1,255 @@
+# ================================================
+# File: downloader/history_store.py
+# ================================================
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+# Large Civitai API payloads; kept out of the journal and of the in-memory history
+BLOB_FIELDS = ("civitai_model_info", "civitai_version_info", "civitai_primary_file")
+
+
+class HistoryStore:
+    """Append-only download history: a JSONL journal plus one metadata blob file per entry.
+
+    add()/remove()/clear() only queue the change and return, so callers can hold the
+    manager lock. A background writer appends everything queued since its last pass in
+    one write, writes the blobs, and compacts the journal once it holds COMPACT_FACTOR
+    times `limit` records.
+    """
+    COMPACT_FACTOR = 4
+
+    def __init__(self, journal_path: str, blob_dir: str, limit: int, legacy_path: Optional[str] = None):
+        self.journal_path = journal_path
+        self.blob_dir = blob_dir
+        self.limit = max(1, limit)
+        self.legacy_path = legacy_path
+
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[str, Any]] = []
+        self._pending_blobs: Dict[str, Dict[str, Any]] = {}
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Writer-owned state: light entries oldest -> newest, and records in the journal file
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._journal_records = 0
+
+    # --- Public API ---
+    def load(self) -> List[Dict[str, Any]]:
+        """Replays the journal (migrating a legacy JSON file once) and starts the writer.
+           Returns the light entries, newest first."""
+        if not os.path.exists(self.journal_path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+        else:
+            self._replay_journal()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._writer, name="civicomfy-history", daemon=True)
+        self._thread.start()
+        return list(reversed(self._entries.values()))
+
+    def add(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Queues a finished download; returns the light entry to keep in memory."""
+        light, blob = self.split(item)
+        with self._cond:
+            if blob:
+                self._pending_blobs[item["id"]] = blob
+            self._pending.append(("add", light))
+            self._cond.notify()
+        return light
+
+    def remove(self, download_id: str):
+        with self._cond:
+            self._pending_blobs.pop(download_id, None)
+            self._pending.append(("remove", download_id))
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            self._pending_blobs.clear()
+            self._pending.append(("clear", None))
+            self._cond.notify()
+
+    def load_blob(self, download_id: str) -> Dict[str, Any]:
+        """Returns the metadata fields stored for an entry ({} if none)."""
+        with self._cond:
+            blob = self._pending_blobs.get(download_id)
+        if blob is not None:
+            return dict(blob)
+        try:
+            with open(self._blob_path(download_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"[History] Warning: Could not read metadata for {download_id}: {e}")
+            return {}
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until everything queued so far is on disk."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._pending_blobs, timeout=timeout)
+
+    def close(self, timeout: float = 2.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    @staticmethod
+    def split(item: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        light = {k: v for k, v in item.items() if k not in BLOB_FIELDS}
+        blob = {k: item[k] for k in BLOB_FIELDS if item.get(k)}
+        return light, blob
+
+    # --- Files ---
+    def _blob_path(self, download_id: str) -> str:
+        return os.path.join(self.blob_dir, re.sub(r'[^A-Za-z0-9._-]', '_', download_id) + ".json")
+
+    def _write_blob(self, download_id: str, blob: Dict[str, Any]):
+        os.makedirs(self.blob_dir, exist_ok=True)
+        path = self._blob_path(download_id)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(blob, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(path + ".tmp", path)
+
+    def _delete_blob(self, download_id: str):
+        try:
+            os.remove(self._blob_path(download_id))
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, op: str, value: Any):
+        """Applies one record to the in-memory entries (replay and writer)."""
+        if op == "add":
+            self._entries[value["id"]] = value
+            self._entries.move_to_end(value["id"])
+            while len(self._entries) > self.limit:
+                self._entries.popitem(last=False)
+        elif op == "remove":
+            self._entries.pop(value, None)
+        elif op == "clear":
+            self._entries.clear()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            print(f"[History] No history journal found ({self.journal_path}). Starting with empty history.")
+            return
+        skipped = 0
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        self._apply(record["op"], record.get("value"))
+                    except (ValueError, KeyError, TypeError):
+                        skipped += 1  # Typically a line cut short by a crash
+                        continue
+                    self._journal_records += 1
+        except Exception as e:
+            print(f"[History] Error: Failed to read history journal ({self.journal_path}): {e}. Starting fresh.")
+            self._entries.clear()
+            return
+        if skipped:
+            print(f"[History] Warning: Skipped {skipped} unreadable journal lines.")
+        print(f"[History] Loaded {len(self._entries)} items from {self.journal_path}.")
+
+    def _migrate_legacy(self):
+        """Imports the old whole-file download_history.json once, then renames it to .bak."""
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                loaded_data = json.load(f)
+            if not isinstance(loaded_data, list):
+                raise ValueError("not a list")
+            items = [item for item in loaded_data if isinstance(item, dict) and 'id' in item][:self.limit]
+            for item in reversed(items):  # Legacy file is newest first
+                light, blob = self.split(item)
+                if blob:
+                    self._write_blob(item["id"], blob)
+                self._apply("add", light)
+            self._compact()
+            os.replace(self.legacy_path, self.legacy_path + ".bak")
+            print(f"[History] Migrated {len(self._entries)} items from {self.legacy_path}.")
+        except Exception as e:
+            print(f"[History] Error: Failed to migrate legacy history file ({self.legacy_path}): {e}. Starting fresh.")
+            self._entries.clear()
+
+    def _compact(self, written_blobs=()):
+        """Rewrites the journal as one record per live entry and drops orphaned blobs.
+           Queued blobs are kept unless the current batch already wrote them (written_blobs)."""
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps({"op": "add", "value": entry}, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.journal_path)
+        self._journal_records = len(self._entries)
+
+        if os.path.isdir(self.blob_dir):
+            live = {os.path.basename(self._blob_path(download_id)) for download_id in self._entries}
+            with self._cond:
+                pending = {os.path.basename(self._blob_path(download_id)) for download_id in self._pending_blobs
+                           if download_id not in written_blobs}
+            for name in os.listdir(self.blob_dir):
+                if name not in live and name not in pending:
+                    try:
+                        os.remove(os.path.join(self.blob_dir, name))
+                    except OSError:
+                        pass
+
+    # --- Background writer ---
+    def _writer(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._pending and not self._running:
+                    return
+                batch, self._pending = self._pending, []
+                blobs = dict(self._pending_blobs)
+
+            try:
+                self._write_batch(batch, blobs)
+            except Exception as e:
+                print(f"[History] Error: Failed to write history: {e}")
+
+            with self._cond:
+                for download_id, blob in blobs.items():
+                    if self._pending_blobs.get(download_id) is blob:
+                        del self._pending_blobs[download_id]
+                self._cond.notify_all()
+
+    def _write_batch(self, batch: List[Tuple[str, Any]], blobs: Dict[str, Dict[str, Any]]):
+        lines = []
+        for op, value in batch:
+            if op == "clear":
+                # Everything before a clear is obsolete: restart the journal and blob store
+                lines = []
+                self._apply(op, value)
+                if os.path.isdir(self.blob_dir):
+                    shutil.rmtree(self.blob_dir, ignore_errors=True)
+                with open(self.journal_path, 'w', encoding='utf-8'):
+                    pass
+                self._journal_records = 0
+                continue
+            if op == "add" and value["id"] in blobs:
+                self._write_blob(value["id"], blobs[value["id"]])
+            elif op == "remove":
+                self._delete_blob(value)
+            self._apply(op, value)
+            lines.append(json.dumps({"op": op, "value": value}, ensure_ascii=False) + "\n")
+
+        if lines:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+            self._journal_records += len(lines)
+
+        if self._journal_records > self.COMPACT_FACTOR * self.limit:
+            self._compact(written_blobs=blobs)
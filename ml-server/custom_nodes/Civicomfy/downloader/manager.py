@@ -1,6 +1,8 @@
 # ================================================
 # File: downloader/manager.py
 # ================================================
+import asyncio
+import itertools
 import threading
 import time
 import datetime
@@ -15,9 +17,14 @@ from typing import List, Dict, Any, Optional, TYPE_CHECKING
 if TYPE_CHECKING:
     from .chunk_downloader import ChunkDownloader
 
+from ..utils.http_pool import get_session
+from ..utils.dir_index import dir_index
+from .history_store import HistoryStore
+
 from ..config import (
     MAX_CONCURRENT_DOWNLOADS, DOWNLOAD_HISTORY_LIMIT, DEFAULT_CONNECTIONS,
-    METADATA_SUFFIX, PREVIEW_SUFFIX, METADATA_DOWNLOAD_TIMEOUT, PLUGIN_ROOT 
+    METADATA_SUFFIX, PREVIEW_SUFFIX, METADATA_DOWNLOAD_TIMEOUT, PLUGIN_ROOT,
+    RESUMABLE_DOWNLOADS, DOWNLOAD_ENGINE
 )
 try:
     from folder_paths import get_directory_by_type, get_valid_path, base_path
@@ -27,25 +34,84 @@ except ImportError:
     COMFY_PATHS_AVAILABLE = False
     base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 
-# --- Define History File Path ---
-# Place it in the root of the extension directory
+# --- Define History File Paths ---
+# Place them in the root of the extension directory
+HISTORY_JOURNAL_PATH = os.path.join(PLUGIN_ROOT, "download_history.jsonl")
+HISTORY_BLOB_DIR = os.path.join(PLUGIN_ROOT, "download_history_blobs")
+# Pre-journal whole-file history; migrated on first start
 HISTORY_FILE_PATH = os.path.join(PLUGIN_ROOT, "download_history.json")
 
+def _create_async_engine():
+    """Builds the asyncio engine on ComfyUI's server loop, or returns None if unavailable."""
+    try:
+        import server
+        loop = getattr(getattr(server.PromptServer, "instance", None), "loop", None)
+        if loop is None or loop.is_closed():
+            print("[Civicomfy Manager] Warning: ComfyUI event loop not available. Using threaded download engine.")
+            return None
+        from .async_engine import AsyncDownloadEngine
+        return AsyncDownloadEngine(loop)
+    except ImportError as e:
+        print(f"[Civicomfy Manager] Warning: Async download engine unavailable ({e}). Using threaded download engine.")
+        return None
+
+class _LiveProgress:
+    """Progress/speed of one active download, written by its downloader without the manager lock.
+
+    Each field is replaced by a single attribute store (atomic under the GIL), so progress
+    ticks never contend with the scheduler; readers may see values from adjacent ticks.
+    """
+    __slots__ = ("progress", "speed", "seq")
+
+    def __init__(self, progress: float = 0, speed: float = 0, seq: int = 0):
+        self.progress = progress
+        self.speed = speed
+        self.seq = seq  # Status sequence number of the latest tick
+
+
 class DownloadManager:
     """Manages a queue of downloads, running them concurrently and saving metadata."""
+    # Fields to exclude when sending status to UI
+    EXCLUDE_FIELDS_FOR_UI = [
+        'downloader_instance', 'civitai_model_info', 'civitai_version_info',
+        'api_key', # Don't send API key to frontend status
+        # Large potentially redundant fields:
+        'url', 'output_path', 'custom_filename', 'model_url_or_id',
+        # Keep 'thumbnail', 'filename', 'model_name', 'version_name' etc for display
+    ]
+    REMOVED_IDS_KEPT = 500 # Removed entries remembered for deltas; older clients get a full status
 
     def __init__(self, max_concurrent: int = MAX_CONCURRENT_DOWNLOADS):
         self.queue: List[Dict[str, Any]] = []
         self.active_downloads: Dict[str, Dict[str, Any]] = {} # {download_id: download_info}
-        # History now stores more complete dictionaries for retry functionality
+        # In-memory history holds light entries; retry data lives in the store's metadata blobs
         self.history: List[Dict[str, Any]] = []
+        self._history_store = HistoryStore(HISTORY_JOURNAL_PATH, HISTORY_BLOB_DIR, DOWNLOAD_HISTORY_LIMIT,
+                                           legacy_path=HISTORY_FILE_PATH)
         self.lock: threading.Lock = threading.Lock()
+        # Signalled on enqueue, terminal status and shutdown; the threaded scheduler waits on it
+        self._queue_changed = threading.Condition(self.lock)
+        self._live_progress: Dict[str, _LiveProgress] = {}
+        # Versioned status feed: every change takes the next number from _status_seq (next() on
+        # itertools.count is atomic, so lock-free progress ticks can take numbers too)
+        self._status_seq = itertools.count(1)
+        self._changed_at: Dict[str, int] = {} # {download_id: seq of last change}
+        self._removed_at: Dict[str, int] = {} # {download_id: seq of removal}
+        self._delta_floor = 0 # Clients older than this need a full status
+        self._status_listeners: List[Any] = []
         self.max_concurrent: int = max(1, max_concurrent)
         self.running: bool = True
         self._load_history_from_file()
-        self._process_thread: threading.Thread = threading.Thread(target=self._process_queue, daemon=True)
-        print(f"Civitai Download Manager starting (Max Concurrent: {self.max_concurrent}).")
-        self._process_thread.start()
+        # Async engine: downloads are tasks on ComfyUI's loop and the queue advances on events
+        self.engine = _create_async_engine() if DOWNLOAD_ENGINE == "async" else None
+        self._tasks = set()
+        self._process_thread: Optional[threading.Thread] = None
+        if self.engine:
+            print(f"Civitai Download Manager starting (Max Concurrent: {self.max_concurrent}, Engine: async).")
+        else:
+            self._process_thread = threading.Thread(target=self._process_queue, daemon=True)
+            print(f"Civitai Download Manager starting (Max Concurrent: {self.max_concurrent}).")
+            self._process_thread.start()
 
     # --- add_to_queue remains largely the same, ensuring all necessary fields are initialized ---
     def add_to_queue(self, download_info: Dict[str, Any]) -> str:
@@ -89,10 +155,25 @@ class DownloadManager:
                     else:
                         download_info[key] = None
                     print(f"[Manager Warning] Queued item '{download_id}' missing '{key}', added default.")
+            # Keep partial parts on failure so a retry can resume them
+            download_info.setdefault("resume", RESUMABLE_DOWNLOADS)
 
             self.queue.append(download_info)
+            self._touch(download_id)
             print(f"[Manager] Queued: {download_info.get('filename', 'N/A')} (ID: {download_id}, Size: {download_info.get('known_size', 'Unknown')})")
-            return download_id
+        self._wake()
+        return download_id
+
+    def _wake(self):
+        """Wakes the scheduler after the queue or the set of active downloads changed."""
+        if self.engine:
+            try:
+                self.engine.loop.call_soon_threadsafe(self._schedule_downloads)
+            except RuntimeError:
+                pass  # Loop closed (shutdown)
+        else:
+            with self.lock:
+                self._queue_changed.notify()
 
     # --- cancel_download remains the same ---
     def cancel_download(self, download_id: str) -> bool:
@@ -127,6 +208,7 @@ class DownloadManager:
                     print(f"[Manager] Marking 'starting' download as cancelled: {download_id}")
                     # Mark as cancelled, it won't start or will be caught by wrapper
                     active_info["status"] = "cancelled"
+                    self._touch(download_id)
                     if not active_info.get("end_time"):
                         active_info["end_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
                     active_info["error"] = "Cancelled before download thread fully started"
@@ -176,109 +258,113 @@ class DownloadManager:
         return False # Should have returned True earlier if successful
 
     # --- get_status remains the same (still strips data for UI) ---
-    def get_status(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Returns the current state of the queue, active downloads, and history.
-           Strips sensitive/large data for UI efficiency."""
-        with self.lock:
-            # Fields to exclude when sending status to UI
-            exclude_fields_for_ui = [
-                'downloader_instance', 'civitai_model_info', 'civitai_version_info',
-                'api_key', # Don't send API key to frontend status
-                # Large potentially redundant fields:
-                'url', 'output_path', 'custom_filename', 'model_url_or_id',
-                # Keep 'thumbnail', 'filename', 'model_name', 'version_name' etc for display
-            ]
-
-            # Prepare active downloads list
-            active_list = [
-                {k: v for k, v in item_data.items() if k not in exclude_fields_for_ui}
-                for item_id, item_data in self.active_downloads.items()
-            ]
+    # --- Status feed ---
+    def add_status_listener(self, callback):
+        """Registers callback() to be called (from any thread) after status changes."""
+        self._status_listeners.append(callback)
 
-            # Prepare history list similarly
-            history_list = [
-                {k: v for k, v in item_data.items() if k not in exclude_fields_for_ui}
-                for item_data in self.history[:DOWNLOAD_HISTORY_LIMIT]
-            ]
+    def _notify_status_listeners(self):
+        for callback in self._status_listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[Manager] Warning: Status listener failed: {e}")
+
+    def _touch(self, download_id: str):
+        """Records a change to an entry. Assumes self.lock is HELD."""
+        self._changed_at[download_id] = next(self._status_seq)
+        self._removed_at.pop(download_id, None)
+        self._notify_status_listeners()
+
+    def _forget(self, download_id: str):
+        """Records that an entry left the status (e.g. trimmed history). Assumes self.lock is HELD."""
+        self._changed_at.pop(download_id, None)
+        self._removed_at[download_id] = next(self._status_seq)
+        if len(self._removed_at) > self.REMOVED_IDS_KEPT:
+            # Dict keeps insertion order: drop the oldest half, clients behind it get a full status
+            dropped = list(self._removed_at)[:len(self._removed_at) // 2]
+            self._delta_floor = max(self._delta_floor, max(self._removed_at[i] for i in dropped))
+            for i in dropped:
+                del self._removed_at[i]
+        self._notify_status_listeners()
+
+    def _ui_item(self, item_data: Dict[str, Any]) -> Dict[str, Any]:
+        """UI copy of an entry (with the latest lock-free progress). Assumes self.lock is HELD."""
+        item = {k: v for k, v in item_data.items() if k not in self.EXCLUDE_FIELDS_FOR_UI}
+        live = self._live_progress.get(item_data.get("id"))
+        if live is not None:
+            item["progress"] = live.progress
+            item["speed"] = live.speed
+        return item
+
+    def _status_sections(self) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            "queue": self.queue,
+            "active": list(self.active_downloads.values()),
+            "history": self.history[:DOWNLOAD_HISTORY_LIMIT],
+        }
 
-            # Return copies
-            return {
-                "queue": [
-                    {k:v for k,v in item.items() if k not in exclude_fields_for_ui}
-                    for item in self.queue
-                ],
-                "active": active_list,
-                "history": history_list,
-            }
+    def get_status(self) -> Dict[str, Any]:
+        """Returns the current state of the queue, active downloads, and history.
+           Strips sensitive/large data for UI efficiency. 'seq' can be passed to get_status_delta()."""
+        with self.lock:
+            status = {name: [self._ui_item(item) for item in items]
+                      for name, items in self._status_sections().items()}
+            status["seq"] = next(self._status_seq)
+            return status
+
+    def get_items(self, download_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """UI copies of the given entries (queued, active or in history), keyed by id; unknown ids are left out."""
+        wanted = set(download_ids)
+        found = {}
+        with self.lock:
+            for items in self._status_sections().values():
+                for item in items:
+                    if item.get("id") in wanted:
+                        found[item["id"]] = ui_item = self._ui_item(item)
+                        # Size learned from the server (HEAD) once the download started
+                        downloader = item.get("downloader_instance")
+                        if not ui_item.get("known_size") and getattr(downloader, "total_size", 0):
+                            ui_item["known_size"] = downloader.total_size
+        return found
+
+    def get_status_delta(self, since: int) -> Dict[str, Any]:
+        """Returns only the entries changed after sequence number `since`.
+
+        Delta: {"seq", "full": False, "changed": [entry + "section"], "removed": [ids],
+        "order": {section: [ids]}}. Falls back to get_status() plus "full": True when
+        `since` is 0 or too old to reconstruct.
+        """
+        with self.lock:
+            if since <= 0 or since < self._delta_floor:
+                status = {name: [self._ui_item(item) for item in items]
+                          for name, items in self._status_sections().items()}
+                status["seq"] = next(self._status_seq)
+                status["full"] = True
+                return status
+
+            changed, order = [], {}
+            for name, items in self._status_sections().items():
+                order[name] = []
+                for item in items:
+                    download_id = item.get("id")
+                    order[name].append(download_id)
+                    live = self._live_progress.get(download_id)
+                    if self._changed_at.get(download_id, 0) > since or (live is not None and live.seq > since):
+                        entry = self._ui_item(item)
+                        entry["section"] = name
+                        changed.append(entry)
+            removed = [download_id for download_id, seq in self._removed_at.items() if seq > since]
+            return {"seq": next(self._status_seq), "full": False, "changed": changed, "removed": removed, "order": order}
 
     def _load_history_from_file(self):
-        """Loads download history from the JSON file."""
+        """Loads download history from the journal (light entries only)."""
         # No lock needed here as it's called during __init__ before the thread starts
-        if not os.path.exists(HISTORY_FILE_PATH):
-            print(f"[Manager] History file not found ({HISTORY_FILE_PATH}). Starting with empty history.")
-            self.history = []
-            return
+        self.history = self._history_store.load()[:DOWNLOAD_HISTORY_LIMIT]
 
-        try:
-            with open(HISTORY_FILE_PATH, 'r', encoding='utf-8') as f:
-                loaded_data = json.load(f)
-
-            if isinstance(loaded_data, list):
-                # Basic validation: Ensure items have IDs (optional but good)
-                validated_history = [item for item in loaded_data if isinstance(item, dict) and 'id' in item]
-                invalid_count = len(loaded_data) - len(validated_history)
-                if invalid_count > 0:
-                    print(f"[Manager Warning] {invalid_count} items removed from loaded history due to missing 'id'.")
-
-                # Ensure history limit
-                self.history = validated_history[:DOWNLOAD_HISTORY_LIMIT]
-                print(f"[Manager] Successfully loaded {len(self.history)} items from {HISTORY_FILE_PATH}.")
-            else:
-                print(f"[Manager Warning] History file ({HISTORY_FILE_PATH}) contained invalid data (not a list). Starting fresh.")
-                self.history = []
-                # Optionally try to delete the corrupted file?
-                # try: os.remove(HISTORY_FILE_PATH) except Exception: pass
-
-        except json.JSONDecodeError as e:
-             print(f"[Manager Error] Failed to parse history file ({HISTORY_FILE_PATH}): {e}. Starting fresh.")
-             self.history = []
-             # Optionally try to delete the corrupted file?
-        except Exception as e:
-            print(f"[Manager Error] Failed to read history file ({HISTORY_FILE_PATH}): {e}. Starting fresh.")
-            self.history = []
-
-    # --- Save History Method ---
-    def _save_history_to_file(self):
-        """Saves the current in-memory history list to the JSON file."""
-        # Assumes self.lock is HELD when this is called
-        history_to_save = self.history[:DOWNLOAD_HISTORY_LIMIT] # Ensure limit before saving
-
-        try:
-            # Ensure directory exists (should already, but belt-and-suspenders)
-            os.makedirs(os.path.dirname(HISTORY_FILE_PATH), exist_ok=True)
-
-            # Write atomically (write to temp then rename) to reduce corruption risk
-            temp_file_path = HISTORY_FILE_PATH + ".tmp"
-            with open(temp_file_path, 'w', encoding='utf-8') as f:
-                json.dump(history_to_save, f, indent=2, ensure_ascii=False) # Pretty print
-
-            os.replace(temp_file_path, HISTORY_FILE_PATH) # Atomic rename/replace
-            # print(f"[Manager] Saved {len(history_to_save)} items to history file.") # Can be noisy
-
-        except Exception as e:
-             # Log error, but don't crash the manager
-             print(f"[Manager Error] Failed to save history file ({HISTORY_FILE_PATH}): {e}")
-             # Attempt to remove temp file if it exists
-             if os.path.exists(temp_file_path):
-                  try: os.remove(temp_file_path)
-                  except Exception: pass
-
-    # --- Updated _add_to_history Method ---
     def _add_to_history(self, download_info: Dict[str, Any]):
         """Adds a completed/failed/cancelled item to history (internal).
-           Stores most original parameters needed for potential retry.
-           NOW ALSO TRIGGERS SAVING HISTORY TO FILE."""
-        # --- (Keep existing logic to prepare info_copy) ---
+           Safe under self.lock: the store's background writer does the file I/O."""
         info_copy = {
             k: v for k, v in download_info.items()
             if k not in ['downloader_instance']
@@ -290,62 +376,30 @@ class DownloadManager:
         if info_copy["status"] != "completed" and not info_copy.get("error"):
             info_copy["error"] = f"Finished with status '{info_copy['status']}' but no error recorded."
 
-        # --- Update in-memory history ---
-        self.history.insert(0, info_copy) # Prepend
-        # Trim in-memory list (save will also respect limit)
+        # --- Update in-memory history (metadata blobs stay with the store) ---
+        self.history.insert(0, self._history_store.add(info_copy)) # Prepend
+        self._touch(info_copy["id"])
         if len(self.history) > DOWNLOAD_HISTORY_LIMIT:
+            for trimmed in self.history[DOWNLOAD_HISTORY_LIMIT:]:
+                self._forget(trimmed.get("id"))
             self.history = self.history[:DOWNLOAD_HISTORY_LIMIT]
 
-        # --- Trigger Save to File (still under lock) ---
-        self._save_history_to_file() # <--- Added call
-
-    # --- Updated clear_history Method ---
     def clear_history(self) -> Dict[str, Any]:
-        """Clears the download history (in-memory and the JSON file)."""
-        cleared_count = 0
-        file_deleted = False
-        error_msg = None
-
+        """Clears the download history (in-memory and the journal)."""
         try:
             with self.lock:
                 cleared_count = len(self.history)
-                if cleared_count > 0:
-                    print(f"[Manager] Clearing {cleared_count} items from in-memory history.")
-                    self.history = [] # Clear memory list first
-
-                    # Attempt to delete the history file
-                    if os.path.exists(HISTORY_FILE_PATH):
-                        try:
-                            os.remove(HISTORY_FILE_PATH)
-                            file_deleted = True
-                            print(f"[Manager] Deleted history file: {HISTORY_FILE_PATH}")
-                        except OSError as e:
-                            error_msg = f"Failed to delete history file {HISTORY_FILE_PATH}: {e}"
-                            print(f"[Manager Error] {error_msg}")
-                    else:
-                        print(f"[Manager] History file ({HISTORY_FILE_PATH}) did not exist, nothing to delete.")
-                        file_deleted = True # Consider success if file wasn't there anyway
-
-                else:
-                    print("[Manager] History clear request received, but history was already empty.")
-                    # Should we still check/delete the file just in case? Yes.
-                    if os.path.exists(HISTORY_FILE_PATH):
-                        try:
-                            os.remove(HISTORY_FILE_PATH)
-                            file_deleted = True
-                            print(f"[Manager] Deleted potentially orphaned history file: {HISTORY_FILE_PATH}")
-                        except OSError as e:
-                             error_msg = f"Failed to delete potentially orphaned history file {HISTORY_FILE_PATH}: {e}"
-                             print(f"[Manager Error] {error_msg}")
-                    else:
-                        file_deleted = True # Success if clear requested and neither memory/file had anything
+                self.history = []
+                self._history_store.clear()
+                # Every client has to drop its copy of history: make them refetch in full
+                self._delta_floor = next(self._status_seq)
+                self._notify_status_listeners()
 
-            if error_msg:
-                 return {"success": False, "error": f"History cleared from memory, but could not delete file: {error_msg}"}
-            elif cleared_count > 0:
+            if cleared_count > 0:
+                 print(f"[Manager] Cleared {cleared_count} items from history.")
                  return {"success": True, "message": f"Cleared {cleared_count} history items (memory and file)."}
             else:
-                 # If count was 0 but file deletion was attempted/succeeded
+                 print("[Manager] History clear request received, but history was already empty.")
                  return {"success": True, "message": "History was already empty."}
 
         except Exception as e:
@@ -353,75 +407,130 @@ class DownloadManager:
             import traceback
             traceback.print_exc()
             return {"success": False, "error": f"Failed to clear history due to unexpected error: {e}"}
-        
-    # --- _process_queue remains the same ---
+
+    def _move_finished_to_history(self) -> bool:
+        """Moves finished/failed/cancelled active downloads to history. Assumes self.lock is HELD."""
+        processed_something = False
+        finished_ids = [
+            dl_id for dl_id, info in self.active_downloads.items()
+            if info.get("status") in ["completed", "failed", "cancelled"] # Use .get() for safety
+        ]
+        for dl_id in finished_ids:
+            # Check if still in active_downloads before popping (might have been removed by another thread edge case?)
+            if dl_id in self.active_downloads:
+                finished_info = self.active_downloads.pop(dl_id)
+                live = self._live_progress.pop(dl_id, None)
+                if live is not None:
+                    finished_info["progress"] = live.progress
+                    finished_info["speed"] = live.speed
+                self._add_to_history(finished_info) # Will now store more data
+                print(f"[Manager] Moved '{finished_info.get('filename', dl_id)}' to history (Status: {finished_info['status']})")
+                processed_something = True
+            else:
+                 print(f"[Manager] Warning: Item {dl_id} intended for history was already removed from active list.")
+        return processed_something
+
+    def _start_queued_downloads(self, start_download) -> bool:
+        """Starts queued downloads while slots are free. Assumes self.lock is HELD."""
+        processed_something = False
+        while len(self.active_downloads) < self.max_concurrent and self.queue:
+            download_info = self.queue.pop(0)
+            download_id = download_info["id"]
+
+             # Double check if cancelled just before starting
+            if download_info["status"] == "cancelled":
+                # Ensure it has an end time before adding to history
+                if not download_info.get("end_time"):
+                     download_info["end_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                self._add_to_history(download_info)
+                print(f"[Manager] Skipping cancelled item from queue: {download_id}")
+                processed_something = True
+                continue
+
+            # Update status to 'starting'
+            download_info["status"] = "starting"
+            download_info["start_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            download_info["downloader_instance"] = None # Placeholder
+
+            # Add to active downloads BEFORE starting thread
+            self.active_downloads[download_id] = download_info
+            self._live_progress[download_id] = _LiveProgress(download_info.get("progress", 0), 0)
+            self._touch(download_id)
+            start_download(download_info)
+            processed_something = True
+        return processed_something
+
+    def _start_download_thread(self, download_info: Dict[str, Any]):
+        # Start download in a separate thread
+        thread = threading.Thread(
+            target=self._download_file_wrapper,
+            args=(download_info,),
+            daemon=True # Ensure thread exits if main program exits
+        )
+        thread.start()
+        print(f"[Manager] Starting download thread for: {download_info.get('filename', 'N/A')} ({download_info['id']})")
+
     def _process_queue(self):
-        """Internal thread function to manage downloads."""
-        # ... (no changes needed here) ...
+        """Internal thread function to manage downloads (threaded engine).
+           Sleeps on _queue_changed until an enqueue, a terminal status or shutdown."""
         print("[Manager] Process queue thread started.")
-        while self.running:
-            processed_something = False
-            with self.lock:
+        with self.lock:
+            while self.running:
                 # 1. Check for finished/failed/cancelled active downloads to move to history
-                finished_ids = [
-                    dl_id for dl_id, info in self.active_downloads.items()
-                    if info.get("status") in ["completed", "failed", "cancelled"] # Use .get() for safety
-                ]
-                for dl_id in finished_ids:
-                    # Check if still in active_downloads before popping (might have been removed by another thread edge case?)
-                    if dl_id in self.active_downloads:
-                        finished_info = self.active_downloads.pop(dl_id)
-                        self._add_to_history(finished_info) # Will now store more data
-                        print(f"[Manager] Moved '{finished_info.get('filename', dl_id)}' to history (Status: {finished_info['status']})")
-                        processed_something = True
-                    else:
-                         print(f"[Manager] Warning: Item {dl_id} intended for history was already removed from active list.")
-
+                processed_something = self._move_finished_to_history()
                 # 2. Start new downloads if slots available and queue has items
-                while len(self.active_downloads) < self.max_concurrent and self.queue:
-                    download_info = self.queue.pop(0)
-                    download_id = download_info["id"]
-
-                     # Double check if cancelled just before starting
-                    if download_info["status"] == "cancelled":
-                        # Ensure it has an end time before adding to history
-                        if not download_info.get("end_time"):
-                             download_info["end_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
-                        self._add_to_history(download_info)
-                        print(f"[Manager] Skipping cancelled item from queue: {download_id}")
-                        processed_something = True
-                        continue
-
-                    # Update status to 'starting'
-                    download_info["status"] = "starting"
-                    download_info["start_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
-                    download_info["downloader_instance"] = None # Placeholder
-
-                    # Add to active downloads BEFORE starting thread
-                    self.active_downloads[download_id] = download_info
-
-                    # Start download in a separate thread
-                    thread = threading.Thread(
-                        target=self._download_file_wrapper,
-                        args=(download_info,),
-                        daemon=True # Ensure thread exits if main program exits
-                    )
-                    thread.start()
-                    print(f"[Manager] Starting download thread for: {download_info.get('filename', 'N/A')} ({download_id})")
-                    processed_something = True
-
-            # Sleep only if nothing was processed to avoid busy-waiting
-            if not processed_something:
-                time.sleep(0.5) # Small delay before checking again
+                processed_something = self._start_queued_downloads(self._start_download_thread) or processed_something
+
+                if not processed_something:
+                    self._queue_changed.wait()
 
         print("[Manager] Process queue thread stopped.")
 
+    # --- Async engine: event-driven scheduling on ComfyUI's loop ---
+    def _schedule_downloads(self):
+        """Starts queued downloads as tasks while slots are free (runs on the engine's loop)."""
+        if not self.running:
+            return
+        with self.lock:
+            self._start_queued_downloads(self._start_download_task)
+
+    def _start_download_task(self, download_info: Dict[str, Any]):
+        task = self.engine.loop.create_task(self._download_task(download_info))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        print(f"[Manager] Starting download task for: {download_info.get('filename', 'N/A')} ({download_info['id']})")
+
+    def _finish_download_task(self):
+        with self.lock:
+            self._move_finished_to_history()
+
    # --- _update_download_status remains the same ---
+    def _record_download_hashes(self, download_id: str, digests: Dict[str, str], verified: Optional[bool]):
+        """Stores the digest computed while downloading on the active item (kept in history and
+           .cminfo.json, so later integrity checks don't have to re-read the file)."""
+        with self.lock:
+            item = self.active_downloads.get(download_id)
+            if item is not None:
+                item["sha256"] = digests.get("SHA256")
+                item["hash_verified"] = verified
+                self._touch(download_id)
+
     def _update_download_status(self, download_id: str, status: Optional[str] = None,
                                 progress: Optional[float] = None, speed: Optional[float] = None,
                                 error: Optional[str] = None, connection_type: Optional[str] = None):
-        """Safely updates the status fields of an active download (thread-safe)."""
-        # ... (no changes needed here) ...
+        """Safely updates the status fields of an active download (thread-safe).
+           Progress/speed-only ticks go to the download's _LiveProgress without taking the lock."""
+        if status is None and error is None and connection_type is None:
+            live = self._live_progress.get(download_id)
+            if live is not None:
+                if progress is not None:
+                    live.progress = max(0.0, min(100.0, progress))
+                if speed is not None:
+                    live.speed = max(0.0, speed)
+                live.seq = next(self._status_seq)
+                self._notify_status_listeners()
+                return
+
         with self.lock:
             if download_id in self.active_downloads:
                 item = self.active_downloads[download_id]
@@ -430,9 +539,11 @@ class DownloadManager:
                 if status is not None and item.get("status") != status:
                     item["status"] = status
                     updated = True
-                    # If status becomes terminal, record end time
-                    if status in ["completed", "failed", "cancelled"] and not item.get("end_time"):
-                        item["end_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                    # If status becomes terminal, record end time and let the scheduler free the slot
+                    if status in ["completed", "failed", "cancelled"]:
+                        if not item.get("end_time"):
+                            item["end_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                        self._queue_changed.notify()
                 if progress is not None:
                     # Clamp progress between 0 and 100
                     clamped_progress = max(0.0, min(100.0, progress))
@@ -445,6 +556,10 @@ class DownloadManager:
                     if item.get("speed") != clamped_speed: # Update if different
                          item["speed"] = clamped_speed
                          updated = True
+                live = self._live_progress.get(download_id)
+                if live is not None:
+                    live.progress = item.get("progress", 0)
+                    live.speed = item.get("speed", 0)
                 if error is not None and item.get("error") != error:
                     # Update error only if it's new or different
                     item["error"] = str(error)[:500] # Limit length
@@ -452,6 +567,8 @@ class DownloadManager:
                 if connection_type is not None and connection_type != "N/A" and item.get("connection_type") != connection_type: # Only update if not N/A and different
                     item["connection_type"] = connection_type
                     updated = True
+                if updated:
+                    self._touch(download_id)
 
     # --- _save_civitai_metadata remains the same ---
     def _save_civitai_metadata(self, download_info: Dict[str, Any]):
@@ -501,6 +618,8 @@ class DownloadManager:
                 },
                 "ImportedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
                 "Hashes": primary_file.get('hashes', {}),
+                "DownloadedSHA256": download_info.get('sha256'),
+                "HashVerified": download_info.get('hash_verified'),
                 "TrainedWords": version_info.get('trainedWords', []),
                 "Stats": {
                     "downloadCount": version_stats.get('downloadCount', model_stats.get('downloadCount', 0)),
@@ -572,7 +691,7 @@ class DownloadManager:
         try:
             headers = {}
             if api_key: headers["Authorization"] = f"Bearer {api_key}"
-            response = requests.get(thumbnail_url, stream=True, headers=headers, timeout=METADATA_DOWNLOAD_TIMEOUT, allow_redirects=True)
+            response = get_session(thumbnail_url).get(thumbnail_url, stream=True, headers=headers, timeout=METADATA_DOWNLOAD_TIMEOUT, allow_redirects=True)
             response.raise_for_status()
             content_type = response.headers.get('Content-Type', '').lower()
             if not content_type.startswith('image/'):
@@ -589,95 +708,177 @@ class DownloadManager:
         finally:
             if response: response.close()
 
-    # --- _download_file_wrapper remains the same ---
-    def _download_file_wrapper(self, download_info: Dict[str, Any]):
-        """Wraps the download execution, handles status updates, exceptions, and metadata saving."""
-        # ... (no changes needed here) ...
+    def _link_downloader(self, download_info: Dict[str, Any], downloader_cls, **kwargs):
+        """Creates the downloader and links it to the active item; None if cancelled before start."""
         download_id = download_info["id"]
         filename = download_info.get('filename', download_id)
+        print(f"[Downloader Wrapper {download_id}] Preparing download for '{filename}'.")
+        local_source = download_info.get("local_source")
+        if local_source and os.path.isfile(local_source):
+            # The route found this file on disk already: link/copy it instead of downloading
+            from .model_store import LocalCopyDownloader
+            downloader_cls = LocalCopyDownloader
+            kwargs = {"source_path": local_source, "source_entry": download_info.get("local_source_entry")}
+        downloader = downloader_cls(
+            url=download_info["url"],
+            output_path=download_info["output_path"],
+            num_connections=download_info.get("num_connections", DEFAULT_CONNECTIONS),
+            manager=self,
+            download_id=download_id,
+            api_key=download_info.get("api_key"),
+            known_size=download_info.get("known_size"),
+            resumable=download_info.get("resume", RESUMABLE_DOWNLOADS),
+            expected_hashes=(download_info.get("civitai_primary_file") or {}).get("hashes"),
+            priority=download_info.get("priority"),
+            **kwargs
+        )
+
+        with self.lock:
+              cancelled = download_id not in self.active_downloads or self.active_downloads[download_id]["status"] == "cancelled"
+              if not cancelled:
+                   self.active_downloads[download_id]["downloader_instance"] = downloader
+
+        if cancelled:
+             # Outside the lock: _update_download_status takes it (non-reentrant) itself
+             print(f"[Downloader Wrapper {download_id}] Download was cancelled before instance could be fully linked/started.")
+             self._update_download_status(download_id, status="cancelled", error="Cancelled before start")
+             return None
+
+        self._update_download_status(download_id, status="downloading")
+        print(f"[Downloader Wrapper {download_id}] Starting download process for '{filename}'.")
+        return downloader
+
+    def _download_outcome(self, download_info: Dict[str, Any], downloader: 'ChunkDownloader', success: bool):
+        """Returns (final_status, error_msg) for a finished downloader."""
+        download_id = download_info["id"]
+        filename = download_info.get('filename', download_id)
+        error_msg = downloader.error
+
+        if success:
+            final_status = "completed"
+            print(f"[Downloader Wrapper {download_id}] Download completed successfully for '{filename}'.")
+        elif downloader.is_cancelled:
+            final_status = "cancelled"
+            error_msg = downloader.error or "Download cancelled"
+            print(f"[Downloader Wrapper {download_id}] Download cancelled for '{filename}'. Reason: {error_msg}")
+        else:
+            final_status = "failed"
+            error_msg = downloader.error or "Download failed with unknown error"
+            print(f"[Downloader Wrapper {download_id}] Download failed for '{filename}'. Error: {error_msg}")
+        return final_status, error_msg
+
+    def _save_download_extras(self, download_info: Dict[str, Any]):
+        """Saves the .cminfo.json and preview image next to a completed download."""
+        try:
+            if download_info.get("civitai_version_id"): # Plain URL downloads (batch manifests) have no Civitai metadata
+                self._save_civitai_metadata(download_info)
+                self._download_and_save_preview(download_info)
+            self._index_downloaded_file(download_info)
+            dir_index.add_dir(os.path.dirname(download_info["output_path"]))
+        except Exception as meta_err:
+             print(f"[Downloader Wrapper {download_info['id']}] Error during post-download metadata/preview saving: {meta_err}")
+
+    def _index_downloaded_file(self, download_info: Dict[str, Any]):
+        """Adds a completed download to the local model index so later requests can reuse it."""
+        from .model_store import model_index
+        primary_file = download_info.get('civitai_primary_file') or {}
+        model_index.add_file(
+            download_info["output_path"],
+            sha256=download_info.get("sha256") or (primary_file.get("hashes") or {}).get("SHA256"),
+            version_id=download_info.get("civitai_version_id"),
+            file_id=download_info.get("civitai_file_id"),
+            verified=download_info.get("hash_verified"),
+        )
+
+    def _wrapper_error(self, download_info: Dict[str, Any], downloader: Optional['ChunkDownloader'], e: Exception) -> str:
+        import traceback
+        print(f"--- Critical Error in Download Wrapper {download_info['id']} ('{download_info.get('filename', download_info['id'])}') ---")
+        traceback.print_exc()
+        print("--- End Error ---")
+        if downloader and not downloader.is_cancelled:
+            try: downloader.cancel()
+            except: pass
+        return f"Unexpected wrapper error: {str(e)}"
+
+    def _finalize_download(self, download_info: Dict[str, Any], downloader: Optional['ChunkDownloader'],
+                           final_status: str, error_msg: Optional[str]):
+        download_id = download_info["id"]
+        final_progress_percent = 0
+        conn_type = download_info.get("connection_type", "N/A")
+
+        if downloader:
+             conn_type = downloader.connection_type
+             if downloader.total_size and downloader.total_size > 0:
+                  final_progress_percent = (downloader.downloaded / downloader.total_size * 100)
+             if final_status == "completed": final_progress_percent = 100.0
+             final_progress_percent = min(100.0, max(0.0, final_progress_percent))
+
+        print(f"[Downloader Wrapper {download_id}] Finalizing status: {final_status}, Error: {error_msg}")
+        self._update_download_status(
+            download_id, status=final_status, progress=final_progress_percent,
+            speed=0, error=error_msg, connection_type=conn_type
+        )
+        if final_status == "completed":
+             print(f"[Manager] Download {download_id} completed ('{download_info.get('filename', download_id)}'). Manual ComfyUI refresh may be needed for model list.")
+
+    def _download_file_wrapper(self, download_info: Dict[str, Any]):
+        """Wraps the download execution, handles status updates, exceptions, and metadata saving."""
         from .chunk_downloader import ChunkDownloader
         downloader = None
-        success = False
         final_status = "failed"
         error_msg = None
 
         try:
-            print(f"[Downloader Wrapper {download_id}] Preparing download for '{filename}'.")
-            downloader = ChunkDownloader(
-                url=download_info["url"],
-                output_path=download_info["output_path"],
-                num_connections=download_info.get("num_connections", DEFAULT_CONNECTIONS),
-                manager=self,
-                download_id=download_id,
-                api_key=download_info.get("api_key"),
-                known_size=download_info.get("known_size")
-            )
+            downloader = self._link_downloader(download_info, ChunkDownloader)
+            if downloader is None:
+                return
+            success = downloader.download() # Blocking call
+            final_status, error_msg = self._download_outcome(download_info, downloader, success)
+            if final_status == "completed":
+                self._save_download_extras(download_info)
 
-            with self.lock:
-                  if download_id not in self.active_downloads or self.active_downloads[download_id]["status"] == "cancelled":
-                       print(f"[Downloader Wrapper {download_id}] Download was cancelled before instance could be fully linked/started.")
-                       self._update_download_status(download_id, status="cancelled", error="Cancelled before start")
-                       return
+        except Exception as e:
+            final_status = "failed"
+            error_msg = self._wrapper_error(download_info, downloader, e)
+
+        finally:
+            self._finalize_download(download_info, downloader, final_status, error_msg)
 
-                  self.active_downloads[download_id]["downloader_instance"] = downloader
+    async def _download_task(self, download_info: Dict[str, Any]):
+        """Async engine counterpart of _download_file_wrapper(); frees its slot as soon as it ends."""
+        from .async_engine import AsyncChunkDownloader
+        downloader = None
+        final_status = "failed"
+        error_msg = None
 
-            self._update_download_status(download_id, status="downloading")
-            print(f"[Downloader Wrapper {download_id}] Starting download process for '{filename}'.")
-            success = downloader.download() # Blocking call
+        try:
+            downloader = self._link_downloader(download_info, AsyncChunkDownloader, engine=self.engine)
+            if downloader is None:
+                return
+            success = await downloader.download_async()
+            final_status, error_msg = self._download_outcome(download_info, downloader, success)
+            if final_status == "completed":
+                await asyncio.to_thread(self._save_download_extras, download_info)
 
-            error_msg = downloader.error
-
-            if success:
-                final_status = "completed"
-                print(f"[Downloader Wrapper {download_id}] Download completed successfully for '{filename}'.")
-                try:
-                    self._save_civitai_metadata(download_info)
-                    self._download_and_save_preview(download_info)
-                except Exception as meta_err:
-                     print(f"[Downloader Wrapper {download_id}] Error during post-download metadata/preview saving: {meta_err}")
-
-            elif downloader.is_cancelled:
-                final_status = "cancelled"
-                error_msg = downloader.error or "Download cancelled"
-                print(f"[Downloader Wrapper {download_id}] Download cancelled for '{filename}'. Reason: {error_msg}")
-            else:
-                final_status = "failed"
-                error_msg = downloader.error or "Download failed with unknown error"
-                print(f"[Downloader Wrapper {download_id}] Download failed for '{filename}'. Error: {error_msg}")
+        except asyncio.CancelledError:
+            final_status = "cancelled"
+            error_msg = (downloader.error if downloader else None) or "Download task cancelled"
+            raise
 
         except Exception as e:
-            import traceback
-            print(f"--- Critical Error in Download Wrapper {download_id} ('{filename}') ---")
-            traceback.print_exc()
-            print("--- End Error ---")
             final_status = "failed"
-            error_msg = f"Unexpected wrapper error: {str(e)}"
-            if downloader and not downloader.is_cancelled:
-                try: downloader.cancel()
-                except: pass
+            error_msg = self._wrapper_error(download_info, downloader, e)
 
         finally:
-            final_progress_percent = 0
-            conn_type = download_info.get("connection_type", "N/A")
-
-            if downloader:
-                 conn_type = downloader.connection_type
-                 if downloader.total_size and downloader.total_size > 0:
-                      final_progress_percent = (downloader.downloaded / downloader.total_size * 100)
-                 if final_status == "completed": final_progress_percent = 100.0
-                 final_progress_percent = min(100.0, max(0.0, final_progress_percent))
-
-            print(f"[Downloader Wrapper {download_id}] Finalizing status: {final_status}, Error: {error_msg}")
-            self._update_download_status(
-                download_id, status=final_status, progress=final_progress_percent,
-                speed=0, error=error_msg, connection_type=conn_type
-            )
-            if final_status == "completed":
-                 print(f"[Manager] Download {download_id} completed ('{filename}'). Manual ComfyUI refresh may be needed for model list.")
+            self._finalize_download(download_info, downloader, final_status, error_msg)
+            await asyncio.to_thread(self._finish_download_task) # History save writes a file
+            self._schedule_downloads()
 
     # --- NEW: Retry Download Method ---
     def retry_download(self, original_download_id: str) -> Dict[str, Any]:
         """Finds a failed/cancelled download in history and re-queues it."""
+        # Model/version info needed by the new download lives in the store, read it outside the lock
+        stored_metadata = self._history_store.load_blob(original_download_id)
         with self.lock:
             # Find the original download info in history
             original_info = next((item for item in self.history if item.get("id") == original_download_id), None)
@@ -693,7 +894,7 @@ class DownloadManager:
             # Make a deep copy to avoid modifying the history item directly
             try:
                 retry_info = json.loads(json.dumps(original_info))
-                print(retry_info)
+                retry_info.update(stored_metadata)
             except Exception as e:
                  return {"success": False, "error": f"Failed to copy original download data: {e}"}
 
@@ -708,9 +909,18 @@ class DownloadManager:
             retry_info.pop("added_time", None)
             retry_info.pop("connection_type", None)
             retry_info.pop("downloader_instance", None) 
+            retry_info.pop("sha256", None)
+            retry_info.pop("hash_verified", None)
             # --- Crucially: Set force_redownload to True for retry ---
             # This ensures it overwrites the potentially corrupted/partial file from the previous attempt.
             retry_info["force_redownload"] = True
+            # Parts kept by the failed attempt live next to the same output path, so the new
+            # downloader picks up their journal and only requests the missing byte ranges.
+            from .chunk_downloader import ChunkDownloader
+            resuming = bool(retry_info.get("resume") and retry_info.get("output_path")
+                            and ChunkDownloader.has_resume_journal(retry_info["output_path"]))
+            if resuming:
+                print(f"[Manager] Retry of '{original_download_id}' will resume from its segment journal.")
 
             # --- Validate required fields for queuing (redundant check, but safe) ---
             required_for_retry = [
@@ -733,13 +943,17 @@ class DownloadManager:
                     # Filter out the item matching the original ID
                     self.history = [item for item in self.history if item.get("id") != original_download_id]
                     items_removed = original_len - len(self.history)
+                    if items_removed:
+                        self._history_store.remove(original_download_id)
+                        self._forget(original_download_id)
 
                     if items_removed == 1:
                         print(f"[Manager] Successfully removed original download '{original_download_id}' from history.")
                         return {
                             "success": True,
-                            "message": f"Retry initiated. New download queued. Original removed from history.",
-                            "new_download_id": new_download_id
+                            "message": f"Retry initiated{' (resuming partial download)' if resuming else ''}. New download queued. Original removed from history.",
+                            "new_download_id": new_download_id,
+                            "resumed": resuming
                         }
 
             else:
@@ -888,6 +1102,7 @@ def shutdown_manager():
     print("[Manager] Shutdown requested.")
     if manager:
         manager.running = False
+        manager._wake()
         acquired_lock = False
         try: acquired_lock = manager.lock.acquire(timeout=1.0)
         except RuntimeError: pass # Lock might not be initialised if init failed
@@ -915,6 +1130,10 @@ def shutdown_manager():
         else:
             print("[Manager] Warning: Could not acquire lock to cancel downloads during shutdown.")
 
+        if manager.engine:
+            manager.engine.close()
+        manager._history_store.close()
+
         # Attempt to join the manager's process thread (best effort)
         try:
             if manager._process_thread and manager._process_thread.is_alive():
@@ -0,0 +1,348 @@
+# ================================================
+# File: downloader/model_store.py
+# ================================================
+import asyncio
+import errno
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from .chunk_downloader import ChunkDownloader
+from .hash_verify import compare_hashes
+from ..config import PLUGIN_ROOT, METADATA_SUFFIX, MODEL_INDEX_RESCAN_INTERVAL, DEDUPE_LINK_MODES
+
+MODEL_INDEX_PATH = os.path.join(PLUGIN_ROOT, "model_index.json")
+MODEL_INDEX_VERSION = 1
+
+# Sidecar files written next to a model; never a model file themselves
+_SIDECAR_SUFFIXES = (METADATA_SUFFIX, ".preview.jpeg", ".preview.png", ".preview.webp", ".json", ".txt", ".md", ".yaml")
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelIndex:
+    """Content-addressed index of model files already on disk.
+
+    Maps Civitai SHA256 and (version id, file id) to every local path holding that file.
+    Entries come from the download pipeline (add_file) and from the .cminfo.json files
+    found when a model root is first scanned. Each entry records size and mtime, and a
+    lookup only returns a path whose file still matches them.
+    """
+
+    def __init__(self, path: str = MODEL_INDEX_PATH, rescan_interval: float = MODEL_INDEX_RESCAN_INTERVAL):
+        self.path = path
+        self.rescan_interval = rescan_interval
+        self.lock = threading.RLock()
+        self._loaded = False
+        self._files: Dict[str, Dict[str, Any]] = {}  # abs path -> entry
+        self._scanned_roots: Dict[str, float] = {}  # abs root -> last scan (epoch seconds)
+        self._by_sha: Dict[str, set] = {}
+        self._by_version: Dict[Tuple[int, Optional[int]], set] = {}
+
+    # --- Persistence ---
+    def _ensure_loaded(self):
+        """Loads the index file once (self.lock held)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == MODEL_INDEX_VERSION:
+                for path, entry in (data.get("files") or {}).items():
+                    self._put(path, entry)
+                self._scanned_roots = dict(data.get("scanned_roots") or {})
+            print(f"[Model Index] Loaded {len(self._files)} indexed model files.")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Model Index] Warning: Ignoring unreadable index {self.path}: {e}")
+
+    def _save(self):
+        """Atomically rewrites the index file (self.lock held)."""
+        data = {"version": MODEL_INDEX_VERSION, "files": self._files, "scanned_roots": self._scanned_roots}
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            print(f"[Model Index] Warning: Could not save index {self.path}: {e}")
+
+    # --- Entries ---
+    def _put(self, path: str, entry: Dict[str, Any]):
+        self._drop(path)
+        self._files[path] = entry
+        if entry.get("sha256"):
+            self._by_sha.setdefault(entry["sha256"], set()).add(path)
+        if entry.get("version_id") is not None:
+            self._by_version.setdefault((entry["version_id"], entry.get("file_id")), set()).add(path)
+
+    def _drop(self, path: str):
+        entry = self._files.pop(path, None)
+        if not entry:
+            return
+        for mapping, key in ((self._by_sha, entry.get("sha256")),
+                             (self._by_version, (entry.get("version_id"), entry.get("file_id")))):
+            paths = mapping.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del mapping[key]
+
+    @staticmethod
+    def _make_entry(path: str, sha256: Optional[str], version_id, file_id, verified: Optional[bool]) -> Optional[Dict[str, Any]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return {
+            "sha256": sha256.upper() if sha256 else None,
+            "version_id": _int_or_none(version_id),
+            "file_id": _int_or_none(file_id),
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "verified": verified,
+        }
+
+    def add_file(self, path: str, sha256: Optional[str] = None, version_id=None, file_id=None,
+                 verified: Optional[bool] = None):
+        """Records a model file (called by the download pipeline once a file is in place)."""
+        path = os.path.abspath(path)
+        entry = self._make_entry(path, sha256, version_id, file_id, verified)
+        if entry is None or (not entry["sha256"] and entry["version_id"] is None):
+            return
+        with self.lock:
+            self._ensure_loaded()
+            self._put(path, entry)
+            self._save()
+
+    def _is_current(self, path: str, entry: Dict[str, Any]) -> bool:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]
+
+    # --- Scanning ---
+    @staticmethod
+    def _model_files_by_stem(files: Iterable[str]) -> Dict[str, str]:
+        """Maps base name -> model file name for one directory listing (sidecars excluded)."""
+        by_stem = {}
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext and not name.lower().endswith(_SIDECAR_SUFFIXES):
+                by_stem.setdefault(stem, name)
+        return by_stem
+
+    def _scan_root(self, root: str) -> int:
+        """Indexes every model with a .cminfo.json under root. Returns the number of new entries."""
+        added = 0
+        for current, _dirs, files in os.walk(root):
+            metas = [name for name in files if name.endswith(METADATA_SUFFIX)]
+            if not metas:
+                continue
+            by_stem = self._model_files_by_stem(files)
+            for name in metas:
+                model_name = by_stem.get(name[:-len(METADATA_SUFFIX)])
+                if not model_name:
+                    continue
+                meta_path = os.path.join(current, name)
+                model_path = os.path.abspath(os.path.join(current, model_name))
+                with self.lock:
+                    known = self._files.get(model_path)
+                if known and self._is_current(model_path, known):
+                    continue
+                try:
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                except Exception:
+                    continue
+                sha256 = meta.get("DownloadedSHA256") or (meta.get("Hashes") or {}).get("SHA256")
+                entry = self._make_entry(model_path, sha256, meta.get("VersionId"), meta.get("PrimaryFileId"),
+                                         meta.get("HashVerified"))
+                if entry is None or (not entry["sha256"] and entry["version_id"] is None):
+                    continue
+                with self.lock:
+                    self._put(model_path, entry)
+                added += 1
+        return added
+
+    def ensure_scanned(self, roots: Iterable[str]):
+        """Scans roots not scanned within rescan_interval (blocking; call from a worker thread)."""
+        with self.lock:
+            self._ensure_loaded()
+            now = time.time()
+            due = [os.path.abspath(r) for r in roots
+                   if now - self._scanned_roots.get(os.path.abspath(r), 0) > self.rescan_interval]
+        due = [r for r in due if os.path.isdir(r)]
+        if not due:
+            return
+        started = time.monotonic()
+        added = sum(self._scan_root(root) for root in due)
+        with self.lock:
+            for root in due:
+                self._scanned_roots[root] = time.time()
+            self._save()
+        print(f"[Model Index] Scanned {len(due)} model roots in {time.monotonic() - started:.2f}s, {added} new entries.")
+
+    # --- Lookup ---
+    def find(self, sha256: Optional[str] = None, version_id=None, file_id=None,
+             size: Optional[int] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Returns (path, entry) of a local file with this content, preferring a SHA256 match.
+           A (version id, file id) match is only used when Civitai gave no SHA256."""
+        with self.lock:
+            self._ensure_loaded()
+            if sha256:
+                candidates = list(self._by_sha.get(sha256.upper(), ()))
+            else:
+                candidates = list(self._by_version.get((_int_or_none(version_id), _int_or_none(file_id)), ()))
+            entries = [(path, dict(self._files[path])) for path in candidates]
+
+        stale = []
+        found = None
+        for path, entry in entries:
+            if not self._is_current(path, entry):
+                stale.append(path)
+                continue
+            if size and abs(entry["size"] - size) > 1024:  # Same tolerance as the existing-file check
+                continue
+            found = (path, entry)
+            break
+        if stale:
+            with self.lock:
+                for path in stale:
+                    self._drop(path)
+                self._save()
+        return found
+
+    def find_local_copy(self, roots: Iterable[str], sha256: Optional[str], version_id=None, file_id=None,
+                        size: Optional[int] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Scans roots if needed, then looks the file up (blocking)."""
+        if not sha256 and version_id is None:
+            return None
+        self.ensure_scanned(roots)
+        return self.find(sha256, version_id, file_id, size)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self._ensure_loaded()
+            return {"files": len(self._files), "hashes": len(self._by_sha), "scanned_roots": len(self._scanned_roots)}
+
+
+def _reflink(source: str, target: str):
+    """Copy-on-write clone (Linux FICLONE: btrfs, xfs, ...). Raises OSError where unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported on this platform")
+    FICLONE = 0x40049409
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+class LocalCopyDownloader(ChunkDownloader):
+    """Materializes a download from a file already on disk: hardlink, reflink, or copy.
+
+    Drop-in for ChunkDownloader in the manager's download wrappers, so the item goes
+    through the normal status, history and metadata path.
+    """
+    COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, *args, source_path: str, source_entry: Optional[Dict[str, Any]] = None,
+                 link_modes: Iterable[str] = DEDUPE_LINK_MODES, **kwargs):
+        kwargs.pop("engine", None)
+        super().__init__(*args, **kwargs)
+        self.source_path = source_path
+        self.source_entry = source_entry or {}
+        self.link_modes = list(link_modes)
+
+    def _temp_target(self) -> str:
+        return str(self.output_path.parent / f".{self.output_path.name}.local_{self.download_id or int(time.time())}")
+
+    def _copy(self, source: str, target: str) -> bool:
+        """Chunked copy with progress and cancel; hashes the bytes it copies."""
+        hasher = self._new_hasher()
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            while True:
+                if self.is_cancelled:
+                    return False
+                data = src.read(self.COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                dst.write(data)
+                if hasher is not None:
+                    hasher.update(data)
+                self._update_progress(len(data))
+        if hasher is not None:
+            return self._check_hashes(hasher.hexdigests())
+        return True
+
+    def download(self) -> bool:
+        self._begin_attempt()
+        success = False
+        source = self.source_path
+        target = self._temp_target()
+        try:
+            self.total_size = os.path.getsize(source)
+            self.output_path.parent.mkdir(parents=True, exist_ok=True)
+            for mode in self.link_modes:
+                try:
+                    if mode == "hardlink":
+                        os.link(source, target)
+                    elif mode == "reflink":
+                        _reflink(source, target)
+                    elif mode == "copy":
+                        if not self._copy(source, target):
+                            break
+                    else:
+                        continue
+                except OSError as e:
+                    print(f"[Downloader {self.download_id}] Local {mode} from {source} not possible ({e}); trying next method.")
+                    continue
+                self.connection_type = f"Local ({mode})"
+                os.replace(target, self.output_path)
+                self.downloaded = self.total_size
+                success = not self.error and not self.is_cancelled
+                break
+            else:
+                self.error = self.error or f"Could not link or copy local file {source}"
+
+            if success and not self.hash_digests and self.source_entry.get("sha256"):
+                # Linked or cloned: same bytes as the indexed source
+                self.hash_digests = {"SHA256": self.source_entry["sha256"]}
+                self.hash_verified = compare_hashes(self.expected_hashes, self.hash_digests)
+            if success:
+                print(f"[Downloader {self.download_id}] Reused local file {source} -> {self.output_path} ({self.connection_type}).")
+
+        except Exception as e:
+            self._handle_unexpected_error(e)
+            success = False
+
+        finally:
+            if os.path.exists(target):
+                try:
+                    os.remove(target)
+                except OSError:
+                    pass
+            self._end_attempt(success)
+
+        return success and not self.error and not self.is_cancelled
+
+    async def download_async(self) -> bool:
+        """Async engine entry point: the local work runs in a worker thread."""
+        return await asyncio.to_thread(self.download)
+
+
+model_index = ModelIndex()
@@ -0,0 +1,330 @@
+# ================================================
+# File: server/routes/DownloadBatch.py
+# ================================================
+import os
+import asyncio
+import json
+import re
+import time
+import traceback
+import urllib.parse
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+
+import server # ComfyUI server instance
+import folder_paths
+from ..utils import get_request_json
+from .DownloadModel import queue_model_download
+from ...downloader.manager import manager as download_manager
+from ...utils.dir_index import dir_index
+from ...utils.helpers import get_model_dir, sanitize_filename
+from ...config import MODEL_TYPE_DIRS, BATCH_RESOLVE_CONCURRENCY, BATCH_HISTORY_LIMIT
+
+prompt_server = server.PromptServer.instance
+
+# Civitai's direct file links carry a *version* id: https://civitai.com/api/download/models/<versionId>
+CIVITAI_DOWNLOAD_URL_RE = re.compile(r"civitai\.com/api/download/models/(\d+)", re.IGNORECASE)
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+_batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict() # {batch_id: {"created", "items"}}, newest last
+
+
+def _workflow_models(workflow: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Model references ({name, url, directory}) in a ComfyUI workflow: the top-level "models"
+       list plus every node's (and subgraph node's) properties.models, as used by ComfyUI's missing-models dialog."""
+    if isinstance(workflow.get("workflow"), dict): # PNG info / extra_pnginfo wrapper
+        workflow = workflow["workflow"]
+    found = list(workflow.get("models") or [])
+    nodes = list(workflow.get("nodes") or [])
+    for subgraph in (workflow.get("definitions") or {}).get("subgraphs") or []:
+        nodes.extend(subgraph.get("nodes") or [])
+    for node in nodes:
+        if isinstance(node, dict):
+            found.extend((node.get("properties") or {}).get("models") or [])
+    return [{"url": m["url"], "directory": m["directory"], "filename": m["name"]}
+            for m in found if isinstance(m, dict) and m.get("url") and m.get("name") and m.get("directory")]
+
+
+def _folder_type(item: Dict[str, Any]) -> Optional[str]:
+    """ComfyUI folder_paths type for an item's target ('directory', or the folder of a Civicomfy 'model_type')."""
+    if item.get("directory"):
+        return item["directory"]
+    display_and_type = MODEL_TYPE_DIRS.get((item.get("model_type") or "").strip().lower())
+    return display_and_type[1] if display_and_type else item.get("model_type")
+
+
+def _model_type_for_folder(folder_type: str) -> str:
+    """Civicomfy model_type key for a ComfyUI folder type ('loras' -> 'lora'); unknown folders are used literally."""
+    return next((key for key, (_, ftype) in MODEL_TYPE_DIRS.items() if ftype == folder_type), folder_type)
+
+
+def _split_name(name: str):
+    """'SDXL/foo.safetensors' -> ('SDXL', 'foo.safetensors'), with every part sanitized."""
+    parts = [p for p in os.path.normpath((name or "").replace('\\', '/')).split('/') if p and p not in ('.', '..')]
+    if not parts:
+        return "", ""
+    subdir = os.path.join(*[sanitize_filename(p) for p in parts[:-1]]) if len(parts) > 1 else ""
+    return subdir, sanitize_filename(parts[-1])
+
+
+def _find_present(item: Dict[str, Any]) -> Optional[str]:
+    """Path of the model if a file with the item's name already exists in any root of its folder type (blocking)."""
+    name = item.get("filename") or item.get("custom_filename")
+    folder_type = _folder_type(item)
+    if not name or not folder_type:
+        return None
+    subdir, filename = _split_name(name)
+    relpath = os.path.join(subdir, filename) if subdir else filename
+    try:
+        found = folder_paths.get_full_path(folder_type, relpath)
+    except Exception:
+        found = None
+    if found:
+        return found
+    candidate = os.path.join(get_model_dir(item.get("model_type") or _model_type_for_folder(folder_type)), relpath)
+    return candidate if os.path.isfile(candidate) else None
+
+
+def _normalize_item(raw: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns a manifest entry into a /civitai/download request, or a plain URL download ('direct')."""
+    item = dict(raw)
+    if not item.get("model_type") and item.get("directory"):
+        item["model_type"] = _model_type_for_folder(item["directory"])
+    item.setdefault("model_type", "checkpoint")
+    for key, value in defaults.items():
+        item.setdefault(key, value)
+
+    url = (item.get("url") or "").strip()
+    match = CIVITAI_DOWNLOAD_URL_RE.search(url)
+    if not item.get("model_url_or_id") and match:
+        item["model_url_or_id"] = f"/model-versions/{match.group(1)}"
+    elif not item.get("model_url_or_id") and "civitai.com" in urllib.parse.urlparse(url).netloc.lower():
+        item["model_url_or_id"] = url
+    if item.get("model_url_or_id"):
+        name = item.pop("filename", None) or item.get("custom_filename") or ""
+        subdir, filename = _split_name(name)
+        if filename:
+            item["custom_filename"] = filename
+        if subdir and not item.get("subdir"):
+            item["subdir"] = subdir
+        item["kind"] = "civitai"
+    elif url.startswith(("http://", "https://")):
+        item["kind"] = "direct"
+    else:
+        item["kind"] = "invalid"
+    return item
+
+
+def _queue_direct_download(item: Dict[str, Any], batch_id: str) -> Dict[str, Any]:
+    """Queues a non-Civitai URL (e.g. Hugging Face) with the download manager (blocking: creates directories)."""
+    url = item["url"].strip()
+    subdir, filename = _split_name(item.get("filename") or os.path.basename(urllib.parse.urlparse(url).path))
+    if not filename:
+        return {"status": "error", "error": "Could not determine a filename for URL"}
+    if item.get("subdir") and not subdir:
+        subdir, _ = _split_name(os.path.join(item["subdir"], filename))
+    output_dir = get_model_dir(item["model_type"])
+    if subdir:
+        output_dir = os.path.join(output_dir, subdir)
+    os.makedirs(output_dir, exist_ok=True)
+    dir_index.add_dir(output_dir)
+    output_path = os.path.join(output_dir, filename)
+    if os.path.exists(output_path) and not item.get("force_redownload"):
+        return {"status": "exists", "path": output_path, "filename": filename}
+
+    download_id = download_manager.add_to_queue({
+        "url": url,
+        "output_path": output_path,
+        "num_connections": int(item.get("num_connections", 4)),
+        "priority": item.get("priority"),
+        "known_size": None, # Taken from the HEAD request when the download starts
+        "api_key": None, # Never send the Civitai key to other hosts
+        "model_url_or_id": url,
+        "model_version_id": None,
+        "custom_filename": filename,
+        "force_redownload": bool(item.get("force_redownload", False)),
+        "filename": filename,
+        "model_name": filename,
+        "version_name": urllib.parse.urlparse(url).netloc,
+        "thumbnail": None,
+        "model_type": item["model_type"],
+        "batch_id": batch_id,
+    })
+    return {"status": "queued", "download_id": download_id, "path": output_path, "filename": filename}
+
+
+async def _resolve_item(index: int, item: Dict[str, Any], batch_id: str, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """Skips, queues or fails one manifest entry. Returns its batch entry."""
+    entry = {"index": index, "source": item.get("model_url_or_id") or item.get("url"), "status": "error"}
+    async with semaphore:
+        try:
+            if item["kind"] == "invalid":
+                entry["error"] = "Entry needs 'model_url_or_id' or an http(s) 'url'"
+                return entry
+            if not item.get("force_redownload"):
+                present = await asyncio.to_thread(_find_present, item)
+                if present:
+                    entry.update(status="exists", path=present, filename=os.path.basename(present))
+                    return entry
+
+            if item["kind"] == "direct":
+                entry.update(await asyncio.to_thread(_queue_direct_download, item, batch_id))
+                return entry
+
+            request_data = {k: v for k, v in item.items() if k not in ("kind", "url", "directory")}
+            request_data["batch_id"] = batch_id
+            response = await queue_model_download(request_data)
+            result = json.loads(response.text)
+            if response.status >= 400:
+                entry["error"] = result.get("error") or result.get("message")
+                entry["details"] = result.get("details")
+                if result.get("status") == "exists_size_mismatch":
+                    entry.update(status="exists_size_mismatch", path=result.get("path"), error=result.get("message"))
+                return entry
+            entry.update(status=result.get("status", "queued"), download_id=result.get("download_id"),
+                         path=result.get("path") or (result.get("details") or {}).get("path"),
+                         filename=result.get("filename") or (result.get("details") or {}).get("filename"))
+            return entry
+        except Exception as e:
+            print(f"[Batch Download] Error resolving entry {index} ({entry['source']}): {e}")
+            entry["error"] = str(e)
+            return entry
+
+
+def _batch_progress(batch_id: str, batch: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregate status of a batch from the manager's entries for its downloads."""
+    live = download_manager.get_items([e["download_id"] for e in batch["items"]
+                                       if e.get("download_id") and e["status"] not in TERMINAL_STATUSES])
+    for stored in batch["items"]:
+        if not stored.get("download_id") or stored["status"] in TERMINAL_STATUSES:
+            continue
+        item = live.get(stored["download_id"])
+        if item is None:
+            # Trimmed from the history (later downloads, clear_history) before it was seen finishing
+            stored.update(status="unknown", progress=0, speed=0,
+                          error=stored.get("error") or "Download is no longer in the queue or history")
+        elif item.get("status") in TERMINAL_STATUSES:
+            # Final result is kept in the batch, history entries do not last
+            stored.update(status=item["status"], progress=item.get("progress", 0), speed=0, size=item.get("known_size"))
+            if item.get("error"):
+                stored["error"] = item["error"]
+
+    entries = [dict(e) for e in batch["items"]]
+    counts: Dict[str, int] = {}
+    sized = [] # (size, progress %) for downloads with a known size
+    unsized = [] # progress % of downloads whose size is not known yet
+    for entry in entries:
+        item = live.get(entry.get("download_id"))
+        if item is not None and entry["status"] not in TERMINAL_STATUSES:
+            entry["status"] = item.get("status", entry["status"])
+            entry["progress"] = item.get("progress", 0)
+            entry["speed"] = item.get("speed", 0)
+            entry["size"] = item.get("known_size")
+            if item.get("error"):
+                entry["error"] = item["error"]
+        if entry.get("download_id") and entry["status"] != "unknown":
+            if entry.get("size"):
+                sized.append((entry["size"], entry.get("progress", 0)))
+            else:
+                unsized.append(entry.get("progress", 0))
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+
+    total_bytes = sum(size for size, _ in sized)
+    done_bytes = sum(size * progress / 100 for size, progress in sized)
+    # Unsized downloads weigh as much as an average sized one (or 1 when none is sized)
+    weight = total_bytes / len(sized) if sized else 1
+    total_weight = total_bytes + weight * len(unsized)
+    progress = (done_bytes + weight * sum(p / 100 for p in unsized)) / total_weight * 100 if total_weight else 100.0
+
+    downloading = [e for e in entries if e.get("download_id") and e["status"] not in TERMINAL_STATUSES + ("unknown",)]
+    failed = [e for e in entries if e["status"] in ("failed", "cancelled", "error", "exists_size_mismatch", "unknown")]
+    return {
+        "batch_id": batch_id,
+        "status": "running" if downloading else ("completed_with_errors" if failed else "completed"),
+        "progress": round(progress, 2),
+        "downloaded_bytes": int(done_bytes),
+        "total_bytes": total_bytes, # Known sizes only
+        "speed": sum(e.get("speed") or 0 for e in downloading),
+        "counts": counts,
+        "created": batch["created"],
+        "items": entries,
+    }
+
+
+@prompt_server.routes.post("/civitai/download/batch")
+async def route_download_batch(request):
+    """API Endpoint to queue many models at once.
+       Body: {"items": [...], "workflow": {...}} plus optional defaults for every entry
+       ("api_key", "num_connections", "priority", "force_redownload").
+       Items take the /civitai/download fields ('model_url_or_id', 'model_type', 'model_version_id', ...)
+       or a plain 'url' with 'directory'/'model_type' and 'filename'. Workflow models are
+       read from its 'models' lists. Models already on disk are skipped; the rest are
+       resolved in parallel and queued under one batch id for GET /civitai/download/batch/{id}."""
+    try:
+        data = await get_request_json(request)
+        raw_items = list(data.get("items") or data.get("models") or [])
+        if isinstance(data.get("workflow"), dict):
+            raw_items.extend(_workflow_models(data["workflow"]))
+        if not raw_items:
+            raise web.HTTPBadRequest(reason="Missing 'items' or a 'workflow' with model URLs")
+        if not all(isinstance(i, dict) for i in raw_items):
+            raise web.HTTPBadRequest(reason="Every entry in 'items' must be an object")
+
+        defaults = {k: data[k] for k in ("api_key", "num_connections", "priority", "force_redownload") if k in data}
+        items, seen = [], set()
+        for raw in raw_items:
+            item = _normalize_item(raw, defaults)
+            # Workflows list the same model once per node that loads it
+            key = (item.get("model_url_or_id") or item.get("url"), item.get("model_version_id"), _folder_type(item),
+                   item.get("filename") or item.get("custom_filename"), item.get("file_id"))
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+
+        batch_id = f"batch_{int(time.time() * 1000)}"
+        print(f"[Batch Download] {batch_id}: resolving {len(items)} entries ({len(raw_items) - len(items)} duplicates dropped)")
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(BATCH_RESOLVE_CONCURRENCY)
+        entries = await asyncio.gather(*(_resolve_item(i, item, batch_id, semaphore) for i, item in enumerate(items)))
+
+        _batches[batch_id] = {"created": time.time(), "items": entries}
+        while len(_batches) > BATCH_HISTORY_LIMIT:
+            _batches.popitem(last=False)
+
+        counts: Dict[str, int] = {}
+        for entry in entries:
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        print(f"[Batch Download] {batch_id}: {counts} in {time.monotonic() - started:.2f}s")
+        return web.json_response({
+            "status": "queued" if counts.get("queued") else "nothing_to_download",
+            "batch_id": batch_id,
+            "queued": counts.get("queued", 0),
+            "skipped": counts.get("exists", 0),
+            "failed": len(entries) - counts.get("queued", 0) - counts.get("exists", 0),
+            "items": entries,
+        })
+
+    except web.HTTPError as http_err:
+        print(f"[Batch Download] HTTP Error: {http_err.status} {http_err.reason}")
+        return web.json_response({"error": http_err.reason, "details": "No details", "status_code": http_err.status}, status=http_err.status)
+
+    except Exception as e:
+        print("--- Unhandled Error in /civitai/download/batch ---")
+        traceback.print_exc()
+        print("--- End Error ---")
+        return web.json_response({"error": "Internal Server Error", "details": f"An unexpected error occurred: {str(e)}", "status_code": 500}, status=500)
+
+
+@prompt_server.routes.get("/civitai/download/batch/{batch_id}")
+async def route_get_batch_status(request):
+    """API Endpoint to get the aggregate progress of a batch download."""
+    batch_id = request.match_info["batch_id"]
+    batch = _batches.get(batch_id)
+    if batch is None:
+        return web.json_response({"error": "Batch not found", "details": f"No batch with id '{batch_id}'", "status_code": 404}, status=404)
+    try:
+        return web.json_response(_batch_progress(batch_id, batch))
+    except Exception as e:
+        print(f"Error getting batch status: {e}")
+        return web.json_response({"error": "Internal Server Error", "details": f"Failed to get batch status: {str(e)}", "status_code": 500}, status=500)
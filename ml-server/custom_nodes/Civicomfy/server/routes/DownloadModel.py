@@ -2,6 +2,7 @@
 # File: server/routes/DownloadModel.py
 # ================================================
 import os
+import asyncio
 import json
 import traceback
 import re
@@ -10,15 +11,36 @@ from aiohttp import web
 import server # ComfyUI server instance
 from ..utils import get_request_json
 from ...downloader.manager import manager as download_manager
+from ...downloader.model_store import model_index
+from ...utils.dir_index import dir_index
 from ...api.civitai import CivitaiAPI
 from ...utils.helpers import get_model_dir, parse_civitai_input, sanitize_filename, select_primary_file
-from ...config import METADATA_SUFFIX, PREVIEW_SUFFIX
+from ...config import METADATA_SUFFIX, PREVIEW_SUFFIX, DEDUPE_EXISTING_MODELS
 
 prompt_server = server.PromptServer.instance
 
+def _find_local_copy(model_type, base_output_dir, primary_file, version_id, size_bytes):
+    """Looks for the same file under any root of the model type (blocking: may scan roots once)."""
+    from ..routes.GetModelDirs import _get_all_roots_for_type
+    roots = _get_all_roots_for_type(model_type)
+    if os.path.abspath(base_output_dir) not in roots:
+        roots.append(os.path.abspath(base_output_dir))
+    sha256 = (primary_file.get("hashes") or {}).get("SHA256")
+    return model_index.find_local_copy(roots, sha256, version_id, primary_file.get("id"), size_bytes or None)
+
 @prompt_server.routes.post("/civitai/download")
 async def route_download_model(request):
     """API Endpoint to initiate a download."""
+    try:
+        data = await get_request_json(request)
+    except web.HTTPError as http_err:
+        print(f"[Server Download] HTTP Error: {http_err.status} {http_err.reason}")
+        return web.json_response({"error": http_err.reason, "details": "No details", "status_code": http_err.status}, status=http_err.status)
+    return await queue_model_download(data)
+
+async def queue_model_download(data):
+    """Resolves one download request (Civitai URL/ID + target) and queues it.
+       Returns the JSON response for it; also used for each item of a batch (DownloadBatch.py)."""
     api_key = None # Define outside try block
     model_info = None # Define here for broader scope
     version_info = None
@@ -26,8 +48,6 @@ async def route_download_model(request):
     target_model_id = None
     target_version_id = None
     try:
-        data = await get_request_json(request)
-
         model_url_or_id = data.get("model_url_or_id")
         # 'model_type' defines the target directory category (e.g., 'lora', 'checkpoint')
         model_type_value = data.get("model_type", "checkpoint")  # Use as-is; may be a literal folder name
@@ -40,6 +60,7 @@ async def route_download_model(request):
         req_file_name_contains = data.get("file_name_contains", "").strip()
         num_connections = int(data.get("num_connections", 4))
         force_redownload = bool(data.get("force_redownload", False))
+        priority = data.get("priority")  # "low" | "normal" | "high" or int; None uses DEFAULT_DOWNLOAD_PRIORITY
         api_key = data.get("api_key", "") # Get API key from frontend settings
 
         if not model_url_or_id:
@@ -70,7 +91,7 @@ async def route_download_model(request):
         if target_version_id:
             # Fetch version info directly using GET /model-versions/{id}
             print(f"[Server Download] Fetching info for Version ID: {target_version_id}")
-            version_info_result = api.get_model_version_info(target_version_id)
+            version_info_result = await asyncio.to_thread(api.get_model_version_info, target_version_id)
             if version_info_result and "error" not in version_info_result:
                 version_info = version_info_result # Assign to broader scope variable
                 # Infer model_id from version info if we didn't have it
@@ -78,14 +99,14 @@ async def route_download_model(request):
                      target_model_id = version_info['modelId']
                      print(f"[Server Download] Inferred Model ID {target_model_id} from Version ID {target_version_id}")
                      # Fetch model info as well for completeness if we only had version ID initially
-                     model_info_result = api.get_model_info(target_model_id)
+                     model_info_result = await asyncio.to_thread(api.get_model_info, target_model_id)
                      if model_info_result and "error" not in model_info_result:
                          model_info = model_info_result
                      else:
                          print(f"[Server Download] Warning: Could not fetch model info ({target_model_id}) after inferring from version.")
                          model_info = {} # Use empty dict as placeholder
                 else:
-                    model_info_result = api.get_model_info(target_model_id)
+                    model_info_result = await asyncio.to_thread(api.get_model_info, target_model_id)
                     if model_info_result and "error" not in model_info_result:
                          model_info = model_info_result
                     else:
@@ -102,7 +123,7 @@ async def route_download_model(request):
         elif target_model_id:
              # Fetch model info (GET /models/{id}) to get the latest version
             print(f"[Server Download] Fetching info for Model ID: {target_model_id} to find latest version.")
-            model_info_result = api.get_model_info(target_model_id)
+            model_info_result = await asyncio.to_thread(api.get_model_info, target_model_id)
             if model_info_result and "error" not in model_info_result:
                 model_info = model_info_result # Assign to broader scope variable
                 versions = model_info.get("modelVersions")
@@ -120,7 +141,7 @@ async def route_download_model(request):
                     print(f"[Server Download] Using latest/default Version ID {target_version_id} for Model ID {target_model_id}")
                     # Need to re-fetch full version details as model info often lacks file download URLs or full metadata
                     print(f"[Server Download] Fetching full details for selected Version ID: {target_version_id}")
-                    full_version_info_result = api.get_model_version_info(target_version_id)
+                    full_version_info_result = await asyncio.to_thread(api.get_model_version_info, target_version_id)
                     if full_version_info_result and "error" not in full_version_info_result:
                         version_info = full_version_info_result # Overwrite with full details
                     else:
@@ -265,6 +286,7 @@ async def route_download_model(request):
         # Ensure directory exists (including subdirectories)
         try:
             os.makedirs(output_dir, exist_ok=True)
+            dir_index.add_dir(output_dir)
             print(f"[Server Download] Ensured output directory exists: {output_dir}")
         except OSError as e:
             raise web.HTTPInternalServerError(reason=f"Could not create subdirectory: {e}")
@@ -324,6 +346,17 @@ async def route_download_model(request):
         if file_exists and force_redownload:
              print(f"[Server Download] Force Re-download enabled. Will overwrite existing file: {output_path}")
 
+        # --- Reuse an identical file already on disk (hardlink/reflink/copy instead of downloading) ---
+        local_copy = None
+        if DEDUPE_EXISTING_MODELS and not force_redownload:
+            try:
+                local_copy = await asyncio.to_thread(_find_local_copy, model_type_value, base_output_dir,
+                                                     primary_file, target_version_id, api_size_bytes)
+            except Exception as e:
+                print(f"[Server Download] Warning: Local model index lookup failed: {e}")
+            if local_copy:
+                print(f"[Server Download] Same file already on disk, reusing: {local_copy[0]}")
+
         # --- Prepare Download Info and Queue ---
         model_name = model_info.get('name', version_info['model']['name'])
         version_name = version_info.get('name', 'Unknown Version')
@@ -401,6 +434,7 @@ async def route_download_model(request):
             "url": download_url,
             "output_path": output_path,
             "num_connections": num_connections,
+            "priority": priority,
             "known_size": known_size_bytes,
             "api_key": api_key or None, # Pass API key for download auth if needed
             # Retry/context fields
@@ -428,6 +462,10 @@ async def route_download_model(request):
             "civitai_version_info": version_info,
             "civitai_primary_file": primary_file, # Pass the selected file object
         }
+        if local_copy:
+            download_info["local_source"], download_info["local_source_entry"] = local_copy
+        if data.get("batch_id"):
+            download_info["batch_id"] = data["batch_id"]
 
         download_id = download_manager.add_to_queue(download_info)
 
@@ -443,7 +481,8 @@ async def route_download_model(request):
                 "thumbnail": thumbnail_url,
                 "thumbnail_nsfw_level": thumbnail_nsfw_level,
                 "path": output_path, # The intended final path
-                "size_kb": api_size_kb if api_size_kb else None # Use KB for display consistency
+                "size_kb": api_size_kb if api_size_kb else None, # Use KB for display consistency
+                "local_source": local_copy[0] if local_copy else None, # Existing identical file being reused
             }
         })
 
@@ -0,0 +1,24 @@
+# ================================================
+# File: server/routes/GetHttpStats.py
+# ================================================
+from aiohttp import web
+import server # ComfyUI server instance
+from ...utils.http_pool import session_pool
+from ...api.civitai import metadata_cache
+from ...utils.shared_scheduler import get_download_scheduler
+
+prompt_server = server.PromptServer.instance
+
+@prompt_server.routes.get("/civitai/http_stats")
+async def route_get_http_stats(request):
+    """API Endpoint to get connection-pool counters (requests vs. new/reused connections per host),
+       Civitai metadata cache hits/misses and the shared download scheduler's jobs."""
+    try:
+        stats = session_pool.get_stats()
+        stats["civitai_cache"] = metadata_cache.stats()
+        scheduler = get_download_scheduler()
+        stats["download_scheduler"] = scheduler.snapshot() if scheduler else None
+        return web.json_response(stats)
+    except Exception as e:
+        print(f"Error getting HTTP pool stats: {e}")
+        return web.json_response({"error": "Internal Server Error", "details": str(e), "status_code": 500}, status=500)
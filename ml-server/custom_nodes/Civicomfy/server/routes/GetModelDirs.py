@@ -2,34 +2,45 @@
 # File: server/routes/GetModelDirs.py
 # ================================================
 import os
+import asyncio
 import json
 from aiohttp import web
 
 import server  # ComfyUI server instance
 from ...utils.helpers import get_model_dir, sanitize_filename
+from ...utils.dir_index import dir_index
 from ...config import PLUGIN_ROOT
 import folder_paths
 
 prompt_server = server.PromptServer.instance
 
 CUSTOM_ROOTS_FILE = os.path.join(PLUGIN_ROOT, "custom_roots.json")
+_custom_roots_cache = {"mtime": None, "data": {}} # Parsed custom_roots.json, re-read only when its mtime changes
 
 def _load_custom_roots():
     try:
-        if os.path.exists(CUSTOM_ROOTS_FILE):
+        mtime = os.stat(CUSTOM_ROOTS_FILE).st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _custom_roots_cache["mtime"]:
+        data = {}
+        try:
             with open(CUSTOM_ROOTS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, dict):
+                loaded = json.load(f)
+                if isinstance(loaded, dict):
                     # Normalize values to lists of strings
-                    return {k: [str(p) for p in (v or []) if isinstance(p, str)] for k, v in data.items()}
-    except Exception as e:
-        print(f"[Civicomfy] Warning: Failed to load custom roots: {e}")
-    return {}
+                    data = {k: [str(p) for p in (v or []) if isinstance(p, str)] for k, v in loaded.items()}
+        except Exception as e:
+            print(f"[Civicomfy] Warning: Failed to load custom roots: {e}")
+        _custom_roots_cache.update(mtime=mtime, data=data)
+    return {k: list(v) for k, v in _custom_roots_cache["data"].items()}
 
 def _save_custom_roots(data):
     try:
         with open(CUSTOM_ROOTS_FILE, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2)
+        _custom_roots_cache.update(mtime=os.stat(CUSTOM_ROOTS_FILE).st_mtime_ns,
+                                   data={k: list(v) for k, v in data.items()})
         return True
     except Exception as e:
         print(f"[Civicomfy] Error writing custom roots file: {e}")
@@ -67,35 +78,18 @@ def _get_all_roots_for_type(model_type: str):
             base = getattr(folder_paths, 'base_path', os.getcwd())
             models_dir = os.path.join(base, 'models')
         if os.path.isdir(models_dir):
-            for name in os.listdir(models_dir):
-                p = os.path.join(models_dir, name)
-                if os.path.isdir(p):
-                    ap = os.path.abspath(p)
-                    if ap not in roots:
-                        roots.append(ap)
+            for name in dir_index.list_children(models_dir):
+                ap = os.path.abspath(os.path.join(models_dir, name))
+                if ap not in roots:
+                    roots.append(ap)
     except Exception as e:
         print(f"[Civicomfy] Warning: Failed to enumerate models dir subfolders: {e}")
     return roots
 
-def _list_subdirs(root_dir: str, max_entries: int = 5000):
-    """Return a sorted list of relative subdirectory paths under root_dir, including nested."""
-    rel_dirs = set()
-    root_dir = os.path.abspath(root_dir)
-    count = 0
-    for current, dirs, _files in os.walk(root_dir):
-        # Avoid following symlinks to reduce risk
-        abs_current = os.path.abspath(current)
-        try:
-            rel = os.path.relpath(abs_current, root_dir)
-        except Exception:
-            continue
-        if rel == ".":
-            rel = ""  # represent root as empty
-        rel_dirs.add(rel)
-        count += 1
-        if count >= max_entries:
-            break
-    return sorted(rel_dirs)
+def _list_subdirs(root_dir: str):
+    """Return a sorted list of relative subdirectory paths under root_dir, including nested.
+       Served from the directory index; only the first call for a root walks it."""
+    return dir_index.list_subdirs(root_dir)
 
 @prompt_server.routes.get("/civitai/model_dirs")
 async def route_get_model_dirs(request):
@@ -104,7 +98,10 @@ async def route_get_model_dirs(request):
     root = (request.query.get("root") or "").strip()
     try:
         base_dir = root if root else get_model_dir(model_type)
-        subdirs = _list_subdirs(base_dir)
+        if dir_index.is_cached(base_dir):
+            subdirs = _list_subdirs(base_dir)
+        else:
+            subdirs = await asyncio.to_thread(_list_subdirs, base_dir) # First listing walks the tree
         return web.json_response({
             "model_type": model_type,
             "base_dir": base_dir,
@@ -140,6 +137,7 @@ async def route_create_model_dir(request):
             return web.json_response({"error": "Invalid path"}, status=400)
 
         os.makedirs(abs_path, exist_ok=True)
+        dir_index.add_dir(abs_path)
         return web.json_response({
             "success": True,
             "created": rel_path,
@@ -175,6 +173,7 @@ async def route_create_model_type(request):
             return web.json_response({"error": "Invalid path"}, status=400)
 
         os.makedirs(abs_path, exist_ok=True)
+        dir_index.add_dir(abs_path)
         return web.json_response({"success": True, "name": safe, "path": abs_path})
     except Exception as e:
         return web.json_response({"error": "Failed to create model type folder", "details": str(e)}, status=500)
@@ -204,6 +203,7 @@ async def route_create_model_root(request):
         abs_path = os.path.abspath(abs_path)
         # Create directory if missing
         os.makedirs(abs_path, exist_ok=True)
+        dir_index.add_dir(abs_path)
         roots = _load_custom_roots()
         current = roots.get(model_type, [])
         if abs_path not in current:
@@ -5,6 +5,7 @@ import os
 from aiohttp import web
 import server # ComfyUI server instance
 import folder_paths
+from ...utils.dir_index import dir_index
 
 prompt_server = server.PromptServer.instance
 
@@ -20,11 +21,7 @@ async def route_get_model_types(request):
         if not os.path.isdir(models_dir):
             return web.json_response({})
 
-        entries = {}
-        for name in sorted(os.listdir(models_dir)):
-            p = os.path.join(models_dir, name)
-            if os.path.isdir(p):
-                entries[name] = name
+        entries = {name: name for name in dir_index.list_children(models_dir)}
         return web.json_response(entries)
     except Exception as e:
         print(f"Error getting model types: {e}")
@@ -7,13 +7,65 @@ from ...downloader.manager import manager as download_manager
 
 prompt_server = server.PromptServer.instance
 
+STATUS_EVENT = "civicomfy-status" # Websocket event carrying status deltas
+STATUS_PUSH_INTERVAL = 0.5 # Seconds; changes within this window go out as one delta
+
+
+class _StatusPusher:
+    """Pushes coalesced status deltas to all clients over ComfyUI's websocket.
+
+    Each message carries "since" (the seq of the previous push); a client whose own
+    seq differs missed a message and resyncs with GET /civitai/status?since=<seq>.
+    """
+
+    def __init__(self):
+        self._scheduled = False
+        self._last_seq = 0
+
+    def notify(self):
+        """Called by the manager from any thread after a status change."""
+        loop = getattr(prompt_server, "loop", None)
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._schedule)
+        except RuntimeError:
+            pass # Loop closed (shutdown)
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            prompt_server.loop.call_later(STATUS_PUSH_INTERVAL, self._push)
+
+    def _push(self):
+        self._scheduled = False
+        try:
+            delta = download_manager.get_status_delta(self._last_seq)
+            delta["since"] = self._last_seq
+            self._last_seq = delta["seq"]
+            prompt_server.send_sync(STATUS_EVENT, delta)
+        except Exception as e:
+            print(f"Error pushing download status: {e}")
+
+
+_status_pusher = _StatusPusher()
+download_manager.add_status_listener(_status_pusher.notify)
+
+
 @prompt_server.routes.get("/civitai/status")
 async def route_get_status(request):
-    """API Endpoint to get the status of downloads."""
+    """API Endpoint to get the status of downloads.
+       With ?since=<seq> only entries changed after that sequence number are returned."""
     try:
-        status = download_manager.get_status()
-        return web.json_response(status)
+        since = request.query.get("since")
+        if since is None:
+            return web.json_response(download_manager.get_status())
+        try:
+            since = int(since)
+        except ValueError:
+            return web.json_response({"error": "Invalid 'since'", "details": "'since' must be an integer sequence number.", "status_code": 400}, status=400)
+        return web.json_response(download_manager.get_status_delta(since))
     except Exception as e:
         print(f"Error getting download status: {e}")
         # Format error response consistently
-        return web.json_response({"error": "Internal Server Error", "details": f"Failed to get status: {str(e)}", "status_code": 500}, status=500)
\ No newline at end of file
+        return web.json_response({"error": "Internal Server Error", "details": f"Failed to get status: {str(e)}", "status_code": 500}, status=500)
@@ -1,6 +1,7 @@
 # ================================================
 # File: server/routes/SearchModels.py
 # ================================================
+import asyncio
 import json
 import math
 import traceback
@@ -65,7 +66,8 @@ async def route_search_models(request):
         print(f"[Server Search] Meili: query='{query if query else '<none>'}', types={api_types_filter or 'Any'}, baseModels={valid_base_models or 'Any'}, sort={sort}, nsfw={nsfw}, limit={limit}, page={page}")
 
         # Call the new search method
-        meili_results = api.search_models_meili(
+        meili_results = await asyncio.to_thread(
+             api.search_models_meili,
              query=query or None, # Meili handles empty query if filters exist
              types=api_types_filter or None,
              base_models=valid_base_models or None,
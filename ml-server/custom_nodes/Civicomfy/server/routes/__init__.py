@@ -8,8 +8,10 @@
 
 from . import CancelDownload
 from . import ClearHistory
+from . import DownloadBatch
 from . import DownloadModel
 from . import GetBaseModels
+from . import GetHttpStats
 from . import GetModelDetails
 from . import GetModelTypes
 from . import GetModelDirs
@@ -0,0 +1,91 @@
+"""A hardlinked local reuse must not let a later re-download rewrite the source model.
+
+Run from ml-server/custom_nodes: python -m unittest Civicomfy.tests.test_local_reuse
+Needs requests (installed with ComfyUI; the downloader imports it) and is skipped without it.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CUSTOM_NODES_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if CUSTOM_NODES_DIR not in sys.path:
+    sys.path.insert(0, CUSTOM_NODES_DIR)
+if "folder_paths" not in sys.modules:
+    # Outside ComfyUI: config.py only needs the base path at import time
+    sys.modules["folder_paths"] = types.SimpleNamespace(base_path=tempfile.gettempdir())
+
+HAS_REQUESTS = importlib.util.find_spec("requests") is not None
+if HAS_REQUESTS:
+    from Civicomfy.downloader.chunk_downloader import ChunkDownloader
+    from Civicomfy.downloader.model_store import LocalCopyDownloader
+
+SOURCE_BYTES = b"original model " * 1024
+NEW_BYTES = b"redownloaded model " * 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Serves NEW_BYTES, or the first half of it and a dropped connection for /short
+    def do_GET(self):
+        body = NEW_BYTES[:len(NEW_BYTES) // 2] if self.path == "/short" else NEW_BYTES
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(NEW_BYTES)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@unittest.skipUnless(HAS_REQUESTS, "requests is not installed")
+class HardlinkReuseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "source.safetensors")
+        self.target = os.path.join(self.tmp.name, "linked.safetensors")
+        with open(self.source, "wb") as f:
+            f.write(SOURCE_BYTES)
+        linker = LocalCopyDownloader(url="", output_path=self.target, source_path=self.source,
+                                     link_modes=("hardlink",), resumable=False, verify_hash=False)
+        self.assertTrue(linker.download())
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(self.target).st_ino)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _redownload(self, path):
+        downloader = ChunkDownloader(self.base_url + path, self.target, num_connections=1,
+                                     resumable=False, verify_hash=False)
+        return downloader.fallback_download()
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_forced_redownload_keeps_source(self):
+        self.assertTrue(self._redownload("/full"))
+        self.assertEqual(self._read(self.target), NEW_BYTES)
+        self.assertEqual(self._read(self.source), SOURCE_BYTES)
+
+    def test_failed_redownload_keeps_source(self):
+        self._redownload("/short")
+        self.assertEqual(self._read(self.source), SOURCE_BYTES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+# ================================================
+# File: utils/dir_index.py
+# ================================================
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from ..config import DIR_INDEX_MAX_ENTRIES, DIR_INDEX_REVALIDATE_INTERVAL
+
+
+class _DirTree:
+    """Cached directory tree under one root: relative dir -> (mtime_ns, child dir names)."""
+
+    def __init__(self, root: str, max_depth: Optional[int], max_entries: int):
+        self.root = root
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        # Depth-limited listings count symlinked directories like os.path.isdir does; the full
+        # tree never descends into symlinks, like os.walk
+        self.follow_symlinks = max_depth is not None
+        self.mtimes: Dict[str, int] = {}
+        self.children: Dict[str, Set[str]] = {}
+        self.checked_at = 0.0
+        self._sorted: Optional[List[str]] = None
+
+    def _abs(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def _depth(self, rel: str) -> int:
+        return rel.count(os.sep) + 1 if rel else 0
+
+    def scan(self, rel: str = ""):
+        """Lists rel and (recursively) every subdirectory not yet in the tree."""
+        pending = [rel]
+        while pending:
+            current = pending.pop()
+            try:
+                mtime = os.stat(self._abs(current)).st_mtime_ns
+                with os.scandir(self._abs(current)) as it:
+                    names = {e.name for e in it if e.is_dir(follow_symlinks=self.follow_symlinks)}
+            except OSError:
+                self.drop(current)
+                continue
+            self.mtimes[current] = mtime
+            if self.max_depth is not None and self._depth(current) >= self.max_depth:
+                names = set()
+            old = self.children.get(current, set())
+            self.children[current] = names
+            for gone in old - names:
+                self.drop(os.path.join(current, gone) if current else gone)
+            for name in sorted(names - old, reverse=True):
+                child = os.path.join(current, name) if current else name
+                if child not in self.mtimes and len(self.mtimes) + len(pending) < self.max_entries:
+                    pending.append(child)
+            self._sorted = None
+
+    def drop(self, rel: str):
+        """Removes rel and its subtree."""
+        stack = [rel]
+        while stack:
+            current = stack.pop()
+            self.mtimes.pop(current, None)
+            for name in self.children.pop(current, ()):
+                stack.append(os.path.join(current, name) if current else name)
+        if rel:
+            parent, name = os.path.split(rel)
+            self.children.get(parent, set()).discard(name)
+        self._sorted = None
+
+    def revalidate(self):
+        """Re-lists only directories whose mtime changed (entries added, removed or renamed)."""
+        for rel, mtime in list(self.mtimes.items()):
+            if rel not in self.mtimes:
+                continue  # Dropped with a parent during this pass
+            try:
+                current = os.stat(self._abs(rel)).st_mtime_ns
+            except OSError:
+                self.drop(rel)
+                continue
+            if current != mtime:
+                self.scan(rel)
+
+    def sorted_dirs(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.mtimes)
+        return self._sorted
+
+
+class DirectoryIndex:
+    """In-memory index of model directory trees for the directory routes.
+
+    A tree is listed once on first use; after that lookups come from memory. A lookup
+    older than revalidate_interval starts a background pass that stats each known
+    directory and re-lists only those whose mtime changed. The pass works on a copy
+    that is swapped in when done, so lookups never wait for it. Directories the plugin
+    creates itself are added immediately with add_dir().
+    """
+
+    def __init__(self, max_entries: int = DIR_INDEX_MAX_ENTRIES,
+                 revalidate_interval: float = DIR_INDEX_REVALIDATE_INTERVAL):
+        self.max_entries = max_entries
+        self.revalidate_interval = revalidate_interval
+        self.lock = threading.Lock()
+        self._trees: Dict[tuple, _DirTree] = {}
+        self._added_during_refresh: Dict[tuple, List[str]] = {}
+
+    def _tree(self, root: str, max_depth: Optional[int]) -> _DirTree:
+        """Returns the tree for root, listing it on first use (blocking)."""
+        key = (os.path.abspath(root), max_depth)
+        with self.lock:
+            tree = self._trees.get(key)
+            if tree is not None:
+                if time.monotonic() - tree.checked_at > self.revalidate_interval and key not in self._added_during_refresh:
+                    self._added_during_refresh[key] = []
+                    threading.Thread(target=self._revalidate, args=(key, tree), daemon=True).start()
+                return tree
+
+        tree = _DirTree(key[0], max_depth, self.max_entries)
+        tree.scan()
+        tree.checked_at = time.monotonic()
+        with self.lock:
+            return self._trees.setdefault(key, tree)
+
+    def _revalidate(self, key: tuple, tree: _DirTree):
+        with self.lock:
+            fresh = _DirTree(tree.root, tree.max_depth, tree.max_entries)
+            fresh.mtimes = dict(tree.mtimes)
+            fresh.children = {rel: set(names) for rel, names in tree.children.items()}
+        try:
+            fresh.revalidate()
+        except Exception as e:
+            print(f"[Civicomfy] Warning: Directory index refresh failed for {tree.root}: {e}")
+            fresh = tree
+        with self.lock:
+            added = self._added_during_refresh.pop(key, [])
+            fresh.checked_at = time.monotonic()
+            if self._trees.get(key) is tree:
+                for path in added:
+                    self._add_to_tree(fresh, path)
+                self._trees[key] = fresh
+
+    def is_cached(self, root: str, max_depth: Optional[int] = None) -> bool:
+        return (os.path.abspath(root), max_depth) in self._trees
+
+    def list_subdirs(self, root: str) -> List[str]:
+        """Sorted relative paths of all directories under root ("" is the root). Do not modify."""
+        tree = self._tree(root, None)
+        with self.lock:
+            return tree.sorted_dirs()
+
+    def list_children(self, root: str) -> List[str]:
+        """Sorted names of the first-level directories in root."""
+        tree = self._tree(root, 1)
+        with self.lock:
+            return sorted(tree.children.get("", ()))
+
+    @staticmethod
+    def _add_to_tree(tree: _DirTree, path: str):
+        rel = os.path.relpath(path, tree.root) if path != tree.root else ""
+        # Re-list the nearest known ancestor; only the new branch is walked
+        ancestor = rel
+        while ancestor and ancestor not in tree.mtimes:
+            ancestor = os.path.dirname(ancestor)
+        tree.scan(ancestor)
+
+    def add_dir(self, path: str):
+        """Records a directory the plugin created (and its missing parents) in every cached tree."""
+        path = os.path.abspath(path)
+        with self.lock:
+            for key, tree in self._trees.items():
+                if path == tree.root or path.startswith(tree.root + os.sep):
+                    self._add_to_tree(tree, path)
+                    if key in self._added_during_refresh:
+                        self._added_during_refresh[key].append(path)
+
+    def invalidate(self, root: Optional[str] = None):
+        """Forgets one root's trees (or all) so the next lookup lists them again."""
+        with self.lock:
+            if root is None:
+                self._trees.clear()
+            else:
+                root = os.path.abspath(root)
+                for key in [k for k in self._trees if k[0] == root]:
+                    del self._trees[key]
+
+
+dir_index = DirectoryIndex()
@@ -0,0 +1,163 @@
+# ================================================
+# File: utils/http_pool.py
+# ================================================
+import threading
+import urllib.parse
+from typing import Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from ..config import HTTP_POOL_MAXSIZE, HTTP_RETRY_TOTAL, HTTP_RETRY_BACKOFF
+
+
+class _HostStats:
+    """Request / new-connection counters for one session (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                # Every request that didn't need a fresh TCP+TLS handshake reused a pooled one
+                "reused_connections": max(0, self.requests - self.new_connections),
+            }
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that counts requests and newly opened connections."""
+
+    def __init__(self, stats: _HostStats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        stats = self._stats
+
+        def counting(base):
+            class CountingPool(base):
+                def _new_conn(self):
+                    stats.record_new_connection()
+                    return super()._new_conn()
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting(HTTPConnectionPool),
+            "https": counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        self._stats.record_request()
+        return super().send(request, **kwargs)
+
+
+def _host_key(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+class SessionPool:
+    """Process-wide keep-alive sessions, one per scheme+host, shared by all threads.
+
+    Redirects (e.g. civitai.com -> R2/S3) are followed by the originating host's
+    session; its adapter keeps a separate connection pool per target host.
+    """
+
+    def __init__(self, pool_maxsize: int = HTTP_POOL_MAXSIZE, retry_total: int = HTTP_RETRY_TOTAL,
+                 retry_backoff: float = HTTP_RETRY_BACKOFF):
+        self.pool_maxsize = pool_maxsize
+        self.retry_total = retry_total
+        self.retry_backoff = retry_backoff
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._stats: Dict[str, _HostStats] = {}
+
+    def _make_retry(self) -> Retry:
+        # Only idempotent methods are retried; the final response is returned so callers'
+        # raise_for_status() keeps reporting the real status code.
+        return Retry(
+            total=self.retry_total,
+            connect=self.retry_total,
+            read=0,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+
+    def get_session(self, url: str) -> requests.Session:
+        """Returns the shared session for url's host, creating it on first use."""
+        key = _host_key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                stats = self._stats.get(key) or _HostStats()
+                adapter = _CountingAdapter(
+                    stats,
+                    pool_connections=8,  # Distinct target hosts (redirect CDNs) cached per session
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=self._make_retry(),
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+                self._stats[key] = stats
+            return session
+
+    def host_stats(self, url: str) -> _HostStats:
+        """Counters for url's host, for clients that don't go through the pooled sessions (aiohttp)."""
+        key = _host_key(url)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _HostStats()
+            return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-host request / connection counters plus totals."""
+        with self._lock:
+            hosts = {key: stats.snapshot() for key, stats in self._stats.items()}
+        totals = {"requests": 0, "new_connections": 0, "reused_connections": 0}
+        for snap in hosts.values():
+            for k in totals:
+                totals[k] += snap[k]
+        return {"hosts": hosts, "totals": totals}
+
+    def close(self):
+        """Closes every pooled connection."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._stats.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+
+# --- Global Instance ---
+session_pool = SessionPool()
+
+
+def get_session(url: str) -> requests.Session:
+    """Shortcut for session_pool.get_session(url)."""
+    return session_pool.get_session(url)
@@ -0,0 +1,53 @@
+# ================================================
+# File: utils/shared_scheduler.py
+# ================================================
+import importlib.util
+import os
+import sys
+import threading
+from typing import Any, Optional
+
+from ..config import USE_SHARED_SCHEDULER
+
+# custom_nodes/download_scheduler.py, shared with the other download extensions
+SCHEDULER_MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+                                     "download_scheduler.py")
+SHARED_MODULE_NAME = "comfy_download_scheduler"
+
+_load_lock = threading.Lock()
+_load_failed = False
+
+
+def get_scheduler_module() -> Optional[Any]:
+    """The shared download_scheduler module, loaded once per process; None if disabled or missing."""
+    global _load_failed
+    if not USE_SHARED_SCHEDULER or _load_failed:
+        return None
+    module = sys.modules.get(SHARED_MODULE_NAME)
+    if module is not None:
+        return module
+    with _load_lock:
+        module = sys.modules.get(SHARED_MODULE_NAME)
+        if module is not None:
+            return module
+        if not os.path.isfile(SCHEDULER_MODULE_PATH):
+            print(f"[Civicomfy] Shared download scheduler not found ({SCHEDULER_MODULE_PATH}); downloads are not coordinated.")
+            _load_failed = True
+            return None
+        try:
+            spec = importlib.util.spec_from_file_location(SHARED_MODULE_NAME, SCHEDULER_MODULE_PATH)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[SHARED_MODULE_NAME] = module
+            spec.loader.exec_module(module)
+            return sys.modules[SHARED_MODULE_NAME]
+        except Exception as e:
+            sys.modules.pop(SHARED_MODULE_NAME, None)
+            print(f"[Civicomfy] Warning: Could not load shared download scheduler: {e}")
+            _load_failed = True
+            return None
+
+
+def get_download_scheduler() -> Optional[Any]:
+    """The process-wide DownloadScheduler instance, or None."""
+    module = get_scheduler_module()
+    return getattr(module, "scheduler", None) if module else None
@@ -57,8 +57,9 @@ export class CivitaiDownloaderAPI {
     });
   }
 
-  static async getStatus() {
-    return await this._request("/civitai/status");
+  static async getStatus(since = null) {
+    const query = since ? `?since=${encodeURIComponent(since)}` : "";
+    return await this._request(`/civitai/status${query}`);
   }
 
   static async cancelDownload(downloadId) {
@@ -1,10 +1,20 @@
+import { api } from "../../../../../scripts/api.js";
 import { CivitaiDownloaderAPI } from "../../api/civitai.js";
 
+const STATUS_EVENT = "civicomfy-status";
+const PUSH_FRESH_MS = 10000; // Skip polling while websocket pushes keep arriving
+
 export function startStatusUpdates(ui) {
+    if (!ui.statusPushListener) {
+        ui.statusPushListener = (event) => handleStatusPush(ui, event.detail);
+        api.addEventListener(STATUS_EVENT, ui.statusPushListener);
+    }
     if (!ui.statusInterval) {
-        console.log("[Civicomfy] Starting status updates (every 3s)...");
+        console.log("[Civicomfy] Starting status updates (push, polling every 3s as fallback)...");
         ui.updateStatus();
-        ui.statusInterval = setInterval(() => ui.updateStatus(), 3000);
+        ui.statusInterval = setInterval(() => {
+            if (!ui.lastStatusPush || Date.now() - ui.lastStatusPush > PUSH_FRESH_MS) ui.updateStatus();
+        }, 3000);
     }
 }
 
@@ -14,38 +24,82 @@ export function stopStatusUpdates(ui) {
         ui.statusInterval = null;
         console.log("[Civicomfy] Stopped status updates.");
     }
+    if (ui.statusPushListener) {
+        api.removeEventListener(STATUS_EVENT, ui.statusPushListener);
+        ui.statusPushListener = null;
+    }
 }
 
-export async function updateStatus(ui) {
-    if (!ui.modal || !ui.modal.classList.contains('open')) return;
-
-    try {
-        const newStatusData = await CivitaiDownloaderAPI.getStatus();
-        if (!newStatusData || !Array.isArray(newStatusData.active) || !Array.isArray(newStatusData.queue) || !Array.isArray(newStatusData.history)) {
+// Merges a full status or a delta ({changed, removed, order}) into ui.statusData
+function applyStatus(ui, data) {
+    if (data.full || !data.order) {
+        if (!Array.isArray(data.active) || !Array.isArray(data.queue) || !Array.isArray(data.history)) {
             throw new Error("Invalid status data structure received from server.");
         }
+        ui.statusData = { queue: data.queue, active: data.active, history: data.history };
+    } else {
+        const byId = new Map();
+        for (const section of ["queue", "active", "history"]) {
+            for (const item of ui.statusData[section] || []) byId.set(item.id, item);
+        }
+        for (const id of data.removed || []) byId.delete(id);
+        for (const { section, ...item } of data.changed || []) byId.set(item.id, item);
+        const next = {};
+        for (const section of ["queue", "active", "history"]) {
+            next[section] = (data.order[section] || []).map((id) => byId.get(id)).filter(Boolean);
+        }
+        ui.statusData = next;
+    }
+    // Pushes and GETs take seqs from the same counter, a push may be older than the last GET
+    if (typeof data.seq === "number") ui.statusSeq = Math.max(ui.statusSeq || 0, data.seq);
+}
 
-        const oldStateString = JSON.stringify(ui.statusData);
-        const newStateString = JSON.stringify(newStatusData);
+function renderStatus(ui) {
+    // Always keep counters in sync
+    const activeCount = ui.statusData.active.length + ui.statusData.queue.length;
+    ui.activeCountSpan.textContent = activeCount;
+    ui.statusIndicator.style.display = activeCount > 0 ? 'inline' : 'none';
 
-        // Cache new state if it differs
-        if (oldStateString !== newStateString) {
-            ui.statusData = newStatusData;
-        }
+    // Always render when Status tab is active, even if data hasn't changed
+    if (ui.activeTab === 'status') {
+        ui.renderDownloadList(ui.statusData.active, ui.activeListContainer, 'No active downloads.');
+        ui.renderDownloadList(ui.statusData.queue, ui.queuedListContainer, 'Download queue is empty.');
+        ui.renderDownloadList(ui.statusData.history, ui.historyListContainer, 'No download history yet.');
+    }
+}
 
-        // Always keep counters in sync
-        const activeCount = ui.statusData.active.length + ui.statusData.queue.length;
-        ui.activeCountSpan.textContent = activeCount;
-        ui.statusIndicator.style.display = activeCount > 0 ? 'inline' : 'none';
+function handleStatusPush(ui, delta) {
+    if (!delta) return;
+    ui.lastStatusPush = Date.now();
+    if (!ui.modal || !ui.modal.classList.contains('open')) return;
+    // A delta holds every entry changed after `since` plus the full order, so it applies on top of
+    // any state at least that new; only a state older than `since` (or none yet) needs a resync
+    if (!delta.full && !(ui.statusSeq && delta.since <= ui.statusSeq)) {
+        ui.updateStatus();
+        return;
+    }
+    try {
+        applyStatus(ui, delta);
+        renderStatus(ui);
+    } catch (error) {
+        console.error("[Civicomfy] Failed to apply pushed status:", error);
+        ui.statusSeq = 0;
+    }
+}
 
-        // Always render when Status tab is active, even if data hasn't changed
-        if (ui.activeTab === 'status') {
-            ui.renderDownloadList(ui.statusData.active, ui.activeListContainer, 'No active downloads.');
-            ui.renderDownloadList(ui.statusData.queue, ui.queuedListContainer, 'Download queue is empty.');
-            ui.renderDownloadList(ui.statusData.history, ui.historyListContainer, 'No download history yet.');
+export async function updateStatus(ui) {
+    if (!ui.modal || !ui.modal.classList.contains('open')) return;
+
+    try {
+        const newStatusData = await CivitaiDownloaderAPI.getStatus(ui.statusSeq || null);
+        if (!newStatusData) {
+            throw new Error("Invalid status data structure received from server.");
         }
+        applyStatus(ui, newStatusData);
+        renderStatus(ui);
     } catch (error) {
         console.error("[Civicomfy] Failed to update status:", error);
+        ui.statusSeq = 0; // Next poll fetches the full status
         if (ui.activeTab === 'status') {
             const errorHtml = `<p style="color: var(--error-text, #ff6b6b);">${error.details || error.message}</p>`;
             if (ui.activeListContainer) ui.activeListContainer.innerHTML = errorHtml;
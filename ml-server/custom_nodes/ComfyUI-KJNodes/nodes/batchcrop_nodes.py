@@ -1,10 +1,15 @@
-from ..utility.utility import tensor2pil, pil2tensor
-from PIL import Image, ImageDraw, ImageFilter
+from ..utility.utility import mask_bboxes
+from ..utility.morphology import box_blur, gaussian_blur
 import numpy as np
 import torch
+import torch.nn.functional as F
 from torchvision.transforms import Resize, CenterCrop, InterpolationMode
 import math
 
+from comfy import model_management
+
+main_device = model_management.get_torch_device()
+
 #based on nodes from mtb https://github.com/melMass/comfy_mtb
 
 def bbox_to_region(bbox, target_size=None):
@@ -23,6 +28,121 @@ def bbox_check(bbox, target_size=None):
     )
     return new_bbox
 
+CROP_CHUNK_PIXELS = 2**25 # Crop pixels gathered and resized together per batch
+
+def crop_resize_batch(frames, regions, transform=None, out=None):
+    """
+    Crops regions (min_x, min_y, max_x, max_y, or None to skip the frame) out of [B,H,W,C] images
+    or [B,H,W] masks and passes them through transform(crops, (height, width)) as [n,C,h,w] batches.
+    Frames whose regions have the same size are transformed together, so the result per frame is
+    the same as transforming each crop on its own. Without a transform the crops are copied as is.
+    Results are written into out, which is allocated on first use if not given.
+    """
+    is_mask = frames.dim() == 3
+    groups = {}
+    for i, region in enumerate(regions):
+        if region is not None:
+            groups.setdefault((region[3] - region[1], region[2] - region[0]), []).append(i)
+
+    for (height, width), indices in groups.items():
+        if transform is None:
+            if out is None:
+                out = torch.empty((len(regions), height, width, *frames.shape[3:]), dtype=frames.dtype, device=frames.device)
+            for i in indices:
+                min_x, min_y = regions[i][:2]
+                out[i] = frames[i, min_y:min_y + height, min_x:min_x + width]
+            continue
+
+        chunk_size = max(1, CROP_CHUNK_PIXELS // max(1, height * width))
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            # Slice copies into one buffer, much faster than an advanced-indexing gather on CPU
+            crops = torch.empty((len(chunk), height, width, *frames.shape[3:]), dtype=frames.dtype, device=frames.device)
+            for j, i in enumerate(chunk):
+                min_x, min_y = regions[i][:2]
+                crops[j] = frames[i, min_y:min_y + height, min_x:min_x + width]
+            crops = crops.unsqueeze(1) if is_mask else crops.permute(0, 3, 1, 2)
+            result = transform(crops, (height, width))
+            result = result.squeeze(1) if is_mask else result.permute(0, 2, 3, 1)
+            if out is None:
+                out = torch.empty((len(regions), *result.shape[1:]), dtype=result.dtype, device=result.device)
+            out[chunk] = result
+    return out
+
+UNCROP_CHUNK_PIXELS = 2**25 # Crop pixels resized together per batch when uncropping
+
+def feather_reach(blur_radius):
+    # How far box_blur then gaussian_blur spread a pixel: floor(radius) + 1 per pass, 3 passes for the Gaussian
+    return 4 * (math.floor(blur_radius) + 1) if blur_radius > 0 else 0
+
+def feather_mask(block, region, image_size, blur_radius):
+    """
+    Alpha over the part of region (min_x, min_y, max_x, max_y) inside a frame of image_size (width, height):
+    the [h,w] block pasted at region into an empty frame, then box and Gaussian blurred by blur_radius the
+    way the PIL BoxBlur/GaussianBlur pair did. Only the region plus the blurs' reach is blurred, pixels
+    further out stay 0 whether they exist or not.
+    """
+    min_x, min_y, max_x, max_y = region
+    img_width, img_height = image_size
+    x0, y0 = max(min_x, 0), max(min_y, 0)
+    x1, y1 = min(max_x, img_width), min(max_y, img_height)
+    if blur_radius <= 0:
+        return block[y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x]
+
+    margin = feather_reach(blur_radius) + 1
+    wx0, wy0 = max(min_x - margin, 0), max(min_y - margin, 0)
+    wx1, wy1 = min(max_x + margin, img_width), min(max_y + margin, img_height)
+    window = block.new_zeros((wy1 - wy0, wx1 - wx0))
+    window[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0] = block[y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x]
+    window = gaussian_blur(box_blur(window, blur_radius), blur_radius)
+    return window[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+
+def paste_feathered_batch(original_images, crops, regions, feather_block, device):
+    """
+    Pastes [B,h,w,C] crops into a copy of [B,H,W,C] original_images at regions (min_x, min_y, max_x, max_y),
+    resized to the region size, and blends them in place by feather masks. feather_block(i, height, width)
+    returns (block, blur_radius, key) for frame i, block being the 0-1 [height,width] mask that feather_mask
+    blurs. Blurred masks with the same key and the same placement against the frame border are reused,
+    key None computes the frame's mask on its own. Crops of the same region size are resized together.
+    """
+    img_height, img_width = original_images.shape[1:3]
+    out = original_images.to(device, dtype=torch.float32, copy=True)
+    feathers = {}
+
+    groups = {}
+    for i, (min_x, min_y, max_x, max_y) in enumerate(regions):
+        # Empty regions and regions outside the frame leave it unchanged
+        if max_x > max(min_x, 0) and max_y > max(min_y, 0) and min_x < img_width and min_y < img_height:
+            groups.setdefault((max_y - min_y, max_x - min_x), []).append(i)
+
+    for (height, width), indices in groups.items():
+        chunk_size = max(1, UNCROP_CHUNK_PIXELS // (height * width))
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            resized = crops[chunk].to(device, dtype=torch.float32).permute(0, 3, 1, 2)
+            if resized.shape[-2:] != (height, width):
+                resized = F.interpolate(resized, size=(height, width), mode="bicubic", antialias=True).clamp_(0, 1)
+            resized = resized.permute(0, 2, 3, 1)
+
+            for j, i in enumerate(chunk):
+                min_x, min_y, max_x, max_y = regions[i]
+                x0, y0 = max(min_x, 0), max(min_y, 0)
+                x1, y1 = min(max_x, img_width), min(max_y, img_height)
+                block, blur_radius, key = feather_block(i, height, width)
+                if key is not None:
+                    # The blur only sees the frame border within its reach of the region
+                    margin = feather_reach(blur_radius) + 1
+                    key = (key, blur_radius, height, width, x0 - min_x, y0 - min_y, max_x - x1, max_y - y1,
+                           min(x0, margin), min(y0, margin), min(img_width - x1, margin), min(img_height - y1, margin))
+                alpha = feathers.get(key)
+                if alpha is None:
+                    alpha = feather_mask(block.to(device), regions[i], (img_width, img_height), blur_radius)
+                    if key is not None:
+                        feathers[key] = alpha
+                crop = resized[j, y0 - min_y:y1 - min_y, x0 - min_x:x1 - min_x]
+                out[i, y0:y1, x0:x1].lerp_(crop, alpha.unsqueeze(-1))
+    return out.cpu()
+
 class BatchCropFromMask:
 
     @classmethod
@@ -69,23 +189,19 @@ class BatchCropFromMask:
     def crop(self, masks, original_images, crop_size_mult, bbox_smooth_alpha):
  
         bounding_boxes = []
-        cropped_images = []
+        regions = []
+
+        num_frames = min(len(masks), len(original_images))
+        bboxes, counts, centroids = mask_bboxes(masks[:num_frames], quantized=True)
+        if num_frames and (counts == 0).any():
+            raise ValueError(f"BatchCropFromMask: mask {int(np.argmax(counts == 0))} is empty")
 
         self.max_bbox_width = 0
         self.max_bbox_height = 0
 
         # First, calculate the maximum bounding box size across all masks
-        curr_max_bbox_width = 0
-        curr_max_bbox_height = 0
-        for mask in masks:
-            _mask = tensor2pil(mask)[0]
-            non_zero_indices = np.nonzero(np.array(_mask))
-            min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
-            min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-            width = max_x - min_x
-            height = max_y - min_y
-            curr_max_bbox_width = max(curr_max_bbox_width, width)
-            curr_max_bbox_height = max(curr_max_bbox_height, height)
+        curr_max_bbox_width = int((bboxes[:, 2] - bboxes[:, 0]).max(initial=0))
+        curr_max_bbox_height = int((bboxes[:, 3] - bboxes[:, 1]).max(initial=0))
 
         # Smooth the changes in the bounding box size
         self.max_bbox_width = self.smooth_bbox_size(self.max_bbox_width, curr_max_bbox_width, bbox_smooth_alpha)
@@ -96,16 +212,12 @@ class BatchCropFromMask:
         self.max_bbox_height = round(self.max_bbox_height * crop_size_mult)
         bbox_aspect_ratio = self.max_bbox_width / self.max_bbox_height
 
-        # Then, for each mask and corresponding image...
-        for i, (mask, img) in enumerate(zip(masks, original_images)):
-            _mask = tensor2pil(mask)[0]
-            non_zero_indices = np.nonzero(np.array(_mask))
-            min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
-            min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-            
-            # Calculate center of bounding box
-            center_x = np.mean(non_zero_indices[1])
-            center_y = np.mean(non_zero_indices[0])
+        img_height, img_width = original_images.shape[1:3]
+        half_box_width = round(self.max_bbox_width / 2)
+        half_box_height = round(self.max_bbox_height / 2)
+
+        # Then, for each mask, smooth the center and place the bounding box
+        for i, (center_x, center_y) in enumerate(centroids):
             curr_center = (round(center_x), round(center_y))
 
             # If this is the first frame, initialize prev_center with curr_center
@@ -122,34 +234,25 @@ class BatchCropFromMask:
             self.prev_center = center
 
             # Create bounding box using max_bbox_width and max_bbox_height
-            half_box_width = round(self.max_bbox_width / 2)
-            half_box_height = round(self.max_bbox_height / 2)
             min_x = max(0, center[0] - half_box_width)
-            max_x = min(img.shape[1], center[0] + half_box_width)
+            max_x = min(img_width, center[0] + half_box_width)
             min_y = max(0, center[1] - half_box_height)
-            max_y = min(img.shape[0], center[1] + half_box_height)
+            max_y = min(img_height, center[1] + half_box_height)
 
             # Append bounding box coordinates
             bounding_boxes.append((min_x, min_y, max_x - min_x, max_y - min_y))
+            regions.append((min_x, min_y, max_x, max_y))
 
-            # Crop the image from the bounding box
-            cropped_img = img[min_y:max_y, min_x:max_x, :]
-            
+        def resize_and_crop(crops, size):
             # Calculate the new dimensions while maintaining the aspect ratio
-            new_height = min(cropped_img.shape[0], self.max_bbox_height)
+            new_height = min(size[0], self.max_bbox_height)
             new_width = round(new_height * bbox_aspect_ratio)
-
-            # Resize the image
-            resize_transform = Resize((new_height, new_width))
-            resized_img = resize_transform(cropped_img.permute(2, 0, 1))
-
+            resized = Resize((new_height, new_width))(crops)
             # Perform the center crop to the desired size
-            crop_transform = CenterCrop((self.max_bbox_height, self.max_bbox_width)) # swap the order here if necessary
-            cropped_resized_img = crop_transform(resized_img)
-
-            cropped_images.append(cropped_resized_img.permute(1, 2, 0))
+            return CenterCrop((self.max_bbox_height, self.max_bbox_width))(resized)
 
-        cropped_out = torch.stack(cropped_images, dim=0)
+        # Crops of the same size are resized together
+        cropped_out = crop_resize_batch(original_images, regions, resize_and_crop)
         
         return (original_images, cropped_out, bounding_boxes, self.max_bbox_width, self.max_bbox_height, )
 
@@ -168,7 +271,10 @@ class BatchUncrop:
                 "border_bottom": ("BOOLEAN", {"default": True}),
                 "border_left": ("BOOLEAN", {"default": True}),
                 "border_right": ("BOOLEAN", {"default": True}),
-            }
+            },
+            "optional": {
+                "device": (["cpu", "gpu"], {"default": "cpu", "tooltip": "Device to use for processing"}),
+            },
         }
 
     RETURN_TYPES = ("IMAGE",)
@@ -176,20 +282,7 @@ class BatchUncrop:
 
     CATEGORY = "KJNodes/masking"
 
-    def uncrop(self, original_images, cropped_images, bboxes, border_blending, crop_rescale, border_top, border_bottom, border_left, border_right):
-        def inset_border(image, border_width, border_color, border_top, border_bottom, border_left, border_right):
-            draw = ImageDraw.Draw(image)
-            width, height = image.size
-            if border_top:
-                draw.rectangle((0, 0, width, border_width), fill=border_color)
-            if border_bottom:
-                draw.rectangle((0, height - border_width, width, height), fill=border_color)
-            if border_left:
-                draw.rectangle((0, 0, border_width, height), fill=border_color)
-            if border_right:
-                draw.rectangle((width - border_width, 0, width, height), fill=border_color)
-            return image
-
+    def uncrop(self, original_images, cropped_images, bboxes, border_blending, crop_rescale, border_top, border_bottom, border_left, border_right, device="cpu"):
         if len(original_images) != len(cropped_images):
             raise ValueError(f"The number of original_images ({len(original_images)}) and cropped_images ({len(cropped_images)}) should be the same")
 
@@ -200,55 +293,32 @@ class BatchUncrop:
         elif len(bboxes) < len(original_images):
             raise ValueError("There should be at least as many bboxes as there are original and cropped images")
 
-        input_images = tensor2pil(original_images)
-        crop_imgs = tensor2pil(cropped_images)
-        
-        out_images = []
-        for i in range(len(input_images)):
-            img = input_images[i]
-            crop = crop_imgs[i]
-            bbox = bboxes[i]
-            
-            # uncrop the image based on the bounding box
-            bb_x, bb_y, bb_width, bb_height = bbox
-
-            paste_region = bbox_to_region((bb_x, bb_y, bb_width, bb_height), img.size)
-            
-            # scale factors
-            scale_x = crop_rescale
-            scale_y = crop_rescale
-
-            # scaled paste_region
-            paste_region = (round(paste_region[0]*scale_x), round(paste_region[1]*scale_y), round(paste_region[2]*scale_x), round(paste_region[3]*scale_y))
-
-            # rescale the crop image to fit the paste_region
-            crop = crop.resize((round(paste_region[2]-paste_region[0]), round(paste_region[3]-paste_region[1])))
-            crop_img = crop.convert("RGB")
-   
-            if border_blending > 1.0:
-                border_blending = 1.0
-            elif border_blending < 0.0:
-                border_blending = 0.0
-
-            blend_ratio = (max(crop_img.size) / 2) * float(border_blending)
-
-            blend = img.convert("RGBA")
-            mask = Image.new("L", img.size, 0)
-
-            mask_block = Image.new("L", (paste_region[2]-paste_region[0], paste_region[3]-paste_region[1]), 255)
-            mask_block = inset_border(mask_block, round(blend_ratio / 2), (0), border_top, border_bottom, border_left, border_right)
-                      
-            mask.paste(mask_block, paste_region)
-            blend.paste(crop_img, paste_region)
-
-            mask = mask.filter(ImageFilter.BoxBlur(radius=blend_ratio / 4))
-            mask = mask.filter(ImageFilter.GaussianBlur(radius=blend_ratio / 4))
-
-            blend.putalpha(mask)
-            img = Image.alpha_composite(img.convert("RGBA"), blend)
-            out_images.append(img.convert("RGB"))
-
-        return (pil2tensor(out_images),)
+        processing_device = main_device if device == "gpu" else torch.device("cpu")
+        img_size = (original_images.shape[2], original_images.shape[1])
+        border_blending = min(max(float(border_blending), 0.0), 1.0)
+
+        regions = []
+        for bbox in bboxes:
+            # uncrop the image based on the bounding box, scaled by crop_rescale
+            paste_region = bbox_to_region(bbox, img_size)
+            regions.append(tuple(round(v * crop_rescale) for v in paste_region))
+
+        def feather_block(i, height, width):
+            blend_ratio = (max(width, height) / 2) * border_blending
+            border_width = round(blend_ratio / 2)
+            # Inset borders as drawn by PIL's inclusive rectangles: top and left cover border_width + 1 pixels
+            block = torch.ones((height, width))
+            if border_top:
+                block[:border_width + 1] = 0
+            if border_bottom:
+                block[max(height - border_width, 0):] = 0
+            if border_left:
+                block[:, :border_width + 1] = 0
+            if border_right:
+                block[:, max(width - border_width, 0):] = 0
+            return block, blend_ratio / 4, "square"
+
+        return (paste_feathered_batch(original_images, cropped_images, regions, feather_block, processing_device),)
 
 class BatchCropFromMaskAdvanced:
 
@@ -298,44 +368,35 @@ class BatchCropFromMaskAdvanced:
     def crop(self, masks, original_images, crop_size_mult, bbox_smooth_alpha):
         bounding_boxes = []
         combined_bounding_box = []
-        cropped_images = []
-        cropped_masks = []
-        cropped_masks_out = []
-        combined_crop_out = []
-        combined_cropped_images = []
-        combined_cropped_masks = []
-        
-        def calculate_bbox(mask):
-            non_zero_indices = np.nonzero(np.array(mask))
-
-            # handle empty masks
-            min_x, max_x, min_y, max_y = 0, 0, 0, 0
-            if len(non_zero_indices[1]) > 0 and len(non_zero_indices[0]) > 0:
-                min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
-                min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-
-            width = max_x - min_x
-            height = max_y - min_y
-            bbox_size = max(width, height)
-            return min_x, max_x, min_y, max_y, bbox_size
-
-        combined_mask = torch.max(masks, dim=0)[0]
-        _mask = tensor2pil(combined_mask)[0]
-        new_min_x, new_max_x, new_min_y, new_max_y, combined_bbox_size = calculate_bbox(_mask)
+        regions = []
+
+        num_frames = min(len(masks), len(original_images))
+        img_height, img_width = original_images.shape[1:3]
+        bboxes, counts, centroids = mask_bboxes(masks[:num_frames], quantized=True)
+        non_empty = counts > 0
+        bbox_sizes = np.maximum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+
+        # The combined mask's bounding box is the union of the per-mask ones
+        if non_empty.any():
+            new_min_x, new_min_y = bboxes[non_empty, :2].min(0).tolist()
+            new_max_x, new_max_y = bboxes[non_empty, 2:].max(0).tolist()
+        else:
+            new_min_x, new_max_x, new_min_y, new_max_y = 0, 0, 0, 0
+        combined_bbox_size = max(new_max_x - new_min_x, new_max_y - new_min_y)
         center_x = (new_min_x + new_max_x) / 2
         center_y = (new_min_y + new_max_y) / 2
         half_box_size = round(combined_bbox_size // 2)
         new_min_x = max(0, round(center_x - half_box_size))
-        new_max_x = min(original_images[0].shape[1], round(center_x + half_box_size))
+        new_max_x = min(img_width, round(center_x + half_box_size))
         new_min_y = max(0, round(center_y - half_box_size))
-        new_max_y = min(original_images[0].shape[0], round(center_y + half_box_size))
+        new_max_y = min(img_height, round(center_y + half_box_size))
         
         combined_bounding_box.append((new_min_x, new_min_y, new_max_x - new_min_x, new_max_y - new_min_y))   
         
         self.max_bbox_size = 0
         
         # First, calculate the maximum bounding box size across all masks
-        curr_max_bbox_size = max(calculate_bbox(tensor2pil(mask)[0])[-1] for mask in masks)
+        curr_max_bbox_size = int(bbox_sizes.max(initial=0))
         # Smooth the changes in the bounding box size
         self.max_bbox_size = self.smooth_bbox_size(self.max_bbox_size, curr_max_bbox_size, bbox_smooth_alpha)
         # Apply the crop size multiplier
@@ -343,23 +404,16 @@ class BatchCropFromMaskAdvanced:
         # Make sure max_bbox_size is divisible by 16, if not, round it upwards so it is
         self.max_bbox_size = math.ceil(self.max_bbox_size / 16) * 16
 
-        if self.max_bbox_size > original_images[0].shape[0] or self.max_bbox_size > original_images[0].shape[1]:
+        if self.max_bbox_size > img_height or self.max_bbox_size > img_width:
             # max_bbox_size can only be as big as our input's width or height, and it has to be even
-            self.max_bbox_size = math.floor(min(original_images[0].shape[0], original_images[0].shape[1]) / 2) * 2
-
-        # Then, for each mask and corresponding image...
-        for i, (mask, img) in enumerate(zip(masks, original_images)):
-            _mask = tensor2pil(mask)[0]
-            non_zero_indices = np.nonzero(np.array(_mask))
+            self.max_bbox_size = math.floor(min(img_height, img_width) / 2) * 2
 
+        # Then, for each mask, smooth the center and place the bounding box
+        for i in range(num_frames):
             # check for empty masks
-            if len(non_zero_indices[0]) > 0 and len(non_zero_indices[1]) > 0:
-                min_x, max_x = np.min(non_zero_indices[1]), np.max(non_zero_indices[1])
-                min_y, max_y = np.min(non_zero_indices[0]), np.max(non_zero_indices[0])
-
+            if non_empty[i]:
                 # Calculate center of bounding box
-                center_x = np.mean(non_zero_indices[1])
-                center_y = np.mean(non_zero_indices[0])
+                center_x, center_y = centroids[i]
                 curr_center = (round(center_x), round(center_y))
 
                 # If this is the first frame, initialize prev_center with curr_center
@@ -378,48 +432,45 @@ class BatchCropFromMaskAdvanced:
                 # Create bounding box using max_bbox_size
                 half_box_size = self.max_bbox_size // 2
                 min_x = max(0, center[0] - half_box_size)
-                max_x = min(img.shape[1], center[0] + half_box_size)
+                max_x = min(img_width, center[0] + half_box_size)
                 min_y = max(0, center[1] - half_box_size)
-                max_y = min(img.shape[0], center[1] + half_box_size)
+                max_y = min(img_height, center[1] + half_box_size)
 
                 # Append bounding box coordinates
                 bounding_boxes.append((min_x, min_y, max_x - min_x, max_y - min_y))
-
-                # Crop the image from the bounding box
-                cropped_img = img[min_y:max_y, min_x:max_x, :]
-                cropped_mask = mask[min_y:max_y, min_x:max_x]
-
-                # Resize the cropped image to a fixed size
-                new_size = max(cropped_img.shape[0], cropped_img.shape[1])
-                resize_transform = Resize(new_size, interpolation=InterpolationMode.NEAREST, max_size=max(img.shape[0], img.shape[1]))
-                resized_mask = resize_transform(cropped_mask.unsqueeze(0).unsqueeze(0)).squeeze(0).squeeze(0)
-                resized_img = resize_transform(cropped_img.permute(2, 0, 1))
-                # Perform the center crop to the desired size
-                # Constrain the crop to the smaller of our bbox or our image so we don't expand past the image dimensions.
-                crop_transform = CenterCrop((min(self.max_bbox_size, resized_img.shape[1]), min(self.max_bbox_size, resized_img.shape[2])))
-
-                cropped_resized_img = crop_transform(resized_img)
-                cropped_images.append(cropped_resized_img.permute(1, 2, 0))
-
-                cropped_resized_mask = crop_transform(resized_mask)
-                cropped_masks.append(cropped_resized_mask)
-
-                combined_cropped_img = original_images[i][new_min_y:new_max_y, new_min_x:new_max_x, :]
-                combined_cropped_images.append(combined_cropped_img)
-
-                combined_cropped_mask = masks[i][new_min_y:new_max_y, new_min_x:new_max_x]
-                combined_cropped_masks.append(combined_cropped_mask)
+                regions.append((min_x, min_y, max_x, max_y))
             else:
-                bounding_boxes.append((0, 0, img.shape[1], img.shape[0]))
-                cropped_images.append(img)
-                cropped_masks.append(mask)
-                combined_cropped_images.append(img)
-                combined_cropped_masks.append(mask)
+                bounding_boxes.append((0, 0, img_width, img_height))
+                regions.append(None)
 
-        cropped_out = torch.stack(cropped_images, dim=0)
-        combined_crop_out = torch.stack(combined_cropped_images, dim=0)
-        cropped_masks_out = torch.stack(cropped_masks, dim=0)
-        combined_crop_mask_out = torch.stack(combined_cropped_masks, dim=0)
+        def resize_and_crop(crops, size):
+            # Resize the cropped image to a fixed size
+            new_size = max(size)
+            resized = Resize(new_size, interpolation=InterpolationMode.NEAREST, max_size=max(img_height, img_width))(crops)
+            # Perform the center crop to the desired size
+            # Constrain the crop to the smaller of our bbox or our image so we don't expand past the image dimensions.
+            return CenterCrop((min(self.max_bbox_size, resized.shape[-2]), min(self.max_bbox_size, resized.shape[-1])))(resized)
+
+        # Crops of the same size are resized together, empty masks pass the whole frame through
+        cropped_out = crop_resize_batch(original_images[:num_frames], regions, resize_and_crop)
+        cropped_masks_out = crop_resize_batch(masks[:num_frames], regions, resize_and_crop)
+        combined_regions = [(new_min_x, new_min_y, new_max_x, new_max_y) if region is not None else None for region in regions]
+        combined_crop_out = crop_resize_batch(original_images[:num_frames], combined_regions)
+        combined_crop_mask_out = crop_resize_batch(masks[:num_frames], combined_regions)
+
+        empty_indices = np.flatnonzero(~non_empty).tolist()
+        if empty_indices:
+            if cropped_out is None:
+                cropped_out = original_images[:num_frames].clone()
+                cropped_masks_out = masks[:num_frames].clone()
+                combined_crop_out = original_images[:num_frames].clone()
+                combined_crop_mask_out = masks[:num_frames].clone()
+            else:
+                for out, frames in ((cropped_out, original_images), (cropped_masks_out, masks),
+                                    (combined_crop_out, original_images), (combined_crop_mask_out, masks)):
+                    if out.shape[1:] != frames.shape[1:]:
+                        raise RuntimeError(f"BatchCropFromMaskAdvanced: cannot batch uncropped frames of empty masks {list(frames.shape[1:])} with crops {list(out.shape[1:])}")
+                    out[empty_indices] = frames[empty_indices]
 
         return (original_images, cropped_out, cropped_masks_out, combined_crop_out, combined_crop_mask_out, bounding_boxes, combined_bounding_box, self.max_bbox_size, self.max_bbox_size)
 
@@ -550,6 +601,7 @@ class BatchUncropAdvanced:
             },
             "optional": {
                 "combined_bounding_box": ("BBOX", {"default": None}),  
+                "device": (["cpu", "gpu"], {"default": "cpu", "tooltip": "Device to use for processing"}),
             },
         }
 
@@ -558,16 +610,7 @@ class BatchUncropAdvanced:
     CATEGORY = "KJNodes/masking"
 
 
-    def uncrop(self, original_images, cropped_images, cropped_masks, combined_crop_mask, bboxes, border_blending, crop_rescale, use_combined_mask, use_square_mask, combined_bounding_box = None):
-        
-        def inset_border(image, border_width=20, border_color=(0)):
-            width, height = image.size
-            bordered_image = Image.new(image.mode, (width, height), border_color)
-            bordered_image.paste(image, (0, 0))
-            draw = ImageDraw.Draw(bordered_image)
-            draw.rectangle((0, 0, width - 1, height - 1), outline=border_color, width=border_width)
-            return bordered_image
-
+    def uncrop(self, original_images, cropped_images, cropped_masks, combined_crop_mask, bboxes, border_blending, crop_rescale, use_combined_mask, use_square_mask, combined_bounding_box = None, device="cpu"):
         if len(original_images) != len(cropped_images):
             raise ValueError(f"The number of original_images ({len(original_images)}) and cropped_images ({len(cropped_images)}) should be the same")
 
@@ -578,62 +621,39 @@ class BatchUncropAdvanced:
         elif len(bboxes) < len(original_images):
             raise ValueError("There should be at least as many bboxes as there are original and cropped images")
 
-        crop_imgs = tensor2pil(cropped_images)
-        input_images = tensor2pil(original_images)
-        out_images = []
-
-        for i in range(len(input_images)):
-            img = input_images[i]
-            crop = crop_imgs[i]
-            bbox = bboxes[i]
-            
-            if use_combined_mask:
-                bb_x, bb_y, bb_width, bb_height = combined_bounding_box[0]
-                paste_region = bbox_to_region((bb_x, bb_y, bb_width, bb_height), img.size)
-                mask = combined_crop_mask[i]
-            else:
-                bb_x, bb_y, bb_width, bb_height = bbox
-                paste_region = bbox_to_region((bb_x, bb_y, bb_width, bb_height), img.size)
-                mask = cropped_masks[i]
-            
-            # scale paste_region
-            scale_x = scale_y = crop_rescale
-            paste_region = (round(paste_region[0]*scale_x), round(paste_region[1]*scale_y), round(paste_region[2]*scale_x), round(paste_region[3]*scale_y))
-
-            # rescale the crop image to fit the paste_region
-            crop = crop.resize((round(paste_region[2]-paste_region[0]), round(paste_region[3]-paste_region[1])))
-            crop_img = crop.convert("RGB")
+        processing_device = main_device if device == "gpu" else torch.device("cpu")
+        img_size = (original_images.shape[2], original_images.shape[1])
+        border_blending = min(max(float(border_blending), 0.0), 1.0)
 
-            #border blending
-            if border_blending > 1.0:
-                border_blending = 1.0
-            elif border_blending < 0.0:
-                border_blending = 0.0
+        if use_combined_mask:
+            bboxes = [combined_bounding_box[0]] * len(original_images)
+            masks = combined_crop_mask
+        else:
+            masks = cropped_masks
 
-            blend_ratio = (max(crop_img.size) / 2) * float(border_blending)
-            blend = img.convert("RGBA")
+        regions = []
+        for bbox in bboxes:
+            # scale paste_region
+            paste_region = bbox_to_region(bbox, img_size)
+            regions.append(tuple(round(v * crop_rescale) for v in paste_region))
 
+        def feather_block(i, height, width):
+            blend_ratio = (max(width, height) / 2) * border_blending
             if use_square_mask:
-                mask = Image.new("L", img.size, 0)
-                mask_block = Image.new("L", (paste_region[2]-paste_region[0], paste_region[3]-paste_region[1]), 255)
-                mask_block = inset_border(mask_block, round(blend_ratio / 2), (0))
-                mask.paste(mask_block, paste_region)
-            else:
-                original_mask = tensor2pil(mask)[0]
-                original_mask = original_mask.resize((paste_region[2]-paste_region[0], paste_region[3]-paste_region[1]))
-                mask = Image.new("L", img.size, 0)
-                mask.paste(original_mask, paste_region)
-
-            mask = mask.filter(ImageFilter.BoxBlur(radius=blend_ratio / 4))
-            mask = mask.filter(ImageFilter.GaussianBlur(radius=blend_ratio / 4))
-
-            blend.paste(crop_img, paste_region) 
-            blend.putalpha(mask)
-            
-            img = Image.alpha_composite(img.convert("RGBA"), blend)
-            out_images.append(img.convert("RGB"))
-
-        return (pil2tensor(out_images),)
+                border_width = round(blend_ratio / 2)
+                block = torch.ones((height, width))
+                if border_width > 0:
+                    block[:border_width] = 0
+                    block[-border_width:] = 0
+                    block[:, :border_width] = 0
+                    block[:, -border_width:] = 0
+                return block, blend_ratio / 4, "square"
+            # rescale the crop mask to fit the paste_region
+            mask = masks[i].to(processing_device, dtype=torch.float32)
+            block = F.interpolate(mask[None, None], size=(height, width), mode="bicubic", antialias=True)
+            return block[0, 0].clamp_(0, 1), blend_ratio / 4, None
+
+        return (paste_feathered_batch(original_images, cropped_images, regions, feather_block, processing_device),)
 
 class SplitBboxes:
 
@@ -32,7 +32,8 @@ try:
     from server import PromptServer
 except:
     PromptServer = None
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ..utility.frame_cache import get_frame_cache
 
 script_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -3009,58 +3010,106 @@ class LoadAndResizeImage:
         return True
 
 import hashlib
-class LoadImagesFromFolderKJ:
-    # Dictionary to store folder hashes
-    folder_hashes = {}
+import threading
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tga')
+
+class ImageFolderState:
+    """
+    Sorted image files of a folder (optionally with subfolders) and their mtimes, kept between runs.
+    A refresh stats only the directories; a directory is listed again (one os.scandir pass, which
+    also yields the file stats) when its mtime changed, i.e. files were added, removed or renamed.
+    Files overwritten in place don't change their directory, so everything is re-stated at least
+    every RESTAT_INTERVAL seconds.
+    """
+    RESTAT_INTERVAL = 60
+    states = {}
+    states_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, folder, include_subfolders):
+        key = (folder, bool(include_subfolders))
+        with cls.states_lock:
+            state = cls.states.get(key)
+            if state is None:
+                state = cls.states[key] = cls(folder, bool(include_subfolders))
+            return state
+
+    def __init__(self, folder, include_subfolders):
+        self.folder = folder
+        self.include_subfolders = include_subfolders
+        self.lock = threading.Lock()
+        self.dirs = {}  # directory -> (mtime_ns, [(path, mtime)], [subdirectories])
+        self.files = []
+        self.hash = None
+        self.restated_at = 0.0
+
+    def scan_dir(self, directory, dir_mtime):
+        files = []
+        subdirs = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.include_subfolders:
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                        files.append((entry.path, entry.stat().st_mtime))
+                except OSError:
+                    pass
+        return dir_mtime, files, subdirs
+
+    def refresh(self):
+        """Returns (sorted image paths, hash of the folder, paths and mtimes)."""
+        with self.lock:
+            restat = time.monotonic() - self.restated_at > self.RESTAT_INTERVAL
+            changed = False
+            seen = set()
+            pending = [self.folder]
+            while pending:
+                directory = pending.pop()
+                try:
+                    dir_mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(directory)
+                cached = self.dirs.get(directory)
+                if restat or cached is None or cached[0] != dir_mtime:
+                    try:
+                        scanned = self.scan_dir(directory, dir_mtime)
+                    except OSError:
+                        seen.discard(directory)
+                        continue
+                    if cached is None or scanned[1:] != cached[1:]:
+                        changed = True
+                    self.dirs[directory] = cached = scanned
+                pending.extend(cached[2])
+            for directory in [d for d in self.dirs if d not in seen]:
+                del self.dirs[directory]
+                changed = True
+            if restat:
+                self.restated_at = time.monotonic()
+
+            if changed or self.hash is None:
+                file_data = sorted(f for _, files, _ in self.dirs.values() for f in files)
+                combined_hash = hashlib.md5()
+                combined_hash.update(self.folder.encode('utf-8'))
+                combined_hash.update(str(len(file_data)).encode('utf-8'))
+                for path, mtime in file_data:
+                    combined_hash.update(f"{path}:{mtime}".encode('utf-8'))
+                self.files = [path for path, _ in file_data]
+                self.hash = combined_hash.hexdigest()
+            return self.files, self.hash
 
+class LoadImagesFromFolderKJ:
     @classmethod
     def IS_CHANGED(cls, folder, **kwargs):
         if folder and not os.path.isabs(folder) and args.base_directory:
             folder = os.path.join(args.base_directory, folder)
         if not folder or not os.path.isdir(folder):
             return float("NaN")
-        
-        valid_extensions = ['.jpg', '.jpeg', '.png', '.webp', '.tga']
-        include_subfolders = kwargs.get('include_subfolders', False)
-        
-        file_data = []
-        if include_subfolders:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if any(file.lower().endswith(ext) for ext in valid_extensions):
-                        path = os.path.join(root, file)
-                        try:
-                            mtime = os.path.getmtime(path)
-                            file_data.append((path, mtime))
-                        except OSError:
-                            pass
-        else:
-            for file in sorted(os.listdir(folder)):
-                if any(file.lower().endswith(ext) for ext in valid_extensions):
-                    path = os.path.join(folder, file)
-                    try:
-                        mtime = os.path.getmtime(path)
-                        file_data.append((path, mtime))
-                    except OSError:
-                        pass
-        
-        file_data.sort()
-        
-        combined_hash = hashlib.md5()
-        combined_hash.update(folder.encode('utf-8'))
-        combined_hash.update(str(len(file_data)).encode('utf-8'))
-        
-        for path, mtime in file_data:
-            combined_hash.update(f"{path}:{mtime}".encode('utf-8'))
-        
-        current_hash = combined_hash.hexdigest()
-        
-        old_hash = cls.folder_hashes.get(folder)
-        cls.folder_hashes[folder] = current_hash
-        
-        if old_hash == current_hash:
-            return old_hash
-        
+
+        _, current_hash = ImageFolderState.get(folder, kwargs.get('include_subfolders', False)).refresh()
         return current_hash
 
     @classmethod
@@ -3076,6 +3125,7 @@ class LoadImagesFromFolderKJ:
                 "image_load_cap": ("INT", {"default": 0, "min": 0, "step": 1}),
                 "start_index": ("INT", {"default": 0, "min": 0, "step": 1}),
                 "include_subfolders": ("BOOLEAN", {"default": False}),
+                "use_cache": ("BOOLEAN", {"default": True, "tooltip": "Keep decoded, resized frames on disk (ComfyUI temp folder) so re-runs only decode new or changed files"}),
             }
         }
 
@@ -3085,94 +3135,108 @@ class LoadImagesFromFolderKJ:
     CATEGORY = "KJNodes/image"
     DESCRIPTION = """Loads images from a folder into a batch, images are resized and loaded into a batch."""
 
-    def load_images(self, folder, width, height, image_load_cap, start_index, keep_aspect_ratio, include_subfolders=False):    
+    def load_images(self, folder, width, height, image_load_cap, start_index, keep_aspect_ratio, include_subfolders=False, use_cache=True):    
         if folder and not os.path.isabs(folder) and args.base_directory:
             folder = os.path.join(args.base_directory, folder)
         if not folder or not os.path.isdir(folder):
             raise FileNotFoundError(f"Folder '{folder}' cannot be found.")
         
-        valid_extensions = ['.jpg', '.jpeg', '.png', '.webp', '.tga']
-        image_paths = []
-        if include_subfolders:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if any(file.lower().endswith(ext) for ext in valid_extensions):
-                        image_paths.append(os.path.join(root, file))
-        else:
-            for file in sorted(os.listdir(folder)):
-                if any(file.lower().endswith(ext) for ext in valid_extensions):
-                    image_paths.append(os.path.join(folder, file))
-
-        dir_files = sorted(image_paths)
+        # Same listing IS_CHANGED just refreshed; only the directory mtimes are checked again
+        dir_files, _ = ImageFolderState.get(folder, include_subfolders).refresh()
 
         if len(dir_files) == 0:
             raise FileNotFoundError(f"No files in directory '{folder}'.")
 
-        # start at start_index
+        # start at start_index; only the files that end up in the batch are decoded
         dir_files = dir_files[start_index:]
-
-        images = []
-        masks = []
-        image_path_list = []
-
-        limit_images = False
         if image_load_cap > 0:
-            limit_images = True
-        image_count = 0
+            dir_files = dir_files[:image_load_cap]
+        if len(dir_files) == 0:
+            raise FileNotFoundError(f"No images in directory '{folder}' from start_index {start_index}.")
 
         pbar = ProgressBar(len(dir_files))
-
-        for image_path in dir_files:
-            if os.path.isdir(image_path):
-                continue
-            if limit_images and image_count >= image_load_cap:
-                break
-            i = Image.open(image_path)
-            i = ImageOps.exif_transpose(i)
-            
-            # Resize image to maximum dimensions
-            if width == -1 and height == -1:
-                width = i.size[0]
-                height = i.size[1]
-            if i.size != (width, height):
-                i = self.resize_with_aspect_ratio(i, width, height, keep_aspect_ratio)
-            
-            
-            image = i.convert("RGB")
-            image = np.array(image).astype(np.float32) / 255.0
-            image = torch.from_numpy(image)[None,]
-            
-            if 'A' in i.getbands():
-                mask = np.array(i.getchannel('A')).astype(np.float32) / 255.0
-                mask = 1. - torch.from_numpy(mask)
+        cache = get_frame_cache() if use_cache else None
+
+        first = None
+        if width == -1 and height == -1:
+            # Batch size comes from the first image
+            first = self.load_image_cached(cache, dir_files[0], None, None, keep_aspect_ratio)
+            height, width = first[0].shape[:2]
+
+        # Frames are decoded as uint8 and converted straight into their slot of the batch
+        images = torch.empty((len(dir_files), height, width, 3), dtype=torch.float32)
+        masks = torch.zeros((len(dir_files), height, width), dtype=torch.float32)
+        images_np = images.numpy()
+        masks_np = masks.numpy()
+
+        def store(index, decoded):
+            image, alpha = decoded
+            if image.shape[:2] != (height, width):
+                raise ValueError(f"Image '{dir_files[index]}' was resized to {image.shape[1]}x{image.shape[0]}, expected {width}x{height}.")
+            np.divide(image, np.float32(255.0), out=images_np[index], dtype=np.float32)
+            if alpha is not None:
+                mask = 1. - torch.from_numpy(alpha.astype(np.float32) / 255.0)
                 if mask.shape != (height, width):
-                    mask = torch.nn.functional.interpolate(mask.unsqueeze(0).unsqueeze(0), 
-                                                         size=(height, width), 
-                                                         mode='bilinear', 
+                    mask = torch.nn.functional.interpolate(mask.unsqueeze(0).unsqueeze(0),
+                                                         size=(height, width),
+                                                         mode='bilinear',
                                                          align_corners=False).squeeze()
-            else:
-                mask = torch.zeros((height, width), dtype=torch.float32, device="cpu")
-            
-            images.append(image)
-            masks.append(mask)
-            image_path_list.append(image_path)
-            image_count += 1
-            pbar.update(1)
+                masks_np[index] = mask.numpy()
 
-        if len(images) == 1:
-            return (images[0], masks[0], 1, image_path_list)
-        
-        elif len(images) > 1:
-            image1 = images[0]
-            mask1 = masks[0].unsqueeze(0)
+        def load(index):
+            store(index, self.load_image_cached(cache, dir_files[index], width, height, keep_aspect_ratio))
 
-            for image2 in images[1:]:
-                image1 = torch.cat((image1, image2), dim=0)
+        start = 0
+        if first is not None:
+            store(0, first)
+            pbar.update(1)
+            start = 1
 
-            for mask2 in masks[1:]:
-                mask1 = torch.cat((mask1, mask2.unsqueeze(0)), dim=0)
+        # PIL releases the GIL while decoding and resizing, so threads scale across cores
+        remaining = range(start, len(dir_files))
+        max_threads = min(os.cpu_count() or 1, len(remaining))
+        if max_threads > 1:
+            with ThreadPoolExecutor(max_workers=max_threads) as executor:
+                futures = [executor.submit(load, index) for index in remaining]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                        pbar.update(1)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for index in remaining:
+                load(index)
+                pbar.update(1)
+
+        if len(dir_files) == 1:
+            return (images, masks[0], 1, dir_files)
+        return (images, masks, len(dir_files), dir_files)
+
+    def load_image_cached(self, cache, image_path, width, height, keep_aspect_ratio):
+        """load_image_uint8() through the frame cache: hits are memory-mapped, misses are decoded and stored."""
+        key = cache.key(image_path, width, height, keep_aspect_ratio) if cache is not None else None
+        cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            return cached[..., :3], (cached[..., 3] if cached.shape[2] == 4 else None)
+        image, alpha = self.load_image_uint8(image_path, width, height, keep_aspect_ratio)
+        if key is not None:
+            cache.put(key, image if alpha is None else np.dstack((image, alpha)))
+        return image, alpha
+
+    def load_image_uint8(self, image_path, width, height, keep_aspect_ratio):
+        """Decodes, EXIF-transposes and resizes one image; returns (RGB uint8 HxWx3, alpha uint8 HxW or None).
+        width/height None keeps the image's own size."""
+        with Image.open(image_path) as img:
+            i = ImageOps.exif_transpose(img)
+            if width is not None and i.size != (width, height):
+                i = self.resize_with_aspect_ratio(i, width, height, keep_aspect_ratio)
+            image = np.asarray(i.convert("RGB"))
+            alpha = np.asarray(i.getchannel('A')) if 'A' in i.getbands() else None
+        return image, alpha
 
-            return (image1, mask1, len(images), image_path_list)
     def resize_with_aspect_ratio(self, img, width, height, mode):
         if mode == "stretch":
             return img.resize((width, height), Image.Resampling.LANCZOS)
@@ -4004,6 +4068,9 @@ class LoadVideosFromFolder:
                 "grid_max_columns": ("INT", {"default": 4, "min": 1, "max": 16, "step": 1, "disable": 1}),
                 "add_label": ( "BOOLEAN", {"default": False} ),
             },
+            "optional": {
+                "use_cache": ("BOOLEAN", {"default": True, "tooltip": "Keep decoded frames on disk as uint8 (ComfyUI temp folder) so re-runs only decode new or changed videos"}),
+            },
             "hidden": {
                 "force_size": "STRING",
                 "unique_id": "UNIQUE_ID"
@@ -4017,7 +4084,7 @@ class LoadVideosFromFolder:
 
     FUNCTION = "load_video"
 
-    def load_video(self, output_type, grid_max_columns, add_label=False, **kwargs):
+    def load_video(self, output_type, grid_max_columns, add_label=False, use_cache=True, **kwargs):
         if kwargs.get('video') and not os.path.isabs(kwargs['video']) and args.base_directory:
             kwargs['video'] = os.path.join(args.base_directory, kwargs['video'])
             
@@ -4033,9 +4100,19 @@ class LoadVideosFromFolder:
                     filenames.append(f)
         print(videos_list)
         kwargs.pop('video')
+        cache = get_frame_cache() if use_cache else None
+        # Everything but the node id changes the decoded frames
+        decode_settings = tuple(sorted((k, v) for k, v in kwargs.items() if k != 'unique_id'))
         loaded_videos = []
         for idx, video in enumerate(videos_list):
-            video_tensor = self.vhs_nodes.load_video_nodes.load_video(video=video, **kwargs)[0]
+            key = cache.key(video, decode_settings) if cache is not None else None
+            cached = cache.get(key) if key is not None else None
+            if cached is not None:
+                video_tensor = torch.from_numpy(np.divide(cached, np.float32(255.0), dtype=np.float32))
+            else:
+                video_tensor = self.vhs_nodes.load_video_nodes.load_video(video=video, **kwargs)[0]
+                if key is not None:
+                    cache.put(key, (video_tensor * 255.0).round_().clamp_(0, 255).to(torch.uint8).cpu().numpy())
             if add_label:
                 # Add filename label above video (without extension)
                 if video_tensor.dim() == 4:
@@ -15,12 +15,15 @@ from nodes import MAX_RESOLUTION
 
 import folder_paths
 
-from ..utility.utility import tensor2pil, pil2tensor
+from ..utility.utility import tensor2pil, pil2tensor, mask_bboxes
+from ..utility.morphology import dilate, erode, gaussian_blur
 
 script_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 main_device = model_management.get_torch_device()
 offload_device = model_management.unet_offload_device()
 
+GROW_MASK_CHUNK_PIXELS = 2**25 # GrowMaskWithBlur: frames processed together per device batch (by pixel count)
+
 class BatchCLIPSeg:
 
     def __init__(self):
@@ -995,69 +998,70 @@ class GrowMaskWithBlur:
 - fill_holes: fill holes in the mask (slow)"""
     
     def expand_mask(self, mask, expand, tapered_corners, flip_input, blur_radius, incremental_expandrate, lerp_alpha, decay_factor, fill_holes=False):
-        import kornia.morphology as morph
         alpha = lerp_alpha
         decay = decay_factor
         if flip_input:
             mask = 1.0 - mask
 
         growmask = mask.reshape((-1, mask.shape[-2], mask.shape[-1]))
-        out = []
-        previous_output = None
+        num_frames, height, width = growmask.shape
+
+        # Per-frame grow (positive) / shrink (negative) radius
+        radii = []
         current_expand = expand
-        for m in tqdm(growmask, desc="Expanding/Contracting Mask"):
-            output = m.unsqueeze(0).unsqueeze(0).to(main_device)  # Add batch and channel dims for kornia
-            if abs(round(current_expand)) > 0:
-                # Create kernel - kornia expects kernel on same device as input
-                if tapered_corners:
-                    kernel = torch.tensor([[0, 1, 0],
-                                        [1, 1, 1],
-                                        [0, 1, 0]], dtype=torch.float32, device=output.device)
-                else:
-                    kernel = torch.tensor([[1, 1, 1],
-                                        [1, 1, 1],
-                                        [1, 1, 1]], dtype=torch.float32, device=output.device)
-                
-                for _ in range(abs(round(current_expand))):
-                    if current_expand < 0:
-                        output = morph.erosion(output, kernel)
-                    else:
-                        output = morph.dilation(output, kernel)
-            
-            output = output.squeeze(0).squeeze(0)  # Remove batch and channel dims
-            
+        for _ in range(num_frames):
+            radii.append(round(current_expand))
             if current_expand < 0:
                 current_expand -= abs(incremental_expandrate)
             else:
                 current_expand += abs(incremental_expandrate)
-                
+
+        if fill_holes:
+            # 2D cross connectivity within each frame, frames not connected to each other
+            fill_structure = np.zeros((3, 3, 3), dtype=bool)
+            fill_structure[1] = scipy.ndimage.generate_binary_structure(2, 1)
+
+        out = torch.empty((num_frames, height, width), dtype=torch.float32)
+        chunk_size = max(1, GROW_MASK_CHUNK_PIXELS // (height * width))
+        previous_output = None
+        pbar = ProgressBar(num_frames)
+        for start in range(0, num_frames, chunk_size):
+            end = min(start + chunk_size, num_frames)
+            output = growmask[start:end].to(main_device, dtype=torch.float32, copy=True)
+            chunk_radii = radii[start:end]
+            for radius in sorted(set(chunk_radii)):
+                if radius == 0:
+                    continue
+                morph = erode if radius < 0 else dilate
+                if len(set(chunk_radii)) == 1:
+                    output = morph(output, abs(radius), tapered_corners)
+                else:
+                    idx = torch.tensor([i for i, r in enumerate(chunk_radii) if r == radius], device=output.device)
+                    output[idx] = morph(output[idx], abs(radius), tapered_corners)
+
             if fill_holes:
-                binary_mask = output > 0
-                output_np = binary_mask.cpu().numpy()
-                filled = scipy.ndimage.binary_fill_holes(output_np)
+                filled = scipy.ndimage.binary_fill_holes((output > 0).cpu().numpy(), structure=fill_structure)
                 output = torch.from_numpy(filled.astype(np.float32)).to(output.device)
-            
-            if alpha < 1.0 and previous_output is not None:
-                output = alpha * output + (1 - alpha) * previous_output
-            if decay < 1.0 and previous_output is not None:
-                output += decay * previous_output
-                output = output / output.max()
-            previous_output = output
-            out.append(output.cpu())
-
-        if blur_radius != 0:
-            # Convert the tensor list to PIL images, apply blur, and convert back
-            for idx, tensor in enumerate(out):
-                # Convert tensor to PIL image
-                pil_image = tensor2pil(tensor.cpu().detach())[0]
-                # Apply Gaussian blur
-                pil_image = pil_image.filter(ImageFilter.GaussianBlur(blur_radius))
-                # Convert back to tensor
-                out[idx] = pil2tensor(pil_image)
-            blurred = torch.cat(out, dim=0)
-            return (blurred, 1.0 - blurred)
-        else:
-            return (torch.stack(out, dim=0), 1.0 - torch.stack(out, dim=0),)
+
+            # Each frame blends with the previous result, so this part stays sequential
+            if alpha < 1.0 or decay < 1.0:
+                for i in range(output.shape[0]):
+                    frame = output[i]
+                    if previous_output is not None:
+                        if alpha < 1.0:
+                            frame = alpha * frame + (1 - alpha) * previous_output
+                        if decay < 1.0:
+                            frame = frame + decay * previous_output
+                            frame = frame / frame.max()
+                        output[i] = frame
+                    previous_output = frame
+
+            if blur_radius != 0:
+                output = gaussian_blur(output, blur_radius)
+            out[start:end] = output.cpu()
+            pbar.update(end - start)
+
+        return (out, 1.0 - out,)
         
 class MaskBatchMulti:
     @classmethod
@@ -1327,9 +1331,7 @@ class SeparateMasks:
     OUTPUT_NODE = True
     DESCRIPTION = "Separates a mask into multiple masks based on the size of the connected components."
 
-    def polygon_to_mask(self, polygon, shape):
-        mask = np.zeros((shape[0], shape[1]), dtype=np.uint8)  # Fixed shape handling
-
+    def polygon_to_mask(self, polygon, mask):
         if len(polygon.shape) == 2:  # Check if polygon points are valid
             polygon = polygon.astype(np.int32)
             cv2.fillPoly(mask, [polygon], 1)
@@ -1381,57 +1383,58 @@ class SeparateMasks:
         return best_approx.squeeze() if best_approx is not None else hull.squeeze()
 
     def separate(self, mask: torch.Tensor, size_threshold_width: int, size_threshold_height: int, max_poly_points: int, mode: str):
-        from scipy.ndimage import label, center_of_mass
-        import numpy as np
-        
+        from scipy.ndimage import label, find_objects
+
         B, H, W = mask.shape
-        separated = []
+        structure = np.ones((3, 3), dtype=np.int8)
+        mask_np = mask.round().cpu().numpy().astype(np.uint8)
 
-        mask = mask.round()
-        
+        # (x position, bbox slices, polygon or cropped component mask) of each kept component
+        separated = []
+        num_components = 0
+        pbar = ProgressBar(B)
         for b in range(B):
-            mask_np = mask[b].cpu().numpy().astype(np.uint8)
-            structure = np.ones((3, 3), dtype=np.int8)
-            labeled, ncomponents = label(mask_np, structure=structure)
-            pbar = ProgressBar(ncomponents)
-            
-            for component in range(1, ncomponents + 1):
-                component_mask_np = (labeled == component).astype(np.uint8)
-                
-                rows = np.any(component_mask_np, axis=1)
-                cols = np.any(component_mask_np, axis=0)
-                y_min, y_max = np.where(rows)[0][[0, -1]]
-                x_min, x_max = np.where(cols)[0][[0, -1]]
-                
-                width = x_max - x_min + 1
-                height = y_max - y_min + 1
-                centroid_x = (x_min + x_max) / 2  # Calculate x centroid
-                print(f"Component {component}: width={width}, height={height}, x_pos={centroid_x}")
-                
-                if width >= size_threshold_width and height >= size_threshold_height:
-                    if mode == "convex_polygons":
-                        polygon = self.get_mask_polygon(component_mask_np, max_poly_points)
-                        if polygon is not None:
-                            poly_mask = self.polygon_to_mask(polygon, (H, W))
-                            poly_mask = torch.tensor(poly_mask, device=mask.device)
-                            separated.append((centroid_x, poly_mask))
-                    elif mode == "box":
-                        # Create bounding box mask
-                        box_mask = np.zeros((H, W), dtype=np.uint8)
-                        box_mask[y_min:y_max+1, x_min:x_max+1] = 1
-                        box_mask = torch.tensor(box_mask, device=mask.device)
-                        separated.append((centroid_x, box_mask))
-                    else:
-                        area_mask = torch.tensor(component_mask_np, device=mask.device)
-                        separated.append((centroid_x, area_mask))
-                pbar.update(1)
-        
+            labeled, ncomponents = label(mask_np[b], structure=structure)
+            num_components += ncomponents
+
+            # Bounding boxes of all components in one pass, each component is then only looked at inside its own box
+            for component, slices in enumerate(find_objects(labeled), start=1):
+                if slices is None:
+                    continue
+                y_slice, x_slice = slices
+                width = x_slice.stop - x_slice.start
+                height = y_slice.stop - y_slice.start
+                if width < size_threshold_width or height < size_threshold_height:
+                    continue
+                centroid_x = (x_slice.start + x_slice.stop - 1) / 2  # Calculate x centroid
+
+                if mode == "box":
+                    separated.append((centroid_x, slices, None))
+                    continue
+                component_mask_np = (labeled[slices] == component).astype(np.uint8)
+                if mode == "convex_polygons":
+                    # Pad by a pixel so contours along the box edge are traced as on the full frame
+                    polygon = self.get_mask_polygon(np.pad(component_mask_np, 1), max_poly_points)
+                    if polygon is not None:
+                        separated.append((centroid_x, slices, polygon + (x_slice.start - 1, y_slice.start - 1)))
+                else:
+                    separated.append((centroid_x, slices, component_mask_np))
+            pbar.update(1)
+
+        print(f"SeparateMasks: kept {len(separated)} of {num_components} components")
         if len(separated) > 0:
-            # Sort by x position and extract only the masks
+            # Sort by x position and draw the masks straight into the output batch
             separated.sort(key=lambda x: x[0])
-            separated = [x[1] for x in separated]
-            out_masks = torch.stack(separated, dim=0)
-            return out_masks,
+            out_masks = torch.zeros((len(separated), H, W), dtype=torch.uint8)
+            out_np = out_masks.numpy()
+            for i, (_, slices, component) in enumerate(separated):
+                if mode == "convex_polygons":
+                    self.polygon_to_mask(component, out_np[i])
+                elif mode == "box":
+                    out_np[i][slices] = 1
+                else:
+                    out_np[i][slices] = component
+            return out_masks.to(mask.device),
         else:
             return torch.empty((1, 64, 64), device=mask.device),
 
@@ -1456,61 +1459,73 @@ class ConsolidateMasksKJ:
 
     def consolidate(self, masks, width=512, height=512, padding=0):
         B, H, W = masks.shape
+        # A group fits if its combined bbox spans at most this many pixels between min and max
+        max_span_x, max_span_y = width - padding, height - padding
 
-        def mask_fits(coords, candidate_coords):
-            x_min, y_min, x_max, y_max = coords
-            cx_min, cy_min, cx_max, cy_max = candidate_coords
-            nx_min, ny_min = min(x_min, cx_min), min(y_min, cy_min)
-            nx_max, ny_max = max(x_max, cx_max), max(y_max, cy_max)
-            if nx_min + width < nx_max + padding or ny_min + height < ny_max + padding:
-                return False, coords
-            return True, (nx_min, ny_min, nx_max, ny_max)
+        bboxes, counts, _ = mask_bboxes(masks)
+        if B and (counts == 0).any():
+            raise ValueError(f"ConsolidateMasksKJ: mask {int(np.argmax(counts == 0))} is empty")
+
+        # Masks sorted by (x_min, y_min, x_max, y_max), x_min then gives the sweep order
+        order = sorted(range(B), key=lambda b: tuple(bboxes[b]))
+        coords = bboxes[order]
+        coord_list = coords.tolist()
+        x_mins = coords[:, 0]
 
-        separated = []
-        final_masks = []
-        for b in range(B):
-            m = masks[b]
-            rows, cols = m.any(dim=1), m.any(dim=0)
-            y_min, y_max = torch.where(rows)[0][[0, -1]]
-            x_min, x_max = torch.where(cols)[0][[0, -1]]
-            w = x_max - x_min + 1
-            h = y_max - y_min + 1
-            separated.append(((x_min.item(), y_min.item(), x_max.item(), y_max.item()), m))
-
-        separated.sort(key=lambda x: x[0])
         fits = []
-        for i, masks in enumerate(separated):
-            coord = masks[0]
+        for i in range(B):
+            x_min, y_min, x_max, y_max = coord_list[i]
+            # Only masks whose bbox fits in one tile together with mask i can ever join it,
+            # their x_min lies within max_span_x of mask i's bbox
+            lo = np.searchsorted(x_mins, x_max - max_span_x, side="left")
+            hi = np.searchsorted(x_mins, x_min + max_span_x, side="right")
+            window = coords[lo:hi]
+            pair_fits = ((np.maximum(window[:, 2], x_max) - np.minimum(window[:, 0], x_min) <= max_span_x) &
+                         (np.maximum(window[:, 3], y_max) - np.minimum(window[:, 1], y_min) <= max_span_y))
+            candidates = lo + np.flatnonzero(pair_fits)
+
+            # Grow the tile greedily in sorted order, a candidate that no longer fits leaves it unchanged
             fits_in_box = []
-            for j, cand_mask in enumerate(separated):
+            for j in candidates.tolist():
                 if i == j:
                     continue
-                r, coord = mask_fits(coord, cand_mask[0])
-                if r:
+                cx_min, cy_min, cx_max, cy_max = coord_list[j]
+                nx_min, ny_min = min(x_min, cx_min), min(y_min, cy_min)
+                nx_max, ny_max = max(x_max, cx_max), max(y_max, cy_max)
+                if nx_max - nx_min <= max_span_x and ny_max - ny_min <= max_span_y:
+                    x_min, y_min, x_max, y_max = nx_min, ny_min, nx_max, ny_max
                     fits_in_box.append(j)
             fits.append((i, fits_in_box))
+
         fits.sort(key=lambda x: -len(x[1]))
-        seen = []
+        seen = set()
         unique_fits = []
         for idx, fs in fits:
             uniq = [i for i in fs if i not in seen]
             unique_fits.append((idx, fs, uniq))
-            seen.extend(uniq)
+            seen.update(uniq)
         unique_fits.sort(key=lambda x: (-len(x[1]), -len(x[2])))
-        merged = []
+
+        # Output mask of every input mask, all merged in one scatter-add
+        group_of = torch.empty(B, dtype=torch.long)
+        merged = set()
+        num_groups = 0
         for mask_idx, fitting_masks, _ in unique_fits:
             if mask_idx in merged:
                 continue
-            fitting_masks = [i for i in fitting_masks if i not in merged]
-            combined_mask = separated[mask_idx][1].clone()
             for i in fitting_masks:
-                combined_mask += separated[i][1]
-                merged.append(i)
-            merged.append(mask_idx)
-            final_masks.append(combined_mask)
-
-        print(f"Consolidated {B} masks into {len(final_masks)}")
-        return (torch.stack(final_masks, dim=0),)
+                if i not in merged:
+                    group_of[order[i]] = num_groups
+                    merged.add(i)
+            group_of[order[mask_idx]] = num_groups
+            merged.add(mask_idx)
+            num_groups += 1
+
+        final_masks = torch.zeros((num_groups, H, W), dtype=masks.dtype, device=masks.device)
+        final_masks.index_add_(0, group_of.to(masks.device), masks)
+
+        print(f"Consolidated {B} masks into {num_groups}")
+        return (final_masks,)
 
 
 class DrawMaskOnImage:
@@ -0,0 +1,168 @@
+"""
+Regression test for BatchUncrop / BatchUncropAdvanced against the PIL compositing they replaced.
+The reference functions below are the previous node bodies, kept as they were.
+
+Run from the ComfyUI-KJNodes folder: python -m unittest tests.test_batch_uncrop
+"""
+import importlib
+import itertools
+import os
+import sys
+import types
+import unittest
+
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageDraw, ImageFilter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tolerance against the PIL path, which rounds to 8 bit after every step
+MAX_DIFF = 3 / 255
+MEAN_DIFF = 1 / 255
+
+
+def load_batchcrop_nodes():
+    try:
+        import comfy.model_management  # noqa: F401
+    except ImportError:
+        # Outside ComfyUI: the node module only asks for the torch device at import time
+        comfy = types.ModuleType("comfy")
+        comfy.model_management = types.SimpleNamespace(get_torch_device=lambda: torch.device("cpu"))
+        sys.modules["comfy"] = comfy
+        sys.modules["comfy.model_management"] = comfy.model_management
+    # Import the node package by path without running its __init__ (which loads every node)
+    package = types.ModuleType("kjnodes_under_test")
+    package.__path__ = [ROOT]
+    sys.modules.setdefault("kjnodes_under_test", package)
+    return importlib.import_module("kjnodes_under_test.nodes.batchcrop_nodes")
+
+
+batchcrop_nodes = load_batchcrop_nodes()
+tensor2pil = importlib.import_module("kjnodes_under_test.utility.utility").tensor2pil
+pil2tensor = importlib.import_module("kjnodes_under_test.utility.utility").pil2tensor
+bbox_to_region = batchcrop_nodes.bbox_to_region
+
+
+def pil_uncrop(original_images, cropped_images, bboxes, border_blending, crop_rescale, border_top, border_bottom, border_left, border_right):
+    def inset_border(image, border_width, border_color, border_top, border_bottom, border_left, border_right):
+        draw = ImageDraw.Draw(image)
+        width, height = image.size
+        if border_top:
+            draw.rectangle((0, 0, width, border_width), fill=border_color)
+        if border_bottom:
+            draw.rectangle((0, height - border_width, width, height), fill=border_color)
+        if border_left:
+            draw.rectangle((0, 0, border_width, height), fill=border_color)
+        if border_right:
+            draw.rectangle((width - border_width, 0, width, height), fill=border_color)
+        return image
+
+    input_images = tensor2pil(original_images)
+    crop_imgs = tensor2pil(cropped_images)
+    out_images = []
+    for img, crop, bbox in zip(input_images, crop_imgs, bboxes):
+        paste_region = bbox_to_region(bbox, img.size)
+        paste_region = tuple(round(v * crop_rescale) for v in paste_region)
+        crop_img = crop.resize((paste_region[2] - paste_region[0], paste_region[3] - paste_region[1])).convert("RGB")
+        blend_ratio = (max(crop_img.size) / 2) * float(border_blending)
+
+        blend = img.convert("RGBA")
+        mask = Image.new("L", img.size, 0)
+        mask_block = Image.new("L", (paste_region[2] - paste_region[0], paste_region[3] - paste_region[1]), 255)
+        mask_block = inset_border(mask_block, round(blend_ratio / 2), (0), border_top, border_bottom, border_left, border_right)
+        mask.paste(mask_block, paste_region)
+        blend.paste(crop_img, paste_region)
+        mask = mask.filter(ImageFilter.BoxBlur(radius=blend_ratio / 4))
+        mask = mask.filter(ImageFilter.GaussianBlur(radius=blend_ratio / 4))
+        blend.putalpha(mask)
+        out_images.append(Image.alpha_composite(img.convert("RGBA"), blend).convert("RGB"))
+    return pil2tensor(out_images)
+
+
+def pil_uncrop_advanced(original_images, cropped_images, cropped_masks, combined_crop_mask, bboxes, border_blending, crop_rescale, use_combined_mask, use_square_mask, combined_bounding_box=None):
+    def inset_border(image, border_width=20, border_color=(0)):
+        width, height = image.size
+        bordered_image = Image.new(image.mode, (width, height), border_color)
+        bordered_image.paste(image, (0, 0))
+        draw = ImageDraw.Draw(bordered_image)
+        draw.rectangle((0, 0, width - 1, height - 1), outline=border_color, width=border_width)
+        return bordered_image
+
+    crop_imgs = tensor2pil(cropped_images)
+    input_images = tensor2pil(original_images)
+    out_images = []
+    for i, (img, crop) in enumerate(zip(input_images, crop_imgs)):
+        if use_combined_mask:
+            paste_region = bbox_to_region(combined_bounding_box[0], img.size)
+            mask = combined_crop_mask[i]
+        else:
+            paste_region = bbox_to_region(bboxes[i], img.size)
+            mask = cropped_masks[i]
+        paste_region = tuple(round(v * crop_rescale) for v in paste_region)
+        crop_img = crop.resize((paste_region[2] - paste_region[0], paste_region[3] - paste_region[1])).convert("RGB")
+        blend_ratio = (max(crop_img.size) / 2) * float(border_blending)
+        blend = img.convert("RGBA")
+
+        if use_square_mask:
+            mask = Image.new("L", img.size, 0)
+            mask_block = Image.new("L", (paste_region[2] - paste_region[0], paste_region[3] - paste_region[1]), 255)
+            mask_block = inset_border(mask_block, round(blend_ratio / 2), (0))
+            mask.paste(mask_block, paste_region)
+        else:
+            original_mask = tensor2pil(mask)[0]
+            original_mask = original_mask.resize((paste_region[2] - paste_region[0], paste_region[3] - paste_region[1]))
+            mask = Image.new("L", img.size, 0)
+            mask.paste(original_mask, paste_region)
+
+        mask = mask.filter(ImageFilter.BoxBlur(radius=blend_ratio / 4))
+        mask = mask.filter(ImageFilter.GaussianBlur(radius=blend_ratio / 4))
+        blend.paste(crop_img, paste_region)
+        blend.putalpha(mask)
+        out_images.append(Image.alpha_composite(img.convert("RGBA"), blend).convert("RGB"))
+    return pil2tensor(out_images)
+
+
+def smooth(images):
+    # Soften random noise so bicubic resampling differences stay small
+    return F.avg_pool2d(images.permute(0, 3, 1, 2), 5, 1, 2).permute(0, 2, 3, 1)
+
+
+class BatchUncropRegressionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        generator = torch.Generator().manual_seed(0)
+        cls.images = smooth(torch.rand(6, 180, 240, 3, generator=generator))
+        cls.crops = smooth(torch.rand(6, 64, 64, 3, generator=generator))
+        masks = (torch.rand(6, 1, 64, 64, generator=generator) > 0.5).float()
+        cls.masks = F.avg_pool2d(masks, 7, 1, 3)[:, 0]
+        # Inside the frame, on the edges, an odd size, and regions that crop_rescale pushes past the border
+        cls.bboxes = [(10, 20, 60, 60), (0, 0, 70, 50), (200, 150, 60, 60), (100, 80, 33, 47), (180, 0, 60, 64), (5, 130, 64, 50)]
+
+    def assertClose(self, expected, actual, case):
+        self.assertEqual(expected.shape, actual.shape, case)
+        diff = (expected - actual).abs()
+        self.assertLessEqual(diff.max().item(), MAX_DIFF, f"{case}: max diff {diff.max().item() * 255:.2f}/255")
+        self.assertLessEqual(diff.mean().item(), MEAN_DIFF, f"{case}: mean diff {diff.mean().item() * 255:.2f}/255")
+
+    def test_uncrop(self):
+        node = batchcrop_nodes.BatchUncrop()
+        # All borders, only top/left (the ones PIL draws a pixel wider), and none
+        border_flags = [(True, True, True, True), (True, False, True, False), (False, True, False, True), (False, False, False, False)]
+        for blending, rescale, flags in itertools.product([0.0, 0.1, 0.25, 0.6, 1.0], [1.0, 0.8, 1.2], border_flags):
+            case = f"border_blending={blending} crop_rescale={rescale} borders={flags}"
+            expected = pil_uncrop(self.images, self.crops, self.bboxes, blending, rescale, *flags)
+            actual = node.uncrop(self.images, self.crops, self.bboxes, blending, rescale, *flags)[0]
+            self.assertClose(expected, actual, case)
+
+    def test_uncrop_advanced(self):
+        node = batchcrop_nodes.BatchUncropAdvanced()
+        combined_bbox = [(30, 40, 64, 64)]
+        for blending, rescale, use_combined, use_square in itertools.product([0.0, 0.25, 1.0], [1.0, 0.8, 1.2], [False, True], [False, True]):
+            case = f"border_blending={blending} crop_rescale={rescale} use_combined_mask={use_combined} use_square_mask={use_square}"
+            args = (self.images, self.crops, self.masks, self.masks, self.bboxes, blending, rescale, use_combined, use_square, combined_bbox)
+            self.assertClose(pil_uncrop_advanced(*args), node.uncrop(*args)[0], case)
+
+
+if __name__ == "__main__":
+    unittest.main()
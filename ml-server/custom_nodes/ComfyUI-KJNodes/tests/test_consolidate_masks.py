@@ -0,0 +1,182 @@
+"""
+Equivalence test and benchmark for ConsolidateMasksKJ against the O(B^2) grouping it replaced.
+The reference function below is the previous node body, kept as it was.
+
+Run from the ComfyUI-KJNodes folder:
+    python -m unittest tests.test_consolidate_masks
+    python -m tests.test_consolidate_masks --benchmark [--sizes 50 500 5000]
+The reference is quadratic, B=5000 takes over a minute on CPU.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import itertools
+import os
+import sys
+import time
+import types
+import unittest
+
+import numpy as np
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_mask_nodes():
+    try:
+        import comfy.utils  # noqa: F401
+        import nodes  # noqa: F401
+        import folder_paths  # noqa: F401
+    except ImportError:
+        # Outside ComfyUI: the node module only needs these names at import time
+        class ProgressBar:
+            def __init__(self, *args):
+                pass
+
+            def update(self, *args):
+                pass
+
+            def update_absolute(self, *args, **kwargs):
+                pass
+
+        comfy = types.ModuleType("comfy")
+        comfy.model_management = types.SimpleNamespace(get_torch_device=lambda: torch.device("cpu"),
+                                                       unet_offload_device=lambda: torch.device("cpu"))
+        comfy.utils = types.SimpleNamespace(ProgressBar=ProgressBar, common_upscale=None)
+        sys.modules["comfy"] = comfy
+        sys.modules["comfy.model_management"] = comfy.model_management
+        sys.modules["comfy.utils"] = comfy.utils
+        sys.modules["nodes"] = types.SimpleNamespace(MAX_RESOLUTION=16384)
+        sys.modules["folder_paths"] = types.ModuleType("folder_paths")
+    # Import the node package by path without running its __init__ (which loads every node)
+    package = types.ModuleType("kjnodes_under_test")
+    package.__path__ = [ROOT]
+    sys.modules.setdefault("kjnodes_under_test", package)
+    return importlib.import_module("kjnodes_under_test.nodes.mask_nodes")
+
+
+mask_nodes = load_mask_nodes()
+
+
+def reference_consolidate(masks, width=512, height=512, padding=0):
+    B, H, W = masks.shape
+
+    def mask_fits(coords, candidate_coords):
+        x_min, y_min, x_max, y_max = coords
+        cx_min, cy_min, cx_max, cy_max = candidate_coords
+        nx_min, ny_min = min(x_min, cx_min), min(y_min, cy_min)
+        nx_max, ny_max = max(x_max, cx_max), max(y_max, cy_max)
+        if nx_min + width < nx_max + padding or ny_min + height < ny_max + padding:
+            return False, coords
+        return True, (nx_min, ny_min, nx_max, ny_max)
+
+    separated = []
+    final_masks = []
+    for b in range(B):
+        m = masks[b]
+        rows, cols = m.any(dim=1), m.any(dim=0)
+        y_min, y_max = torch.where(rows)[0][[0, -1]]
+        x_min, x_max = torch.where(cols)[0][[0, -1]]
+        separated.append(((x_min.item(), y_min.item(), x_max.item(), y_max.item()), m))
+
+    separated.sort(key=lambda x: x[0])
+    fits = []
+    for i, masks in enumerate(separated):
+        coord = masks[0]
+        fits_in_box = []
+        for j, cand_mask in enumerate(separated):
+            if i == j:
+                continue
+            r, coord = mask_fits(coord, cand_mask[0])
+            if r:
+                fits_in_box.append(j)
+        fits.append((i, fits_in_box))
+    fits.sort(key=lambda x: -len(x[1]))
+    seen = []
+    unique_fits = []
+    for idx, fs in fits:
+        uniq = [i for i in fs if i not in seen]
+        unique_fits.append((idx, fs, uniq))
+        seen.extend(uniq)
+    unique_fits.sort(key=lambda x: (-len(x[1]), -len(x[2])))
+    merged = []
+    for mask_idx, fitting_masks, _ in unique_fits:
+        if mask_idx in merged:
+            continue
+        fitting_masks = [i for i in fitting_masks if i not in merged]
+        combined_mask = separated[mask_idx][1].clone()
+        for i in fitting_masks:
+            combined_mask += separated[i][1]
+            merged.append(i)
+        merged.append(mask_idx)
+        final_masks.append(combined_mask)
+
+    return torch.stack(final_masks, dim=0)
+
+
+def random_box_masks(batch_size, height, width, max_size=24, seed=0):
+    # One filled rectangle per mask, up to max_size pixels per side
+    rng = np.random.default_rng(seed)
+    masks = torch.zeros(batch_size, height, width)
+    for b in range(batch_size):
+        w, h = rng.integers(1, max_size, 2)
+        x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+        masks[b, y:y + h, x:x + w] = 1
+    return masks
+
+
+def consolidate(masks, *args):
+    # The node prints a summary line per call
+    with contextlib.redirect_stdout(io.StringIO()):
+        return mask_nodes.ConsolidateMasksKJ().consolidate(masks, *args)[0]
+
+
+class ConsolidateMasksEquivalenceTest(unittest.TestCase):
+    def test_matches_reference(self):
+        # (width, height, padding): tiles smaller, similar and larger than the masks, padding wider than the tile
+        tiles = [(32, 32, 0), (64, 48, 4), (128, 128, 0), (16, 16, 20), (512, 512, 0)]
+        for batch_size, (height, width) in itertools.product([1, 2, 7, 40, 150], [(64, 64), (200, 300)]):
+            masks = random_box_masks(batch_size, height, width, seed=batch_size)
+            if batch_size > 5:
+                # Duplicates tie in the bbox sort
+                masks[3] = masks[1]
+                masks[4] = masks[1]
+            for args in tiles:
+                case = f"B={batch_size} size={height}x{width} (width, height, padding)={args}"
+                expected = reference_consolidate(masks, *args)
+                actual = consolidate(masks, *args)
+                self.assertEqual(expected.shape, actual.shape, case)
+                self.assertTrue(torch.equal(expected, actual), case)
+
+    def test_empty_mask_raises(self):
+        masks = random_box_masks(3, 64, 64)
+        masks[1] = 0
+        with self.assertRaises(ValueError):
+            consolidate(masks, 32, 32, 0)
+
+
+def benchmark(sizes, frame=256, tile=64):
+    print(f"{frame}x{frame} frames, random boxes up to 24px, {tile}x{tile} tile, {torch.get_num_threads()} CPU threads")
+    for batch_size in sizes:
+        masks = random_box_masks(batch_size, frame, frame)
+        start = time.perf_counter()
+        expected = reference_consolidate(masks, tile, tile, 0)
+        reference_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = consolidate(masks, tile, tile, 0)
+        node_time = time.perf_counter() - start
+        match = "identical" if torch.equal(expected, actual) else "MISMATCH"
+        print(f"B={batch_size:<6} groups={actual.shape[0]:<5} reference {reference_time:8.2f} s -> node {node_time:6.2f} s ({match})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", action="store_true", help="time the node against the reference instead of running the tests")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    args, remaining = parser.parse_known_args()
+    if args.benchmark:
+        benchmark(args.sizes)
+    else:
+        unittest.main(argv=sys.argv[:1] + remaining)
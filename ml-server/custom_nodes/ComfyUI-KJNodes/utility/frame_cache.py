@@ -0,0 +1,122 @@
+import os
+import hashlib
+import threading
+import uuid
+import numpy as np
+import folder_paths
+
+FRAME_CACHE_DIRNAME = "kjnodes_frame_cache"
+FRAME_CACHE_MAX_BYTES = 10 * 1024**3
+
+
+class FrameCache:
+    """
+    Decoded (and resized) frames on disk as uint8 .npy files, memory-mapped on reuse.
+
+    Entries are keyed by the source file's path, mtime and size plus the decode settings,
+    so an edited file simply misses and the stale entry ages out. File mtimes double as
+    last-use stamps: when the cache grows past max_bytes the least recently used entries
+    are deleted.
+    """
+    def __init__(self, directory, max_bytes=FRAME_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None  # Counted on first write
+
+    def key(self, path, *settings):
+        """Cache key for a source file decoded with the given settings, or None if it can't be stat'ed."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        ident = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{settings!r}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npy")
+
+    def get(self, key):
+        """Read-only memory-mapped array for key, or None."""
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        return array
+
+    def put(self, key, array):
+        """Stores array (uint8) under key; failures only cost the cache entry."""
+        if key is None:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array, dtype=np.uint8))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"FrameCache: could not store frame: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self._scan()[1]
+            else:
+                self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        """Deletes least recently used entries down to 90% of max_bytes. Lock held."""
+        entries, total = self._scan()
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass  # In use (Windows) or already gone
+        self.total_bytes = total
+
+
+_frame_cache = None
+_frame_cache_lock = threading.Lock()
+
+def get_frame_cache():
+    """The shared frame cache in ComfyUI's temp directory (cleared by ComfyUI on startup)."""
+    global _frame_cache
+    with _frame_cache_lock:
+        if _frame_cache is None:
+            _frame_cache = FrameCache(os.path.join(folder_paths.get_temp_directory(), FRAME_CACHE_DIRNAME))
+        return _frame_cache
@@ -0,0 +1,106 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+def _shifted_max(x, step, diagonal_free):
+    """
+    Max of x and its copies shifted by +-step along both axes (out of range reads are -inf).
+    diagonal_free=False only shifts along one axis at a time (a sparse cross), True applies
+    the two axes one after the other (a sparse 3x3 square).
+    """
+    height, width = x.shape[-2:]
+    padded = F.pad(x, (step, step, step, step), value=-math.inf)
+    if diagonal_free:
+        rows = torch.maximum(x, padded[..., step:step + height, :width])
+        torch.maximum(rows, padded[..., step:step + height, 2 * step:2 * step + width], out=rows)
+        padded = F.pad(rows, (0, 0, step, step), value=-math.inf)
+        torch.maximum(rows, padded[..., :height, :], out=rows)
+        return torch.maximum(rows, padded[..., 2 * step:2 * step + height, :], out=rows)
+    out = torch.maximum(x, padded[..., :height, step:step + width])
+    torch.maximum(out, padded[..., 2 * step:2 * step + height, step:step + width], out=out)
+    torch.maximum(out, padded[..., step:step + height, :width], out=out)
+    return torch.maximum(out, padded[..., step:step + height, 2 * step:2 * step + width], out=out)
+
+
+def dilate(masks, radius, tapered_corners=True):
+    """
+    Grayscale dilation of a [..., H, W] batch, the same as `radius` passes of a 3x3 kornia
+    dilation (cross kernel if tapered_corners, else full square) but in O(log radius) passes:
+    a diamond/square of radius a+b is the radius-a shape dilated by a sparse cross/square of
+    radius b (b <= a, resp. b <= 2a+1). The input is padded by -inf first so the border behaves
+    like kornia's geodesic border (pixels outside the image are ignored).
+    """
+    if radius <= 0:
+        return masks
+    height, width = masks.shape[-2:]
+    # Beyond this the structuring element already covers the whole image
+    radius = min(radius, height + width if tapered_corners else max(height, width))
+    x = F.pad(masks, (radius, radius, radius, radius), value=-math.inf)
+    done = 0
+    while done < radius:
+        if tapered_corners:
+            step = max(1, min(done, radius - done))
+        else:
+            step = min(2 * done + 1, radius - done)
+        x = _shifted_max(x, step, diagonal_free=not tapered_corners)
+        done += step
+    return x[..., radius:radius + height, radius:radius + width]
+
+
+def erode(masks, radius, tapered_corners=True):
+    """Grayscale erosion, see dilate()."""
+    if radius <= 0:
+        return masks
+    return -dilate(-masks, radius, tapered_corners)
+
+
+def _box_blur_radius(sigma, passes):
+    # Extended box radius giving a `passes`-fold box blur the variance of a Gaussian
+    # (Gwosdek et al. 2011), as used by PIL's ImageFilter.GaussianBlur
+    sigma2 = sigma * sigma / passes
+    box_length = math.sqrt(12.0 * sigma2 + 1.0)
+    l = math.floor((box_length - 1.0) / 2.0)
+    a = (2 * l + 1) * (l * (l + 1) - 3 * sigma2)
+    a /= 6 * (sigma2 - (l + 1) * (l + 1))
+    return l, a
+
+
+def _box_blur(x, l, a, dim):
+    # Box of radius l plus weight a on the next pixel each side along dim (-1 or -2), edges replicated
+    size = x.shape[dim]
+    pad = (l + 1, l + 1, 0, 0) if dim == -1 else (0, 0, l + 1, l + 1)
+    padded = F.pad(x.reshape(-1, 1, *x.shape[-2:]), pad, mode="replicate")
+    cumsum = padded.cumsum(dim)
+    window = cumsum.narrow(dim, 2 * l + 1, size) - cumsum.narrow(dim, 0, size)
+    if a > 0:
+        window.add_(padded.narrow(dim, 0, size) + padded.narrow(dim, 2 * l + 2, size), alpha=a)
+    return window.div_(2 * l + 1 + 2 * a).reshape(x.shape)
+
+
+def gaussian_blur(masks, radius, passes=3):
+    """
+    Separable Gaussian blur of a [..., H, W] batch on its own device. Uses the same
+    extended box approximation as PIL's GaussianBlur(radius), so results match the PIL
+    path up to its 8 bit rounding, at a cost independent of the radius.
+    """
+    if radius <= 0:
+        return masks
+    l, a = _box_blur_radius(radius, passes)
+    x = masks
+    for dim in (-1, -2):
+        for _ in range(passes):
+            x = _box_blur(x, l, a, dim)
+    return x
+
+
+def box_blur(masks, radius):
+    """
+    Separable box blur of a [..., H, W] batch with a fractional radius (edge pixels replicated),
+    the same filter as PIL's BoxBlur(radius) without its 8 bit rounding.
+    """
+    if radius <= 0:
+        return masks
+    l = math.floor(radius)
+    x = _box_blur(masks, l, radius - l, -1)
+    return _box_blur(x, l, radius - l, -2)
@@ -36,4 +36,63 @@ def tensor2pil(image: torch.Tensor) -> List[Image.Image]:
         Image.fromarray(
             np.clip(255.0 * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8)
         )
-    ]
\ No newline at end of file
+    ]
+
+
+def _quantized_threshold() -> float:
+    # Smallest float32 value v with 255 * v >= 1 in float32, i.e. nonzero after tensor2pil
+    threshold = np.float32(1.0 / 255.0)
+    while threshold * np.float32(255.0) >= 1.0:
+        threshold = np.nextafter(threshold, np.float32(0.0))
+    while threshold * np.float32(255.0) < 1.0:
+        threshold = np.nextafter(threshold, np.float32(1.0))
+    return float(threshold)
+
+QUANTIZED_THRESHOLD = _quantized_threshold()
+
+
+def mask_bboxes(masks: torch.Tensor, quantized: bool = False, chunk_pixels: int = 2**25):
+    """
+    Bounding boxes, pixel counts and centroids of the nonzero pixels of a [B,H,W] mask batch,
+    reduced on the masks' device a chunk of frames at a time.
+    With quantized=True a pixel counts as set if it is nonzero after tensor2pil's 8 bit conversion.
+
+    Returns numpy arrays: bboxes [B,4] int64 (min_x, min_y, max_x, max_y, inclusive; zeros for
+    empty masks), counts [B] int64 and centroids [B,2] float64 (x, y; nan for empty masks).
+    """
+    masks = masks.reshape(-1, masks.shape[-2], masks.shape[-1])
+    batch, height, width = masks.shape
+    bboxes = np.zeros((batch, 4), dtype=np.int64)
+    counts = np.zeros(batch, dtype=np.int64)
+    sums = np.zeros((batch, 2), dtype=np.int64)
+    xs = torch.arange(width, device=masks.device, dtype=torch.float64)
+    ys = torch.arange(height, device=masks.device, dtype=torch.float64)
+    step_at_zero = torch.tensor(1.0 if quantized else 0.0, device=masks.device)
+    chunk_size = max(1, min(batch, chunk_pixels // (height * width)))
+    buffer = torch.empty((chunk_size, height, width), device=masks.device)
+    for start in range(0, batch, chunk_size):
+        chunk = masks[start:start + chunk_size].float()
+        end = start + chunk.shape[0]
+        # 0/1 float per pixel, summed along rows and columns
+        set_pixels = buffer[:chunk.shape[0]]
+        if quantized:
+            torch.sub(chunk, QUANTIZED_THRESHOLD, out=set_pixels)
+            torch.heaviside(set_pixels, step_at_zero, out=set_pixels)
+        else:
+            torch.heaviside(chunk, step_at_zero, out=set_pixels)
+        col_counts = set_pixels.sum(1).double()  # [n, W]
+        row_counts = set_pixels.sum(2).double()  # [n, H]
+        cols_any = (col_counts > 0).to(torch.uint8)
+        rows_any = (row_counts > 0).to(torch.uint8)
+        bboxes[start:end, 0] = cols_any.argmax(1).cpu().numpy()
+        bboxes[start:end, 1] = rows_any.argmax(1).cpu().numpy()
+        bboxes[start:end, 2] = (width - 1 - cols_any.flip(1).argmax(1)).cpu().numpy()
+        bboxes[start:end, 3] = (height - 1 - rows_any.flip(1).argmax(1)).cpu().numpy()
+        counts[start:end] = row_counts.sum(1).cpu().numpy()
+        sums[start:end, 0] = (col_counts * xs).sum(1).cpu().numpy()
+        sums[start:end, 1] = (row_counts * ys).sum(1).cpu().numpy()
+    empty = counts == 0
+    bboxes[empty] = 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroids = sums / counts[:, None]
+    return bboxes, counts, centroids
@@ -4,8 +4,17 @@ Download models directly to your RunPod instance with multi-connection support
 """
 
 import os
+import sys
+import time
+import queue
 import logging
+import json
+import random
 import asyncio
+import threading
+import importlib.util
+from collections import deque
+import aiohttp
 import folder_paths
 from aiohttp import web
 from server import PromptServer
@@ -16,11 +25,344 @@ active_downloads = {}
 download_control = {}
 # Download queue management
 download_queue = []
-current_download_task = None  # Only one download at a time
+running_downloads = {}  # download_id -> asyncio.Task of each file downloading now
 
 # Configuration optimized for datacenter connections (RunPod)
 CHUNK_SIZE = 32 * 1024 * 1024  # 32MB chunks - balanced for 500MB to 30GB+ files
-NUM_CONNECTIONS = 8  # 8 parallel connections - optimal for DC bandwidth
+NUM_CONNECTIONS = 8  # Max parallel connections per file - optimal for DC bandwidth
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("RUNPODDIRECT_MAX_CONCURRENT", 4))  # Files downloading at once (1 = one after another)
+TOTAL_CONNECTIONS = int(os.environ.get("RUNPODDIRECT_TOTAL_CONNECTIONS", 16))  # Connections shared by all downloading files
+BYTES_PER_CONNECTION = 32 * 1024 * 1024  # A file gets one connection per 32MB, up to NUM_CONNECTIONS
+WRITE_QUEUE_BYTES = 256 * 1024 * 1024  # Max received bytes waiting for the writer thread (per download)
+LOOP_LAG_INTERVAL = 0.05  # Event loop lag sampling interval while downloads run (seconds)
+MIN_SPLIT_SIZE = 4 * 1024 * 1024  # Idle connections don't split ranges with less than 2x this left
+RATE_WINDOW = 1.0  # Seconds a request must run before its rate is used to place a split
+RANGE_MAX_ATTEMPTS = 5  # Failures in a row without progress before a range fails the download
+RANGE_RETRY_BACKOFF_MAX = 30  # Max seconds between retries of a failed range
+STATE_SAVE_INTERVAL = 2.0  # Seconds between saves of the completed byte intervals (resume after restart)
+STATE_SUFFIX = ".rpdownload"  # Resume state next to the partial file: <output_path>.rpdownload
+PROGRESS_INTERVAL = 0.1  # Min seconds between progress messages per download
+
+# Shared download scheduler (custom_nodes/download_scheduler.py): global connection budget,
+# bandwidth limit and priority preemption across all download extensions
+SCHEDULER_MODULE_NAME = "comfy_download_scheduler"
+SCHEDULER_MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "download_scheduler.py")
+
+
+def load_download_scheduler():
+    """Returns the shared scheduler module (loaded once per process), or None if it isn't installed"""
+    module = sys.modules.get(SCHEDULER_MODULE_NAME)
+    if module is not None or not os.path.isfile(SCHEDULER_MODULE_PATH):
+        return module
+    try:
+        spec = importlib.util.spec_from_file_location(SCHEDULER_MODULE_NAME, SCHEDULER_MODULE_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[SCHEDULER_MODULE_NAME] = module
+        spec.loader.exec_module(module)
+        return sys.modules[SCHEDULER_MODULE_NAME]
+    except Exception as e:
+        sys.modules.pop(SCHEDULER_MODULE_NAME, None)
+        logging.warning(f"[RunpodDirect] Shared download scheduler unavailable: {e}")
+        return None
+
+
+download_scheduler = load_download_scheduler()
+
+
+class FileWriter:
+    """Writes a download to disk from a dedicated thread so the event loop never blocks on disk I/O.
+
+    Chunks go to the thread through a queue bounded by WRITE_QUEUE_BYTES (write() waits when the
+    disk falls behind) and land with positional writes into one shared file descriptor.
+    """
+
+    def __init__(self, path, loop, max_pending=WRITE_QUEUE_BYTES):
+        self.path = path
+        self.loop = loop
+        self.max_pending = max_pending
+        self.pending = 0
+        self.error = None
+        self.bytes_written = 0
+        self.write_time = 0.0  # Seconds spent in write calls on the writer thread
+        self._space = asyncio.Event()
+        self._space.set()
+        self._queue = queue.SimpleQueue()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self._thread = threading.Thread(target=self._run, name="runpoddirect-writer", daemon=True)
+        self._thread.start()
+
+    def _pwrite(self, data, offset):
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(self._fd, view, offset)
+            else:
+                # Only this thread touches the fd, so seek + write is safe
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                written = os.write(self._fd, view)
+            view = view[written:]
+            offset += written
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            op, offset, data, future = item
+            try:
+                if self.error is None:
+                    started = time.perf_counter()
+                    if op == "write":
+                        self._pwrite(data, offset)
+                        self.bytes_written += len(data)
+                    elif op == "truncate":
+                        os.ftruncate(self._fd, offset)
+                    self.write_time += time.perf_counter() - started
+            except Exception as e:
+                self.error = e
+            finally:
+                self.loop.call_soon_threadsafe(self._done, len(data) if data else 0, future)
+        os.close(self._fd)
+
+    def _done(self, size, future):
+        self.pending -= size
+        if self.pending < self.max_pending:
+            self._space.set()
+        if future is not None and not future.done():
+            if self.error is not None:
+                future.set_exception(self.error)
+            else:
+                future.set_result(None)
+
+    def _check(self):
+        if self.error is not None:
+            raise IOError(f"Writing {self.path} failed: {self.error}")
+
+    async def write(self, offset, data):
+        """Queues data for offset; waits only while the queue is over its byte limit."""
+        self._check()
+        while self.pending > 0 and self.pending + len(data) > self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+            self._check()
+        self.pending += len(data)
+        self._queue.put(("write", offset, data, None))
+
+    async def _call(self, op, offset=0):
+        future = self.loop.create_future()
+        self._queue.put((op, offset, None, future))
+        await future
+
+    async def truncate(self, size):
+        """Sets the file size (sparse preallocation) once earlier writes are done."""
+        await self._call("truncate", size)
+
+    async def flush(self):
+        """Waits until every queued write is on disk (or raises the first write error)."""
+        await self._call("flush")
+        self._check()
+
+    async def close(self):
+        """Flushes and closes the file descriptor; safe to call more than once."""
+        if not self._thread.is_alive():
+            return
+        try:
+            await self._call("flush")
+        finally:
+            self._queue.put(None)
+            await asyncio.to_thread(self._thread.join)
+        self._check()
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a sleeping task while downloads run.
+
+    Lag is time the loop spent on something else (blocking calls on the loop, long
+    callbacks). Shown in /server_download/metrics and logged after each download.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, history=20000):
+        self.interval = interval
+        self.samples = deque(maxlen=history)  # (monotonic time, lag seconds)
+        self.users = 0
+        self._task = None
+
+    def acquire(self):
+        self.users += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def release(self):
+        self.users = max(0, self.users - 1)
+        if self.users == 0 and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.samples.append((now, max(0.0, now - started - self.interval)))
+
+    def summary(self, since=0.0):
+        lags = sorted(lag for t, lag in self.samples if t >= since)
+        if not lags:
+            return {"samples": 0, "mean_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(lags),
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 2),
+            "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+            "max_ms": round(lags[-1] * 1000, 2),
+        }
+
+
+loop_lag = LoopLagMonitor()
+
+
+class RangeManager:
+    """Byte-range bookkeeping for one multi-connection download.
+
+    Tracks completed byte intervals (merged, end-exclusive), hands ranges to connection
+    workers, splits the range expected to finish last when a worker goes idle, and takes
+    back the rest of a paused or preempted range. Progress is the size of the completed
+    interval set, so it is right no matter which connection finishes first. Runs on the
+    event loop only.
+    """
+
+    def __init__(self, total_size, completed=None):
+        self.total_size = total_size
+        self.completed = []  # Sorted, non-overlapping [start, end) intervals
+        for start, end in completed or []:
+            self.add_completed(start, end)
+        self.pending = deque(self.gaps())
+        self.inflight = []  # Range dicts {"start", "pos", "end", "failures", "since"} owned by workers
+
+    @property
+    def done_bytes(self):
+        return sum(end - start for start, end in self.completed)
+
+    def add_completed(self, start, end):
+        """Merges [start, end) into the completed set."""
+        merged = []
+        for s_, e_ in self.completed:
+            if e_ < start or s_ > end:
+                merged.append([s_, e_])
+            else:
+                start, end = min(start, s_), max(end, e_)
+        merged.append([start, end])
+        merged.sort()
+        self.completed = merged
+
+    def gaps(self):
+        """Missing [start, end) intervals."""
+        gaps, position = [], 0
+        for start, end in self.completed:
+            if start > position:
+                gaps.append((position, start))
+            position = max(position, end)
+        if position < self.total_size:
+            gaps.append((position, self.total_size))
+        return gaps
+
+    def initial_split(self, connections):
+        """Cuts the missing bytes into about one range per connection."""
+        target = max(MIN_SPLIT_SIZE, -(-sum(e - s for s, e in self.pending) // max(1, connections)))
+        ranges = deque()
+        for start, end in self.pending:
+            while end - start > target * 1.5:
+                ranges.append((start, start + target))
+                start += target
+            ranges.append((start, end))
+        self.pending = ranges
+
+    def _new_range(self, start, end):
+        rng = {"start": start, "pos": start, "end": end, "failures": 0, "since": (time.monotonic(), start)}
+        self.inflight.append(rng)
+        return rng
+
+    def _rate(self, rng, now):
+        """Bytes/s of the range's current request; None until it has run RATE_WINDOW seconds."""
+        started, pos_then = rng["since"]
+        if now - started < RATE_WINDOW:
+            return None
+        return (rng["pos"] - pos_then) / (now - started)
+
+    def next_range(self):
+        """Queued work first, otherwise the tail of the in-flight range expected to finish last
+        (a stalled connection's range goes first). None when nothing is left."""
+        if self.pending:
+            return self._new_range(*self.pending.popleft())
+        now = time.monotonic()
+        rates = {id(rng): self._rate(rng, now) for rng in self.inflight}
+        known = [rate for rate in rates.values() if rate is not None]
+        typical = sum(known) / len(known) if known else 0.0
+
+        victim, victim_eta = None, 0.0
+        for rng in self.inflight:
+            remaining = rng["end"] - rng["pos"]
+            if remaining < 2 * MIN_SPLIT_SIZE:
+                continue
+            rate = rates[id(rng)] if rates[id(rng)] is not None else typical
+            eta = remaining / max(rate, 1.0)
+            if eta > victim_eta:
+                victim, victim_eta = rng, eta
+        if victim is None:
+            return None
+
+        # The victim keeps what it can finish in the time a typical connection takes for the rest
+        remaining = victim["end"] - victim["pos"]
+        rate = rates[id(victim)] if rates[id(victim)] is not None else typical
+        keep = remaining // 2 if rate + typical <= 0 else int(remaining * rate / (rate + typical))
+        keep = min(max(keep, MIN_SPLIT_SIZE), remaining - MIN_SPLIT_SIZE)
+        rng = self._new_range(victim["pos"] + keep, victim["end"])
+        victim["end"] = victim["pos"] + keep
+        return rng
+
+    def give_back(self, rng):
+        """Returns the unfinished part of a range to the front of the queue (preempted or paused)."""
+        self.inflight.remove(rng)
+        if rng["pos"] < rng["end"]:
+            self.pending.appendleft((rng["pos"], rng["end"]))
+
+    def finish(self, rng):
+        self.inflight.remove(rng)
+
+
+def state_path_for(output_path):
+    return output_path + STATE_SUFFIX
+
+
+def load_resume_state(output_path, url, total_size, validator):
+    """Completed intervals from a previous run of this download, or None if they can't be trusted"""
+    try:
+        with open(state_path_for(output_path), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if not os.path.isfile(output_path) or state.get("total_size") != total_size:
+            return None
+        if state.get("validator") and validator and state["validator"] != validator:
+            return None  # File changed on the server
+        if state.get("url") != url and not (state.get("validator") and validator):
+            return None
+        return [(int(start), int(end)) for start, end in state.get("completed", [])
+                if 0 <= int(start) < int(end) <= total_size]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_resume_state(output_path, url, total_size, validator, completed):
+    state_path = state_path_for(output_path)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"url": url, "total_size": total_size, "validator": validator, "completed": completed}, f)
+    os.replace(tmp_path, state_path)
+
+
+def remove_resume_state(output_path):
+    try:
+        os.remove(state_path_for(output_path))
+    except OSError:
+        pass
 
 
 @PromptServer.instance.routes.post("/server_download/start")
@@ -81,18 +423,24 @@ async def start_download(request):
                 status=400
             )
 
-        # Check if file already exists
-        if os.path.exists(output_path):
+        # Check if file already exists (a partial download with resume state is continued instead)
+        if os.path.exists(output_path) and not os.path.exists(state_path_for(output_path)):
             return web.json_response(
                 {"error": f"File already exists: {output_path}"},
                 status=400
             )
 
+        download_id = f"{save_path}/{safe_filename}"
+        if active_downloads.get(download_id, {}).get("status") in ("queued", "downloading", "paused"):
+            return web.json_response(
+                {"error": f"Download already in progress: {download_id}"},
+                status=400
+            )
+
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
         # Mark as queued
-        download_id = f"{save_path}/{safe_filename}"
         active_downloads[download_id] = {
             "url": url,
             "filename": safe_filename,
@@ -100,7 +448,7 @@ async def start_download(request):
             "output_path": output_path,
             "progress": 0,
             "status": "queued",
-            "priority": None
+            "priority": json_data.get("priority")  # "low" | "normal" | "high" or int
         }
 
         # Add to queue
@@ -127,93 +475,114 @@ async def start_download(request):
         )
 
 
-async def process_download_queue():
-    """Process the download queue - one download at a time"""
-    global download_queue, current_download_task
+def connections_for_size(total_size, supports_range):
+    """Connections a file can use: small files can't keep 8 range connections busy"""
+    if not supports_range or total_size <= CHUNK_SIZE:
+        return 1
+    return max(1, min(NUM_CONNECTIONS, -(-total_size // BYTES_PER_CONNECTION)))
 
-    # Check if already downloading
-    if current_download_task is not None and not current_download_task.done():
-        logging.info("[RunpodDirect] Download already in progress, waiting...")
-        return  # Already downloading
 
-    if len(download_queue) == 0:
-        logging.info("[RunpodDirect] Queue is empty")
-        return  # Nothing to process
+def connections_in_use():
+    """Connections held by running downloads (one each until their size is known)"""
+    return sum(download_control.get(download_id, {}).get("connections", 1) for download_id in running_downloads)
 
-    # Get next download from queue
-    download_item = download_queue.pop(0)
-    download_id = download_item["download_id"]
-    url = download_item["url"]
-    output_path = download_item["output_path"]
 
-    # Set status to downloading
-    active_downloads[download_id]["status"] = "downloading"
-    active_downloads[download_id]["progress"] = 0
-    active_downloads[download_id]["downloaded"] = 0
+def queued_reserve():
+    """One connection kept back for each queued file that could start now, so small files
+    are packed alongside a big one instead of waiting for it"""
+    return max(0, min(len(download_queue), MAX_CONCURRENT_DOWNLOADS - len(running_downloads)))
 
-    logging.info(f"[RunpodDirect] Starting download {download_id} with {NUM_CONNECTIONS} connections (full speed)")
 
-    # Notify frontend that download is starting
-    await PromptServer.instance.send("server_download_progress", {
-        "download_id": download_id,
-        "progress": 0,
-        "downloaded": 0,
-        "total": 0
-    })
+def grant_connections(download_id, wanted):
+    """Sets how many connections a starting download gets out of the shared budget"""
+    control = download_control[download_id]
+    available = TOTAL_CONNECTIONS - connections_in_use() + control["connections"] - queued_reserve()
+    control["wanted"] = wanted
+    control["connections"] = max(1, min(wanted, available))
+    active_downloads[download_id]["connections"] = control["connections"]
+    return control["connections"]
 
-    # Start download task
-    current_download_task = asyncio.create_task(download_file(url, output_path, download_id))
 
-    # Add completion callback to process next in queue
-    current_download_task.add_done_callback(lambda t: on_download_complete(download_id))
+def grow_downloads():
+    """Hands connections freed by finished files to running downloads that wanted more"""
+    for download_id, control in list(download_control.items()):
+        extra = min(TOTAL_CONNECTIONS - connections_in_use() - queued_reserve(),
+                    control.get("wanted", 0) - control.get("connections", 1))
+        if extra > 0 and control.get("add_workers") is not None:
+            control["add_workers"](extra)
+            active_downloads[download_id]["connections"] = control["connections"]
+            logging.info(f"[RunpodDirect] {download_id} now uses {control['connections']} connections")
 
 
-def on_download_complete(download_id):
-    """Called when a download completes - processes next in queue"""
-    global current_download_task
+async def process_download_queue():
+    """Start queued downloads while there are free download slots and connections"""
+    while (download_queue and len(running_downloads) < MAX_CONCURRENT_DOWNLOADS
+           and connections_in_use() < TOTAL_CONNECTIONS):
+        # Get next download from queue (highest priority first, FIFO within a priority)
+        next_index = 0
+        if download_scheduler is not None:
+            priorities = [download_scheduler.parse_priority(active_downloads[d["download_id"]].get("priority"))
+                          for d in download_queue]
+            next_index = priorities.index(max(priorities))
+        download_item = download_queue.pop(next_index)
+        download_id = download_item["download_id"]
+        url = download_item["url"]
+        output_path = download_item["output_path"]
+
+        # Set status to downloading
+        active_downloads[download_id]["status"] = "downloading"
+        active_downloads[download_id]["progress"] = 0
+        active_downloads[download_id]["downloaded"] = 0
 
-    current_download_task = None
-    logging.info(f"[RunpodDirect] Download completed: {download_id}, processing next in queue...")
+        # Start download task
+        task = asyncio.create_task(download_file(url, output_path, download_id))
+        running_downloads[download_id] = task
 
-    # Process next in queue
-    asyncio.create_task(process_download_queue())
+        # Add completion callback to process next in queue
+        task.add_done_callback(lambda t, download_id=download_id: on_download_complete(download_id))
 
+        logging.info(f"[RunpodDirect] Starting download {download_id} ({len(running_downloads)} of {MAX_CONCURRENT_DOWNLOADS} running)")
 
-async def download_chunk(session, url, start, end, output_path, chunk_index, download_id):
-    """Download a specific chunk of the file"""
-    headers = {'Range': f'bytes={start}-{end}'}
+        # Notify frontend that download is starting
+        await PromptServer.instance.send("server_download_progress", {
+            "download_id": download_id,
+            "progress": 0,
+            "downloaded": 0,
+            "total": 0
+        })
 
-    try:
-        async with session.get(url, headers=headers) as response:
-            if response.status not in [200, 206]:
-                return None
+    if download_queue:
+        logging.info(f"[RunpodDirect] {len(download_queue)} queued, waiting for a free download slot")
+    grow_downloads()
 
-            chunk_data = await response.read()
 
-            # Write chunk to file at specific position
-            with open(output_path, 'r+b') as f:
-                f.seek(start)
-                f.write(chunk_data)
+def on_download_complete(download_id):
+    """Called when a download completes - processes next in queue"""
+    running_downloads.pop(download_id, None)
+    logging.info(f"[RunpodDirect] Download completed: {download_id}, processing next in queue...")
 
-            return len(chunk_data)
-    except Exception as e:
-        logging.error(f"Error downloading chunk {chunk_index} for {download_id}: {e}")
-        return None
+    # Process next in queue
+    asyncio.create_task(process_download_queue())
 
 
 async def download_file(url, output_path, download_id):
     """Download file with multi-connection support and progress tracking"""
-    import aiohttp
-
-    logging.info(f"[RunpodDirect] Download {download_id} using {NUM_CONNECTIONS} connections (full speed)")
+    logging.info(f"[RunpodDirect] Download {download_id} started")
 
+    loop_lag.acquire()
+    started = time.monotonic()
     try:
         # Initialize control for this download
         download_control[download_id] = {
             "paused": False,
             "cancelled": False,
-            "total_downloaded": 0,  # Shared counter for all chunks
-            "lock": asyncio.Lock()   # Lock for thread-safe updates
+            "total_downloaded": 0,  # Bytes on disk (or queued for it) across all connections
+            "job": None,             # Shared scheduler job (connection slots + bandwidth)
+            "writer": None,          # FileWriter (disk I/O off the event loop)
+            "last_progress": 0.0,    # When progress was last sent
+            "connections": 1,        # Share of TOTAL_CONNECTIONS granted to this file
+            "wanted": 1,             # Connections its size could use
+            "add_workers": None      # Starts extra range workers when connections free up
         }
 
         timeout = aiohttp.ClientTimeout(total=None)
@@ -221,6 +590,7 @@ async def download_file(url, output_path, download_id):
             # Get file size - try HEAD first, then fall back to GET with Range
             total_size = 0
             supports_range = False
+            validator = None  # ETag / Last-Modified: a resumed download must still match the server's file
 
             try:
                 # Try HEAD request first
@@ -228,6 +598,7 @@ async def download_file(url, output_path, download_id):
                     if response.status == 200:
                         total_size = int(response.headers.get('content-length', 0))
                         supports_range = response.headers.get('accept-ranges') == 'bytes'
+                        validator = response.headers.get('etag') or response.headers.get('last-modified')
             except Exception as e:
                 logging.warning(f"HEAD request failed for {download_id}: {e}")
 
@@ -246,6 +617,7 @@ async def download_file(url, output_path, download_id):
                                 if len(parts) == 2:
                                     total_size = int(parts[1])
                                     supports_range = True
+                                    validator = response.headers.get('etag') or response.headers.get('last-modified')
 
                             # Fallback to Content-Length
                             if total_size == 0:
@@ -258,48 +630,58 @@ async def download_file(url, output_path, download_id):
 
             logging.info(f"File size for {download_id}: {total_size} bytes, supports range: {supports_range}")
 
-            # Create file with full size
-            with open(output_path, 'wb') as f:
-                f.seek(total_size - 1)
-                f.write(b'\0')
-
-            active_downloads[download_id]["total"] = total_size
-            active_downloads[download_id]["downloaded"] = 0
-
             # Use multi-connection download if server supports range requests
-            if supports_range and total_size > CHUNK_SIZE:
-                logging.info(f"Using {NUM_CONNECTIONS} connections for {download_id}")
-
-                # Calculate chunk ranges
-                chunk_size = total_size // NUM_CONNECTIONS
-                tasks = []
-
-                for i in range(NUM_CONNECTIONS):
-                    start = i * chunk_size
-                    end = start + chunk_size - 1 if i < NUM_CONNECTIONS - 1 else total_size - 1
+            use_ranges = supports_range and total_size > CHUNK_SIZE
+            completed = load_resume_state(output_path, url, total_size, validator) if use_ranges else None
 
-                    tasks.append(download_chunk_with_progress(
-                        session, url, start, end, output_path, i, download_id, total_size
-                    ))
+            # Create file with full size (sparse; all file I/O runs on the writer thread)
+            writer = FileWriter(output_path, asyncio.get_running_loop())
+            download_control[download_id]["writer"] = writer
+            if completed is None:
+                remove_resume_state(output_path)
+                await writer.truncate(total_size)
 
-                # Download all chunks in parallel
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-
-                # Check for errors
-                for result in results:
-                    if isinstance(result, Exception):
-                        raise result
+            ranges = RangeManager(total_size, completed) if use_ranges else None
+            active_downloads[download_id]["total"] = total_size
+            active_downloads[download_id]["downloaded"] = ranges.done_bytes if ranges else 0
+            if ranges is not None and ranges.done_bytes:
+                logging.info(f"[RunpodDirect] Resuming {download_id}: {ranges.done_bytes} of {total_size} bytes already on disk")
+
+            if download_scheduler is not None:
+                download_control[download_id]["job"] = download_scheduler.scheduler.register(
+                    download_id, source="RunpodDirect",
+                    priority=download_scheduler.parse_priority(active_downloads[download_id].get("priority")),
+                    size=total_size
+                )
+
+            if ranges is not None:
+                wanted = connections_for_size(total_size - ranges.done_bytes, True)
+                connections = grant_connections(download_id, wanted)
+                logging.info(f"Using {connections} of {wanted} connections for {download_id}")
+
+                # Ranges are split further whenever a connection goes idle
+                ranges.initial_split(connections)
+                await download_ranges(session, url, download_id, total_size, validator, ranges)
 
             else:
                 # Fallback to single connection download
                 logging.info(f"Using single connection for {download_id}")
                 await download_single_connection(session, url, output_path, download_id, total_size)
 
+            # Wait until every received byte is on disk
+            await writer.close()
+
             # Check if cancelled
             if download_control[download_id]["cancelled"]:
                 os.remove(output_path)
+                remove_resume_state(output_path)
                 return
 
+            if ranges is not None and ranges.done_bytes != total_size:
+                raise Exception(f"Download incomplete: {ranges.done_bytes} of {total_size} bytes")
+            remove_resume_state(output_path)
+            await report_progress(download_id, total_size, total_size, force=True)
+
             # Mark as complete
             active_downloads[download_id]["status"] = "completed"
             active_downloads[download_id]["progress"] = 100
@@ -313,11 +695,10 @@ async def download_file(url, output_path, download_id):
 
             logging.info(f"Successfully downloaded {download_id} to {output_path}")
 
-            # Cleanup
-            del download_control[download_id]
-
     except Exception as e:
         logging.error(f"Error downloading {download_id}: {e}")
+        if os.path.exists(state_path_for(output_path)):
+            logging.info(f"[RunpodDirect] Partial download of {download_id} kept; starting it again resumes it")
         active_downloads[download_id]["status"] = "error"
         active_downloads[download_id]["error"] = str(e)
 
@@ -326,98 +707,244 @@ async def download_file(url, output_path, download_id):
             "error": str(e)
         })
 
+    finally:
         # Cleanup
-        if download_id in download_control:
-            del download_control[download_id]
-
-
-async def download_chunk_with_progress(session, url, start, end, output_path, chunk_index, download_id, total_size):
-    """Download chunk with progress tracking"""
-    headers = {'Range': f'bytes={start}-{end}'}
-    chunk_size = end - start + 1
-    downloaded = 0
-    last_report_time = 0
+        control = download_control.pop(download_id, None)
+        if control is not None and control["job"] is not None:
+            control["job"].close()
+        if control is not None and control["writer"] is not None:
+            try:
+                await control["writer"].close()
+            except Exception as e:
+                logging.warning(f"[RunpodDirect] Closing {output_path} failed: {e}")
+            writer_stats = f", disk writes {control['writer'].write_time:.2f}s on writer thread"
+        else:
+            writer_stats = ""
+        lag = loop_lag.summary(since=started)
+        loop_lag.release()
+        logging.info(f"[RunpodDirect] Event loop lag during {download_id}: mean {lag['mean_ms']}ms, "
+                     f"p99 {lag['p99_ms']}ms, max {lag['max_ms']}ms{writer_stats}")
+
+
+class RangeRequestError(Exception):
+    """A range request that may succeed when retried (bad status, connection closed early)"""
+
+
+async def report_progress(download_id, downloaded, total_size, force=False):
+    """Publishes progress, at most every PROGRESS_INTERVAL seconds unless forced"""
+    control = download_control[download_id]
+    control["total_downloaded"] = downloaded
+    now = time.monotonic()
+    if not force and now - control["last_progress"] < PROGRESS_INTERVAL:
+        return
+    control["last_progress"] = now
+    progress = (downloaded / total_size) * 100
+    active_downloads[download_id]["progress"] = progress
+    active_downloads[download_id]["downloaded"] = downloaded
 
-    try:
-        async with session.get(url, headers=headers) as response:
-            if response.status not in [200, 206]:
-                raise Exception(f"HTTP {response.status} for chunk {chunk_index}")
+    await PromptServer.instance.send("server_download_progress", {
+        "download_id": download_id,
+        "progress": progress,
+        "downloaded": downloaded,
+        "total": total_size
+    })
 
-            with open(output_path, 'r+b') as f:
-                f.seek(start)
 
-                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                    # Check if paused
-                    while download_control.get(download_id, {}).get("paused", False):
-                        await asyncio.sleep(0.5)
+async def persist_ranges(download_id, url, total_size, validator, ranges):
+    """Saves the completed intervals once every byte in them is on disk"""
+    control = download_control[download_id]
+    completed = [list(interval) for interval in ranges.completed]  # All of these are queued for writing
+    await control["writer"].flush()
+    await asyncio.to_thread(save_resume_state, control["writer"].path, url, total_size, validator, completed)
 
-                    # Check if cancelled
-                    if download_control.get(download_id, {}).get("cancelled", False):
-                        return
 
-                    f.write(chunk)
-                    chunk_len = len(chunk)
-                    downloaded += chunk_len
+async def fetch_range(session, url, download_id, ranges, rng):
+    """One request for the rest of a range.
 
-                    # Update shared progress counter with lock
-                    async with download_control[download_id]["lock"]:
-                        download_control[download_id]["total_downloaded"] += chunk_len
-                        total_downloaded = download_control[download_id]["total_downloaded"]
+    Returns True once the range is complete, False if it stopped early (paused, cancelled,
+    or its connection was handed to a higher-priority download).
+    """
+    control = download_control[download_id]
+    job = control["job"]
+    writer = control["writer"]
+    if rng["pos"] >= rng["end"]:
+        return True
 
-                    # Send progress updates every 100ms to avoid spam (only from chunk 0)
-                    import time
-                    current_time = time.time()
-                    if chunk_index == 0 and (current_time - last_report_time) >= 0.1:
-                        progress = (total_downloaded / total_size) * 100
-                        active_downloads[download_id]["progress"] = progress
-                        active_downloads[download_id]["downloaded"] = total_downloaded
+    rng["since"] = (time.monotonic(), rng["pos"])  # Rate estimate for splitting covers this request only
+    headers = {'Range': f'bytes={rng["pos"]}-{rng["end"] - 1}'}
+    async with session.get(url, headers=headers) as response:
+        # A 200 answer ignores the Range header and starts at byte 0
+        if response.status != 206 and not (response.status == 200 and rng["pos"] == 0):
+            raise RangeRequestError(f"HTTP {response.status} for bytes {rng['pos']}-{rng['end'] - 1}")
 
-                        await PromptServer.instance.send("server_download_progress", {
-                            "download_id": download_id,
-                            "progress": progress,
-                            "downloaded": total_downloaded,
-                            "total": total_size
-                        })
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            # Check if cancelled
+            if control["cancelled"]:
+                return False
+
+            # Never write past the range end; it shrinks when an idle worker splits it
+            chunk = chunk[:rng["end"] - rng["pos"]]
+            offset = rng["pos"]
+            rng["pos"] += len(chunk)
+            await writer.write(offset, chunk)
+            ranges.add_completed(offset, offset + len(chunk))
+            await report_progress(download_id, ranges.done_bytes, ranges.total_size)
+            if rng["pos"] >= rng["end"]:
+                return True
+
+            if job is not None:
+                await job.throttle_async(len(chunk))
+                if job.should_yield():
+                    logging.info(f"[RunpodDirect] Range {rng['pos']}-{rng['end'] - 1} of {download_id} yielding its connection to a higher-priority download")
+                    return False
+            # Paused: drop the request (and its connection slot) until resumed
+            if control["paused"]:
+                return False
+
+    if rng["pos"] < rng["end"]:
+        raise RangeRequestError(f"Connection closed at byte {rng['pos']} (range ends at {rng['end'] - 1})")
+    return True
+
+
+async def range_worker(session, url, download_id, ranges):
+    """One connection: takes ranges until none are left, retrying failed ones with backoff"""
+    control = download_control[download_id]
+    job = control["job"]
+    rng = None  # Kept across retries; other workers can still split it meanwhile
 
-                        last_report_time = current_time
+    try:
+        while not control["cancelled"]:
+            # Check if paused
+            while control["paused"] and not control["cancelled"]:
+                await asyncio.sleep(0.5)
+            if control["cancelled"]:
+                return
 
-    except Exception as e:
-        logging.error(f"Error in chunk {chunk_index} for {download_id}: {e}")
-        raise
+            if job is not None and not await job.acquire_async(should_stop=lambda: control["cancelled"]):
+                return
+            failure = None
+            try:
+                if rng is None:
+                    rng = ranges.next_range()
+                    if rng is None:
+                        return
+                attempt_from = rng["pos"]
+                finished = await fetch_range(session, url, download_id, ranges, rng)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RangeRequestError) as e:
+                failure = e
+            finally:
+                if job is not None:
+                    job.release()
+
+            if failure is None:
+                if finished:
+                    ranges.finish(rng)
+                else:
+                    ranges.give_back(rng)
+                rng = None
+                continue
+
+            # Progress made in this attempt resets the count
+            rng["failures"] = 1 if rng["pos"] > attempt_from else rng["failures"] + 1
+            if rng["failures"] >= RANGE_MAX_ATTEMPTS:
+                raise Exception(f"Bytes {rng['pos']}-{rng['end'] - 1} failed {RANGE_MAX_ATTEMPTS} times in a row: {failure}")
+            delay = min(RANGE_RETRY_BACKOFF_MAX, 2 ** (rng["failures"] - 1)) * random.uniform(0.75, 1.25)
+            logging.warning(f"[RunpodDirect] Range {rng['pos']}-{rng['end'] - 1} of {download_id} failed "
+                            f"(try {rng['failures']}/{RANGE_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {failure}")
+            await asyncio.sleep(delay)
+    finally:
+        if rng is not None and rng in ranges.inflight:
+            ranges.give_back(rng)
+
+
+async def download_ranges(session, url, download_id, total_size, validator, ranges):
+    """Runs the download's granted range workers until every byte is written or a range fails for good.
+    More workers join when other files finish (grow_downloads). Completed intervals are saved
+    every STATE_SAVE_INTERVAL seconds and when the download stops."""
+    control = download_control[download_id]
+    workers = []
+
+    def count_connections(_task=None):
+        # Only workers still running hold a connection; finished ones free theirs for other files
+        control["connections"] = max(1, sum(not task.done() for task in workers))
+
+    def add_workers(count):
+        for _ in range(count):
+            task = asyncio.create_task(range_worker(session, url, download_id, ranges))
+            task.add_done_callback(count_connections)
+            workers.append(task)
+        count_connections()
+
+    async def save_periodically():
+        while True:
+            await asyncio.sleep(STATE_SAVE_INTERVAL)
+            await persist_ranges(download_id, url, total_size, validator, ranges)
+
+    add_workers(control["connections"])
+    control["add_workers"] = add_workers
+    saver = asyncio.create_task(save_periodically())
+    try:
+        # Workers added while waiting are picked up on the next pass
+        while not all(task.done() for task in workers):
+            done, _ = await asyncio.wait([task for task in workers if not task.done()],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+    finally:
+        control["add_workers"] = None
+        for task in workers + [saver]:
+            task.cancel()
+        await asyncio.gather(*workers, saver, return_exceptions=True)
+        if not control["cancelled"] and ranges.done_bytes < total_size:
+            try:
+                await persist_ranges(download_id, url, total_size, validator, ranges)
+            except Exception as e:
+                logging.warning(f"[RunpodDirect] Could not save resume state for {download_id}: {e}")
 
 
 async def download_single_connection(session, url, output_path, download_id, total_size):
     """Fallback single connection download"""
+    job = download_control[download_id]["job"]
+    writer = download_control[download_id]["writer"]
+
+    # A plain GET can't be resumed elsewhere, so it keeps its connection slot until done
+    if job is not None and not await job.acquire_async(should_stop=lambda: download_control[download_id]["cancelled"]):
+        return
+    try:
+        await _stream_single_connection(session, url, writer, download_id, total_size, job)
+    finally:
+        if job is not None:
+            job.release()
+
+
+async def _stream_single_connection(session, url, writer, download_id, total_size, job):
     downloaded_size = 0
 
     async with session.get(url) as response:
         if response.status != 200:
             raise Exception(f"HTTP {response.status}")
 
-        with open(output_path, 'wb') as f:
-            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                # Check if paused
-                while download_control.get(download_id, {}).get("paused", False):
-                    await asyncio.sleep(0.5)
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            # Check if paused
+            while download_control.get(download_id, {}).get("paused", False):
+                await asyncio.sleep(0.5)
 
-                # Check if cancelled
-                if download_control.get(download_id, {}).get("cancelled", False):
-                    return
+            # Check if cancelled
+            if download_control.get(download_id, {}).get("cancelled", False):
+                return
 
-                f.write(chunk)
-                downloaded_size += len(chunk)
+            await writer.write(downloaded_size, chunk)
+            downloaded_size += len(chunk)
+            if job is not None:
+                await job.throttle_async(len(chunk))
 
-                # Update progress
-                progress = (downloaded_size / total_size) * 100
-                active_downloads[download_id]["progress"] = progress
-                active_downloads[download_id]["downloaded"] = downloaded_size
+            # Update progress
+            await report_progress(download_id, downloaded_size, total_size)
 
-                await PromptServer.instance.send("server_download_progress", {
-                    "download_id": download_id,
-                    "progress": progress,
-                    "downloaded": downloaded_size,
-                    "total": total_size
-                })
+    # The file was preallocated to total_size, so a body that ends early must not pass as complete
+    if downloaded_size != total_size:
+        raise Exception(f"Download incomplete: {downloaded_size} of {total_size} bytes")
 
 
 @PromptServer.instance.routes.get("/server_download/status")
@@ -440,6 +967,25 @@ async def get_single_download_status(request):
         )
 
 
+@PromptServer.instance.routes.get("/server_download/metrics")
+async def get_download_metrics(request):
+    """Event loop lag while downloads run, and per-download writer queue state"""
+    writers = {}
+    for download_id, control in list(download_control.items()):
+        writer = control.get("writer")
+        if writer is not None:
+            writers[download_id] = {
+                "queued_bytes": writer.pending,
+                "written_bytes": writer.bytes_written,
+                "write_seconds": round(writer.write_time, 3)
+            }
+    return web.json_response({
+        "loop_lag": loop_lag.summary(),
+        "loop_lag_last_minute": loop_lag.summary(since=time.monotonic() - 60),
+        "writers": writers
+    })
+
+
 @PromptServer.instance.routes.post("/server_download/pause")
 async def pause_download(request):
     """Pause an active download"""
@@ -507,8 +1053,6 @@ async def resume_download(request):
 @PromptServer.instance.routes.post("/server_download/cancel")
 async def cancel_download(request):
     """Cancel an active download"""
-    global download_queue, current_download_task
-
     try:
         json_data = await request.json()
         download_id = json_data.get("download_id")
@@ -0,0 +1,344 @@
+"""
+Shared download scheduler for the download extensions in this ComfyUI install
+(Civicomfy, ComfyUI-RunpodDirect).
+
+Every download registers a job with a priority. Each HTTP connection a job opens takes
+a slot from one global connection budget, and every byte it reads passes through a
+global token bucket (plus an optional per-job one). When a higher-priority job is
+waiting for a slot, the lowest-priority job holding slots is asked to give one back:
+its range worker stops after the current chunk, re-queues the rest of its range and
+waits for a slot again. A small LoRA a queued prompt needs is then not starved by a
+30 GB background checkpoint.
+
+Works from threads and from asyncio tasks. Exactly one scheduler exists per process:
+extensions load this file under SHARED_MODULE_NAME, and ComfyUI's own import of it as
+a custom node module reuses that instance.
+
+Configuration (environment):
+  DOWNLOAD_SCHEDULER_MAX_CONNECTIONS  global connection budget (default 16)
+  DOWNLOAD_SCHEDULER_RATE_LIMIT       global bytes/second, 0 = unlimited (default 0)
+"""
+
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+SHARED_MODULE_NAME = "comfy_download_scheduler"
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 10
+PRIORITY_HIGH = 20
+PRIORITY_NAMES = {
+    "low": PRIORITY_LOW, "background": PRIORITY_LOW,
+    "normal": PRIORITY_NORMAL,
+    "high": PRIORITY_HIGH, "interactive": PRIORITY_HIGH,
+}
+
+DEFAULT_MAX_CONNECTIONS = 16
+WAIT_POLL_INTERVAL = 0.25  # How often a waiting worker checks its stop condition
+
+
+def parse_priority(value: Any, default: int = PRIORITY_NORMAL) -> int:
+    """Accepts an int or one of PRIORITY_NAMES; anything else gives default."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, str) and value.strip().lower() in PRIORITY_NAMES:
+        return PRIORITY_NAMES[value.strip().lower()]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """Byte-rate limiter. reserve() never blocks: it returns how long the caller must wait."""
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self.lock:
+            self.rate = max(0.0, float(rate or 0))
+            self.burst = float(burst) if burst else max(self.rate, 1.0)  # One second of traffic
+            self.tokens = self.burst
+            self.updated = time.monotonic()
+
+    def reserve(self, amount: int) -> float:
+        """Takes amount tokens, going into debt if needed; returns seconds to wait before using them."""
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Waiter:
+    """One worker waiting for a connection slot (thread event or asyncio future)."""
+    __slots__ = ("job", "seq", "granted", "event", "loop", "future")
+
+    def __init__(self, job: "DownloadJob", seq: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.job = job
+        self.seq = seq
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self, granted: bool):
+        """Scheduler lock held."""
+        self.granted = granted
+        if self.event is not None:
+            self.event.set()
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._resolve, granted)
+            except RuntimeError:
+                pass  # Loop closed
+
+    def _resolve(self, granted: bool):
+        if not self.future.done():
+            self.future.set_result(granted)
+
+
+class DownloadJob:
+    """A download's handle on the scheduler. Workers call acquire()/release() around each
+       connection, throttle() for every chunk read, and should_yield() between chunks."""
+
+    def __init__(self, scheduler: "DownloadScheduler", job_id: int, name: str, source: str,
+                 priority: int, size: Optional[int], rate_limit: float):
+        self.scheduler = scheduler
+        self.id = job_id
+        self.name = name
+        self.source = source
+        self.priority = priority
+        self.size = size
+        self.bucket = TokenBucket(rate_limit)
+        self.held = 0
+        self.pending_yields = 0  # Slots the scheduler wants back
+        self.yielding = 0  # Slots a worker agreed to give back but has not released yet
+        self.bytes = 0
+        self.preempted = 0
+        self.closed = False
+        self.created = time.monotonic()
+
+    # --- Connection slots ---
+    def acquire(self, should_stop: Optional[Callable[[], bool]] = None) -> bool:
+        """Blocks until a connection slot is granted. False if the job closed or should_stop()."""
+        waiter = self.scheduler._enqueue(self)
+        while not waiter.event.wait(WAIT_POLL_INTERVAL):
+            if should_stop is not None and should_stop():
+                self.scheduler._abandon(waiter)
+                return False
+        if not waiter.granted:
+            return False
+        if should_stop is not None and should_stop():
+            self.release()
+            return False
+        return True
+
+    async def acquire_async(self, should_stop: Optional[Callable[[], bool]] = None) -> bool:
+        """Async acquire(); task cancellation gives back a slot granted in the meantime."""
+        waiter = self.scheduler._enqueue(self, asyncio.get_running_loop())
+        try:
+            while True:
+                done, _ = await asyncio.wait({waiter.future}, timeout=WAIT_POLL_INTERVAL)
+                if done:
+                    break
+                if should_stop is not None and should_stop():
+                    self.scheduler._abandon(waiter)
+                    return False
+        except asyncio.CancelledError:
+            self.scheduler._abandon(waiter)
+            raise
+        if not waiter.granted:
+            return False
+        if should_stop is not None and should_stop():
+            self.release()
+            return False
+        return True
+
+    def release(self):
+        self.scheduler._release(self)
+
+    def should_yield(self) -> bool:
+        """True once for each slot a higher-priority waiter needs from this job.
+           The caller stops its range after the current chunk and release()s the slot."""
+        if not self.pending_yields:
+            return False
+        with self.scheduler.lock:
+            if self.pending_yields <= 0:
+                return False
+            self.pending_yields -= 1
+            self.yielding += 1
+            self.preempted += 1
+            return True
+
+    # --- Bandwidth ---
+    def _reserve(self, amount: int) -> float:
+        self.bytes += amount
+        return max(self.scheduler.bucket.reserve(amount), self.bucket.reserve(amount))
+
+    def throttle(self, amount: int):
+        delay = self._reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def throttle_async(self, amount: int):
+        delay = self._reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # --- Lifecycle ---
+    def set_priority(self, priority: int):
+        with self.scheduler.lock:
+            self.priority = priority
+            self.scheduler._dispatch()
+
+    def close(self):
+        """Returns every slot still held and fails this job's waiters."""
+        self.scheduler._close(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "name": self.name, "source": self.source, "priority": self.priority,
+            "size": self.size, "connections": self.held, "bytes": self.bytes, "preempted": self.preempted,
+        }
+
+
+class DownloadScheduler:
+    """Global connection budget, bandwidth limit and priority preemption for all downloads."""
+
+    def __init__(self, max_connections: int = DEFAULT_MAX_CONNECTIONS, rate_limit: float = 0):
+        self.lock = threading.Lock()
+        self.max_connections = max(1, int(max_connections))
+        self.bucket = TokenBucket(rate_limit)
+        self.in_use = 0
+        self._jobs: Dict[int, DownloadJob] = {}
+        self._waiters: List[_Waiter] = []
+        self._job_ids = itertools.count(1)
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "DownloadScheduler":
+        def number(name, default):
+            try:
+                return float(os.environ.get(name, default))
+            except ValueError:
+                return default
+        return cls(max_connections=int(number("DOWNLOAD_SCHEDULER_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+                   rate_limit=number("DOWNLOAD_SCHEDULER_RATE_LIMIT", 0))
+
+    def configure(self, max_connections: Optional[int] = None, rate_limit: Optional[float] = None):
+        if rate_limit is not None:
+            self.bucket.set_rate(rate_limit)
+        with self.lock:
+            if max_connections is not None:
+                self.max_connections = max(1, int(max_connections))
+            self._dispatch()
+
+    def register(self, name: str, source: str = "", priority: int = PRIORITY_NORMAL,
+                 size: Optional[int] = None, rate_limit: float = 0) -> DownloadJob:
+        with self.lock:
+            job = DownloadJob(self, next(self._job_ids), name, source, priority, size, rate_limit)
+            self._jobs[job.id] = job
+            return job
+
+    # --- Slot bookkeeping (all below with self.lock held unless noted) ---
+    def _enqueue(self, job: DownloadJob, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Waiter:
+        """Not locked by caller."""
+        waiter = _Waiter(job, next(self._seq), loop)
+        with self.lock:
+            if job.closed:
+                waiter.wake(False)
+            else:
+                self._waiters.append(waiter)
+                self._dispatch()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter):
+        """Not locked by caller. Withdraws a waiter; a slot granted meanwhile is returned."""
+        with self.lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.granted:
+                waiter.granted = False
+                self._give_back(waiter.job)
+            self._dispatch()
+
+    def _release(self, job: DownloadJob):
+        """Not locked by caller."""
+        with self.lock:
+            if job.held > 0:
+                self._give_back(job)
+            self._dispatch()
+
+    def _give_back(self, job: DownloadJob):
+        job.held -= 1
+        self.in_use -= 1
+        job.yielding = max(0, job.yielding - 1)
+
+    def _close(self, job: DownloadJob):
+        """Not locked by caller."""
+        with self.lock:
+            job.closed = True
+            self.in_use -= job.held
+            job.held = 0
+            job.pending_yields = 0
+            job.yielding = 0
+            for waiter in [w for w in self._waiters if w.job is job]:
+                self._waiters.remove(waiter)
+                waiter.wake(False)
+            self._jobs.pop(job.id, None)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grants free slots to waiters by priority (FIFO within a priority), then plans preemption."""
+        self._waiters.sort(key=lambda w: (-w.job.priority, w.seq))
+        while self._waiters and self.in_use < self.max_connections:
+            waiter = self._waiters.pop(0)
+            waiter.job.held += 1
+            self.in_use += 1
+            waiter.wake(True)
+        self._plan_preemption()
+
+    def _plan_preemption(self):
+        """Asks the lowest-priority slot holders to yield one slot per higher-priority waiter."""
+        for job in self._jobs.values():
+            job.pending_yields = 0
+        # Slots already on their way back serve the first waiters
+        in_flight = sum(job.yielding for job in self._jobs.values())
+        for waiter in self._waiters[in_flight:]:
+            victims = [j for j in self._jobs.values()
+                       if j.priority < waiter.job.priority and j.held - j.yielding - j.pending_yields > 0]
+            if not victims:
+                break  # Waiters are sorted; nobody later can preempt either
+            victim = min(victims, key=lambda j: (j.priority, -(j.held - j.yielding - j.pending_yields)))
+            victim.pending_yields += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "max_connections": self.max_connections,
+                "connections_in_use": self.in_use,
+                "rate_limit": self.bucket.rate,
+                "waiting": len(self._waiters),
+                "jobs": [job.snapshot() for job in sorted(self._jobs.values(), key=lambda j: (-j.priority, j.id))],
+            }
+
+
+# One scheduler per process, whichever name this file was imported under
+_shared = sys.modules.get(SHARED_MODULE_NAME)
+scheduler: DownloadScheduler = getattr(_shared, "scheduler", None) or DownloadScheduler.from_env()
+sys.modules.setdefault(SHARED_MODULE_NAME, sys.modules[__name__])
+
+# Loaded by ComfyUI as a (node-less) custom node module
+NODE_CLASS_MAPPINGS = {}
+NODE_DISPLAY_NAME_MAPPINGS = {}